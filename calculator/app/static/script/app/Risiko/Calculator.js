@@ -268,6 +268,36 @@ Risiko.Calculator = Ext.extend(gxp.plugins.Tool, {
             });
         }
 
+        function failed(result, request) {
+            var progressbar = Ext.getCmp('calculateprogress');
+            progressbar.hide();
+            progressbar.reset();
+            Ext.MessageBox.alert('Failed', result.responseText);
+        }
+
+        function poll(result_url) {
+            // The result is returned with status 202 until it is ready
+            Ext.Ajax.request({
+                url: result_url,
+                method: 'GET',
+                success: function(result, request) {
+                    if (result.status == 202) {
+                        setTimeout(function() {
+                            poll(result_url);
+                        }, 1000);
+                    } else {
+                        received(result, request);
+                    }
+                },
+                failure: failed
+            });
+        }
+
+        function queued(result, request) {
+            var data = Ext.decode( result.responseText );
+            poll(data.result_url);
+        }
+
         function calculate() {
             var hazardcombo = Ext.getCmp('hazardcombo');
             var exposurecombo = Ext.getCmp('exposurecombo');
@@ -310,13 +340,8 @@ Risiko.Calculator = Ext.extend(gxp.plugins.Tool, {
                     impact_function: impact_function
                 },
                 method: 'POST',
-                timeout: 1200000, // 20 minutes
-                success: received,
-                failure: function ( result, request) {
-                    progressbar.hide();
-                    progressbar.reset();
-                    Ext.MessageBox.alert('Failed', result.responseText);
-                }
+                success: queued,
+                failure: failed
             });
         }
 
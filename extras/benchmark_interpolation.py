@@ -0,0 +1,56 @@
+"""Benchmark interpolation from raster grids to points
+
+Times one-shot interpolation with interpolate_raster as well as creating
+an InterpolationPlan once and applying it, in double and single precision.
+"""
+
+import sys
+import time
+import numpy
+from impact.engine.interpolation2d import interpolate_raster
+from impact.engine.interpolation2d import InterpolationPlan
+
+
+def benchmark(N, columns=2000, rows=1500):
+    """Time interpolation of N random points on a grid and print the results
+    """
+
+    x = numpy.linspace(100.0, 110.0, columns)
+    y = numpy.linspace(-5.0, 0.0, rows)
+    Z = numpy.random.random((rows, columns))
+
+    points = numpy.zeros((N, 2))
+    points[:, 0] = numpy.random.uniform(99.9, 110.1, N)
+    points[:, 1] = numpy.random.uniform(-5.1, 0.1, N)
+
+    print 'Interpolating %i points on %i x %i grid' % (N, columns, rows)
+
+    t0 = time.time()
+    interpolate_raster(x, y, Z, points)
+    print 'interpolate_raster:         %.2f s' % (time.time() - t0)
+
+    for dtype in ['d', 'f']:
+        t0 = time.time()
+        plan = InterpolationPlan(x, y, points, dtype=dtype)
+        t_plan = time.time() - t0
+
+        t0 = time.time()
+        plan.interpolate_raster(Z)
+        t_apply = time.time() - t0
+
+        print ('Plan (%s): creation %.2f s, application %.2f s'
+               % (numpy.dtype(dtype).name, t_plan, t_apply))
+
+
+def usage():
+    s = 'benchmark_interpolation.py number_of_points'
+    return s
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print usage()
+        sys.exit()
+
+    benchmark(int(sys.argv[1]))
@@ -0,0 +1,73 @@
+"""Benchmark reading of vector data, e.g. a large polygon shapefile
+
+Compares the bulk reader in Vector.read_from_file with the previous
+approach of random access by feature id and reading one vertex at the time.
+"""
+
+import sys
+import time
+from osgeo import ogr
+from impact.storage.vector import Vector
+
+
+def read_by_feature_id(filename):
+    """Read outer rings and attributes one feature and one vertex at a time
+
+    This is how Vector.read_from_file used to work and is kept here
+    as a reference point only.
+    """
+
+    fid = ogr.Open(filename)
+    layer = fid.GetLayerByIndex(0)
+    layer_def = layer.GetLayerDefn()
+    M = layer_def.GetFieldCount()
+
+    geometry = []
+    data = []
+    for i in range(layer.GetFeatureCount()):
+        feature = layer.GetFeature(i)
+        G = feature.GetGeometryRef()
+        if G.GetGeometryType() == ogr.wkbPolygon:
+            G = G.GetGeometryRef(0)
+
+        if G.GetGeometryType() == ogr.wkbPoint:
+            geometry.append((G.GetX(), G.GetY()))
+        else:
+            geometry.append([(G.GetX(j), G.GetY(j))
+                             for j in range(G.GetPointCount())])
+        data.append([feature.GetField(j) for j in range(M)])
+
+    return geometry, data
+
+
+def benchmark(filename):
+    """Time both readers on filename and print the results
+    """
+
+    t0 = time.time()
+    geometry, data = read_by_feature_id(filename)
+    t_ref = time.time() - t0
+    print 'Feature by feature: %i features in %.2f s' % (len(geometry),
+                                                          t_ref)
+
+    t0 = time.time()
+    V = Vector(filename)
+    t_new = time.time() - t0
+    print 'Bulk reader:        %i features in %.2f s' % (len(V), t_new)
+
+    if t_new > 0:
+        print 'Speedup:            %.1f' % (t_ref / t_new)
+
+
+def usage():
+    s = 'benchmark_vector_reading.py filename.shp'
+    return s
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print usage()
+        sys.exit()
+
+    benchmark(sys.argv[1])
@@ -13,17 +13,25 @@ from impact.storage.utilities import unique_filename
 from impact.storage.utilities import bbox_intersection
 from impact.storage.utilities import buffered_bounding_box
 from impact.storage.utilities import is_sequence
+from impact.storage.utilities import grid2windows
+from impact.storage.utilities import read_keywords
 from impact.storage.io import bboxlist2string, bboxstring2list
 from impact.storage.io import check_bbox_string
 from impact.storage.io import get_metadata
+from impact.storage.io import read_layer
+from impact.storage.raster import RasterWriter
+from impact.storage.vector import VectorWriter
+from impact.storage.vector import read_vector_in_chunks
+from impact.storage.vector import split_vector_in_chunks
 from impact.engine.utilities import REQUIRED_KEYWORDS
+from impact.engine.utilities import merge_statistics
 
 import logging
 logger = logging.getLogger('risiko')
 
 
 def calculate_impact(layers, impact_fcn,
-                     comment=''):
+                     comment='', chunk_size=None):
     """Calculate impact levels as a function of list of input layers
 
     Input
@@ -31,9 +39,22 @@ def calculate_impact(layers, impact_fcn,
         elements containing one hazard level one exposure level
 
         layers: List of Raster and Vector layer objects to be used for analysis
+                Vector layers may also be given by filename (see below).
 
         impact_fcn: Function of the form f(layers)
         comment:
+        chunk_size: Optional maximal number of exposure features or
+                    raster pixels to process at a time. This only applies
+                    to impact functions that provide the method run_chunk.
+                    Vector exposure is processed in chunks of features
+                    (see run_in_chunks) and raster layers are processed
+                    in aligned tiles (see run_in_tiles). Otherwise it is
+                    ignored and all data is processed in one go.
+
+                    Vector exposure given by filename is then read from
+                    the file one chunk at a time, so the full layer is
+                    never held in memory. Other vector layers given by
+                    filename are read in full.
 
     Output
         filename of resulting impact layer (GML). Comment is embedded as
@@ -48,25 +69,50 @@ def calculate_impact(layers, impact_fcn,
         2. Layers are equipped with metadata such as names and categories
     """
 
-    # Input checks
-    check_data_integrity(layers)
-
     # Get an instance of the passed impact_fcn
     impact_function = impact_fcn()
-
-    # Pass input layers to plugin
-    F = impact_function.run(layers)
-
-    # Write result and return filename
-    if F.is_raster:
+    in_chunks = (chunk_size is not None and
+                 hasattr(impact_function, 'run_chunk'))
+
+    # Vector layers given by filename are left to run_in_chunks
+    if not in_chunks:
+        layers = [read_if_filename(layer) for layer in layers]
+    filenames = [layer for layer in layers
+                 if isinstance(layer, basestring)]
+
+    # Input checks (see run_in_chunks for chunked vector exposure)
+    if len(filenames) == 0:
+        check_data_integrity(layers)
+
+    if (in_chunks and len(filenames) == 0 and
+        len([layer for layer in layers if layer.is_vector]) == 0):
+        # Pass aligned tiles of raster layers to plugin writing
+        # results as they become available
         extension = '.tif'
-        # use default style for raster
-    else:
+        output_filename = unique_filename(suffix=extension)
+        F = run_in_tiles(layers, impact_function, chunk_size,
+                         output_filename)
+    elif in_chunks:
+        # Pass input layers to plugin chunk by chunk writing
+        # results as they become available
         extension = '.shp'
-        # use default style for vector
+        output_filename = unique_filename(suffix=extension)
+        F = run_in_chunks(layers, impact_function, chunk_size,
+                          output_filename)
+    else:
+        # Pass input layers to plugin
+        F = impact_function.run(layers)
+
+        # Write result and return filename
+        if F.is_raster:
+            extension = '.tif'
+            # use default style for raster
+        else:
+            extension = '.shp'
+            # use default style for vector
 
-    output_filename = unique_filename(suffix=extension)
-    F.write_to_file(output_filename)
+        output_filename = unique_filename(suffix=extension)
+        F.write_to_file(output_filename)
 
     # Generate style as defined by the impact_function
     style = impact_function.generate_style(F)
@@ -77,6 +123,171 @@ def calculate_impact(layers, impact_fcn,
     return output_filename
 
 
+def read_if_filename(layer):
+    """Read layer given by filename
+
+    Input
+        layer: Layer object or filename of layer
+
+    Output
+        Layer object
+    """
+
+    if isinstance(layer, basestring):
+        return read_layer(layer)
+    else:
+        return layer
+
+
+def get_layer_keywords(layer):
+    """Get keywords of layer object or of layer file
+    """
+
+    if isinstance(layer, basestring):
+        basename, _ = os.path.splitext(layer)
+        return read_keywords(basename + '.keywords')
+    else:
+        return layer.get_keywords()
+
+
+def run_in_chunks(layers, impact_function, chunk_size, filename):
+    """Run impact function on vector exposure data one chunk at a time
+
+    Input
+        layers: List of Raster and Vector layer objects. Exactly one of them
+                must be a vector layer with category 'exposure'. Vector
+                layers may be given by the name of their file instead.
+        impact_function: Instance of impact function providing the methods
+                         run_chunk(layers) -> (layer, statistics) and
+                         make_caption(statistics) -> caption
+        chunk_size: Maximal number of exposure features in each chunk
+        filename: Name of vector file where result will be written
+
+    Output
+        Result layer for the last chunk with keyword 'caption' describing
+        the full result. This can be used to generate the style.
+
+    An exposure layer given by filename is read from the file one chunk
+    at a time, so that at most one chunk of exposure and impact features
+    is held in memory at the time. An exposure layer object is split into
+    chunks that are views into its arrays. The result of each chunk is
+    appended to filename and statistics (counts, sums) are added up
+    across chunks before the caption is made. Data integrity of exposure
+    given by filename is checked with its first chunk.
+    """
+
+    # Identify exposure layer
+    exposure = [layer for layer in layers
+                if (isinstance(layer, basestring) or layer.is_vector) and
+                'exposure' in get_layer_keywords(layer).get('category', '')]
+    msg = ('Impact function %s can only be run in chunks if there is '
+           'exactly one vector exposure layer. I got %s'
+           % (impact_function, [str(layer) for layer in layers]))
+    assert len(exposure) == 1, msg
+    E = exposure[0]
+
+    if isinstance(E, basestring):
+        chunks = read_vector_in_chunks(E, chunk_size)
+    else:
+        chunks = split_vector_in_chunks(E, chunk_size)
+
+    # Other layers are needed in full
+    layers = [layer if layer is E else read_if_filename(layer)
+              for layer in layers]
+
+    writer = None
+    statistics = None
+    for chunk in chunks:
+
+        # Substitute this chunk for the exposure layer
+        chunk_layers = []
+        for layer in layers:
+            if layer is E:
+                chunk_layers.append(chunk)
+            else:
+                chunk_layers.append(layer)
+
+        # Layers given by objects were checked by calculate_impact
+        if writer is None and isinstance(E, basestring):
+            check_data_integrity(chunk_layers)
+
+        F, chunk_statistics = impact_function.run_chunk(chunk_layers)
+        statistics = merge_statistics(statistics, chunk_statistics)
+
+        if writer is None:
+            writer = VectorWriter(filename,
+                                  projection=F.projection,
+                                  geometry_type=F.geometry_type)
+        writer.write(F)
+
+    msg = 'Exposure layer %s did not have any features' % E
+    assert writer is not None, msg
+
+    # Caption is made from statistics for all chunks
+    F.keywords = F.get_keywords().copy()
+    F.keywords['caption'] = impact_function.make_caption(statistics)
+    writer.close(keywords=F.keywords)
+
+    return F
+
+
+def run_in_tiles(layers, impact_function, tile_size, filename):
+    """Run impact function on raster layers one tile at a time
+
+    Input
+        layers: List of aligned Raster layer objects
+        impact_function: Instance of impact function providing the methods
+                         run_chunk(layers) -> (layer, statistics) and
+                         make_caption(statistics) -> caption
+        tile_size: Maximal number of pixels in each tile
+        filename: Name of raster file where result will be written
+
+    Output
+        Result layer for the last tile with keyword 'caption' describing
+        the full result. This can be used to generate the style.
+
+    The same block of pixels is taken from each input layer and passed to
+    the impact function, so that only one tile of input, temporary and
+    result arrays are held in memory at the time. The result of each tile
+    is written into its window of filename and statistics (counts, sums)
+    are added up across tiles before the caption is made.
+
+    Impact functions that provide the method make_keywords(statistics)
+    can supply further keywords computed from statistics for all tiles.
+    """
+
+    # Use first layer as reference for the grid (layers are aligned,
+    # see check_data_integrity)
+    R = layers[0]
+    columns = R.columns
+    rows = R.rows
+
+    writer = None
+    statistics = None
+    for window in grid2windows(columns, rows, tile_size):
+        tile_layers = [layer.get_tile(window) for layer in layers]
+
+        F, tile_statistics = impact_function.run_chunk(tile_layers)
+        statistics = merge_statistics(statistics, tile_statistics)
+
+        if writer is None:
+            writer = RasterWriter(filename,
+                                  projection=F.get_projection(),
+                                  geotransform=R.get_geotransform(),
+                                  columns=columns,
+                                  rows=rows)
+        writer.write(F, window)
+
+    # Caption is made from statistics for all tiles
+    F.keywords = F.get_keywords().copy()
+    if hasattr(impact_function, 'make_keywords'):
+        F.keywords.update(impact_function.make_keywords(statistics))
+    F.keywords['caption'] = impact_function.make_caption(statistics)
+    writer.close(keywords=F.keywords)
+
+    return F
+
+
 def check_data_integrity(layer_files):
     """Read list of layer files and verify that that they have correct keywords
     as well as the same projection and georeferencing.
@@ -179,8 +390,6 @@ def check_data_integrity(layer_files):
     # Then check for alignment
     for layer in layer_files:
         if layer.is_raster:
-            data = layer.get_data()
-
             msg = ('Rasters are not aligned!\n'
                    'Raster %s has %i rows but raster %s has %i rows\n'
                    'Refer to issue #102' % (layer.get_name(),
@@ -5,12 +5,106 @@ using the underlying interpolation algorithm in interpolate2d.py
 """
 
 import numpy
-from impact.engine.interpolation2d import interpolate_raster
+import weakref
+import threading
+from impact.engine.interpolation2d import InterpolationPlan
+from impact.engine.zonal_statistics import zonal_statistics
 from impact.storage.vector import Vector
 from impact.storage.vector import convert_polygons_to_centroids
 
+# Interpolation plans kept for reuse, most recently used first, and their
+# maximal total size in bytes (see get_interpolation_plan)
+PLAN_CACHE_BYTES = 256 * 1024 ** 2
+plan_cache = []
+plan_cache_lock = threading.Lock()
 
-def interpolate_raster_vector_points(R, V, name=None):
+
+def get_plan_size(plan):
+    """Get number of bytes held by arrays of interpolation plan
+    """
+
+    size = 0
+    for value in plan.__dict__.values():
+        if isinstance(value, numpy.ndarray):
+            size += value.nbytes
+    return size
+
+
+def get_interpolation_plan(R, V, mode='linear', source=None):
+    """Get interpolation plan from grid of raster layer to points
+
+    Input
+        R: Raster data set (grid)
+        V: Vector data set (points)
+        mode: Interpolation mode (see interpolate2d)
+        source: Optional layer the points of V are derived from, e.g. the
+                polygon layer whose centroids V holds. Default is V.
+
+    Output
+        InterpolationPlan for the grid of R and the points of V
+
+    Plans are cached by grid geometry (geotransform and dimensions) and
+    the identity of source, so that the same exposure points sampled
+    against several hazard layers on the same grid reuse the neighbours
+    and weights computed for the first one without looking at the
+    coordinates again. Keying on the source layer lets the plan be reused
+    when the points are derived anew for each call. Layers must therefore
+    not be modified in place.
+
+    When a plan is added, plans of layers that no longer exist are
+    dropped and so are the least recently used plans beyond a total of
+    PLAN_CACHE_BYTES.
+    """
+
+    if source is None:
+        source = V
+
+    key = (tuple(R.get_geotransform()), R.rows, R.columns, mode, id(source))
+    ref = weakref.ref(source)
+
+    plan_cache_lock.acquire()
+    try:
+        for i, (entry_key, entry_ref, plan, size) in enumerate(plan_cache):
+            # Identities of layers that no longer exist may be reused
+            if entry_ref() is None:
+                continue
+
+            if entry_key == key:
+                # Move to front as most recently used
+                plan_cache.insert(0, plan_cache.pop(i))
+                return plan
+    finally:
+        plan_cache_lock.release()
+
+    # Compute plan without holding the lock
+    coordinates = numpy.array(V.get_geometry(), dtype='d', copy=False)
+    longitudes, latitudes = R.get_geometry()
+    plan = InterpolationPlan(longitudes, latitudes, coordinates, mode=mode)
+
+    plan_cache_lock.acquire()
+    try:
+        # Drop plans of layers that no longer exist and keep the most
+        # recently used ones within the size limit
+        entries = [(key, ref, plan, get_plan_size(plan))]
+        for entry in plan_cache:
+            if entry[1]() is not None and entry[0] != key:
+                entries.append(entry)
+
+        total = 0
+        plan_cache[:] = []
+        for entry in entries:
+            total += entry[3]
+            if total > PLAN_CACHE_BYTES:
+                break
+            plan_cache.append(entry)
+    finally:
+        plan_cache_lock.release()
+
+    return plan
+
+
+def interpolate_raster_vector_points(R, V, name=None, mode='linear',
+                                     source=None):
     """Interpolate from raster layer to point data
 
     Input
@@ -18,6 +112,9 @@ def interpolate_raster_vector_points(R, V, name=None):
         V: Vector data set (points)
         name: Name for new attribute.
               If None (default) the name of R is used
+        mode: Interpolation mode 'linear' (default) or 'constant'
+        source: Optional layer the points of V are derived from
+                (see get_interpolation_plan)
 
     Output
         I: Vector data set; points located as V with values interpolated from R
@@ -33,11 +130,8 @@ def interpolate_raster_vector_points(R, V, name=None):
     assert V.is_vector
     assert V.is_point_data
 
-    # Get raster data and corresponding x and y axes
+    # Get raster data
     A = R.get_data(nan=True)
-    longitudes, latitudes = R.get_geometry()
-    assert len(longitudes) == A.shape[1]
-    assert len(latitudes) == A.shape[0]
 
     # Get vector point geometry as Nx2 array
     coordinates = numpy.array(V.get_geometry(),
@@ -45,23 +139,49 @@ def interpolate_raster_vector_points(R, V, name=None):
                               copy=False)
 
     # Interpolate and create new attribute
-    N = len(V)
-    attributes = []
     if name is None:
         name = R.get_name()
 
-    values = interpolate_raster(longitudes, latitudes, A,
-                                coordinates, mode='linear')
+    plan = get_interpolation_plan(R, V, mode=mode, source=source)
+    values = plan.interpolate_raster(A)
 
-    # Create list of dictionaries for this attribute and return
-    for i in range(N):
-        attributes.append({name: values[i]})
-
-    return Vector(data=attributes, projection=V.get_projection(),
+    # Create new vector layer with interpolated values as one column
+    return Vector(data={name: values}, projection=V.get_projection(),
                   geometry=coordinates)
 
 
-def interpolate_raster_vector(R, V, name=None):
+def interpolate_raster_vector_polygons(R, V, name=None, mode='average'):
+    """Aggregate raster layer over polygon data
+
+    Input
+        R: Raster data set (grid)
+        V: Vector data set (polygons)
+        name: Name for new attribute.
+              If None (default) the name of R is used
+        mode: Statistic 'sum', 'average' (default) or 'max' of the pixels
+              in each polygon (see zonal_statistics)
+
+    Output
+        I: Vector data set; polygons as V with values aggregated from R
+    """
+
+    # Input checks
+    assert R.is_raster
+    assert V.is_vector
+    assert V.is_polygon_data
+
+    coordinates, offsets = V.get_packed_geometry()
+    values = zonal_statistics(R, coordinates, offsets, mode=mode)
+
+    if name is None:
+        name = R.get_name()
+
+    return Vector(data={name: values}, projection=V.get_projection(),
+                  geometry=coordinates, offsets=offsets,
+                  geometry_type=V.geometry_type)
+
+
+def interpolate_raster_vector(R, V, name=None, mode='linear'):
     """Interpolate from raster layer to vector data
 
     Input
@@ -69,22 +189,39 @@ def interpolate_raster_vector(R, V, name=None):
         V: Vector data set (points or polygons)
         name: Name for new attribute.
               If None (default) the name of R is used
+        mode: Interpolation mode. Either 'linear' (default) or 'constant'
+              for interpolation to points, or 'sum', 'average' or 'max'
+              for statistics over polygons (see zonal_statistics).
 
     Output
-        I: Vector data set; points located as V with values interpolated from R
+        I: Vector data set; points located as V with values interpolated
+           from R, or polygons as V for the statistics modes.
 
-    Note: If target geometry is polygon, data will be interpolated to
-    its centroids and the output is a point data set.
+    Note: If target geometry is polygon and mode is 'linear' or 'constant',
+    data will be interpolated to its centroids and the output is a point
+    data set.
     """
 
     # Input checks
     assert R.is_raster
     assert V.is_vector
 
+    if mode in ['sum', 'average', 'max']:
+        msg = ('Mode %s requires polygon data. Layer %s has geometry '
+               'type %s' % (mode, V.get_name(), V.geometry_type))
+        assert V.is_polygon_data, msg
+        return interpolate_raster_vector_polygons(R, V, name=name, mode=mode)
+
+    msg = ('Interpolation mode to points must be either "linear" or '
+           '"constant". I got %s' % mode)
+    assert mode in ['linear', 'constant'], msg
+
     if V.is_polygon_data:
-        # Use centroids, in case of polygons
+        # Use centroids, in case of polygons. They are computed for each
+        # call so plans are keyed on the polygon layer.
         P = convert_polygons_to_centroids(V)
     else:
         P = V
 
-    return interpolate_raster_vector_points(R, P, name=name)
+    return interpolate_raster_vector_points(R, P, name=name, mode=mode,
+                                            source=V)
@@ -13,6 +13,9 @@ See end of this file for documentation of the mathematical derivation used.
 
 import numpy
 
+# Number of points processed at a time by InterpolationPlan
+BLOCK_SIZE = 65536
+
 
 def interpolate2d(x, y, Z, points, mode='linear', bounds_error=False):
     """Fundamental 2D interpolation routine
@@ -46,92 +49,322 @@ def interpolate2d(x, y, Z, points, mode='linear', bounds_error=False):
         data is typically organised with longitudes (x) going from left to
         right and latitudes (y) from left to right then user
         interpolate_raster in this module
+
+        To interpolate many arrays Z on the same mesh to the same points,
+        use InterpolationPlan directly.
     """
 
-    # Input checks
-    x, y, Z, xi, eta = check_inputs(x, y, Z, points, mode, bounds_error)
+    # Find neighbours and weights and apply them to Z (with input checks)
+    plan = InterpolationPlan(x, y, points, mode=mode,
+                             bounds_error=bounds_error)
+    return plan.interpolate(Z)
 
-    # If there is only one pixel, assign that value to all points
-    #if len(x) == 1 and len(y) == 1:
-    #    return numpy.array([Z[0, 0]] * len(points))
 
-    # Identify elements that are outside interpolation domain or NaN
-    outside = (xi < x[0]) + (eta < y[0]) + (xi > x[-1]) + (eta > y[-1])
-    outside += numpy.isnan(xi) + numpy.isnan(eta)
+class InterpolationPlan:
+    """Precomputed interpolation from a mesh to a set of points
 
-    inside = -outside
-    xi = xi[inside]
-    eta = eta[inside]
+    The neighbours and weights of each point only depend on the mesh and
+    the points. They are computed once by the constructor and can then be
+    applied to any number of arrays Z defined on the mesh, e.g.
 
-    # Find upper neighbours for each interpolation point
-    idx = numpy.searchsorted(x, xi, side='left')
-    idy = numpy.searchsorted(y, eta, side='left')
+        plan = InterpolationPlan(x, y, points)
+        for Z in arrays:
+            values = plan.interpolate(Z)
+
+    See interpolate2d for the meaning of the arguments. In addition
+
+        dtype: Floating point type of the stored weights and of the
+               interpolated values. Use 'f' (float32) to halve the memory
+               used for large point sets. Default is 'd' (float64).
+
+    If the mesh is equally spaced, as is the case for raster data, the
+    neighbours are computed arithmetically rather than searched for.
+    Points are processed in blocks of BLOCK_SIZE so that temporary arrays
+    stay small for large point sets.
+    """
+
+    def __init__(self, x, y, points, mode='linear', bounds_error=False,
+                 dtype='d'):
+        """Find neighbours and weights for each interpolation point
+        """
+
+        # Input checks
+        x, y, xi, eta = check_mesh_and_points(x, y, points, mode,
+                                              bounds_error)
+
+        dtype = numpy.dtype(dtype)
+        msg = 'Argument dtype must be a floating point type. I got %s' % dtype
+        assert dtype.kind == 'f', msg
+
+        N = len(xi)
+        self.mode = mode
+        self.dtype = dtype
+        self.shape = (len(x), len(y))
+        self.number_of_points = N
+
+        # Spacing if mesh is regular (otherwise None)
+        x_spacing = get_regular_spacing(x)
+        y_spacing = get_regular_spacing(y)
+
+        # If there is only one pixel, assign that value to all points
+        #if len(x) == 1 and len(y) == 1:
+        #    return numpy.array([Z[0, 0]] * len(points))
+
+        self.outside = numpy.zeros(N, dtype=bool)
+        self.idx = numpy.zeros(N, dtype='i4')
+        self.idy = numpy.zeros(N, dtype='i4')
+        if mode == 'linear':
+            self.alpha = numpy.zeros(N, dtype=dtype)
+            self.beta = numpy.zeros(N, dtype=dtype)
+            self.alpha_beta = numpy.zeros(N, dtype=dtype)
+
+        for start in range(0, N, BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+            xi_block = xi[block]
+            eta_block = eta[block]
+
+            # Identify elements that are inside interpolation domain
+            # (comparisons with NaN are False)
+            inside = xi_block >= x[0]
+            inside &= xi_block <= x[-1]
+            inside &= eta_block >= y[0]
+            inside &= eta_block <= y[-1]
+
+            # Find upper neighbours for each interpolation point and
+            # coefficients for weighting between lower and upper bounds
+            idx, alpha = find_neighbours(x, xi_block, inside, x_spacing)
+            idy, beta = find_neighbours(y, eta_block, inside, y_spacing)
+
+            if mode == 'linear':
+                # Keep indices of neighbours and weights for equation (5)
+                self.idx[block] = idx
+                self.idy[block] = idy
+                self.alpha[block] = alpha
+                self.beta[block] = beta
+                self.alpha_beta[block] = alpha * beta
+            else:
+                # Piecewise constant (as verified in input_check)
+                # so keep index of nearest neighbour only
+                self.idx[block] = idx - (alpha < 0.5)
+                self.idy[block] = idy - (beta < 0.5)
+
+            self.outside[block] = numpy.logical_not(inside)
+
+    def interpolate(self, Z):
+        """Interpolate array defined on the mesh to the points
+
+        Input
+            Z: 2D array of values for each x, y pair of the mesh
+
+        Output
+            1D array with interpolated values for each point
+        """
+
+        Z = check_array(Z, self.shape)
+
+        r = numpy.zeros(self.number_of_points, dtype=self.dtype)
+        for start in range(0, self.number_of_points, BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+            idx = self.idx[block]
+            idy = self.idy[block]
+
+            if self.mode == 'linear':
+                r[block] = self.bilinear(Z[idx - 1, idy - 1],
+                                         Z[idx - 1, idy],
+                                         Z[idx, idy - 1],
+                                         Z[idx, idy], block)
+            else:
+                # Nearest neighbour
+                r[block] = Z[idx, idy]
+
+        return self.finalise(r, Z)
+
+    def interpolate_raster(self, Z):
+        """Interpolate raster data to the points
+
+        Input
+            Z: Raster data organised as described in interpolate_raster
+               with x the vector of longitudes and y the vector of latitudes
+               used to create this plan.
+
+        Output
+            1D array with interpolated values for each point
+
+        Values are taken directly from the raster rows using flat indices
+        rather than from the flipped and transposed mesh view.
+        """
+
+        Nx, Ny = self.shape
+        if Nx < 2 or Ny < 2:
+            return self.interpolate(raster2mesh(Z))
+
+        Z = numpy.asarray(Z)
+        check_array(Z, (Ny, Nx))
+        flat = numpy.ascontiguousarray(Z).ravel()
+
+        r = numpy.zeros(self.number_of_points, dtype=self.dtype)
+        for start in range(0, self.number_of_points, BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+
+            # Mesh index (i, j) is raster element (Ny - 1 - j, i)
+            k = (Ny - 1) - self.idy[block].astype('i8')
+            k *= Nx
+            k += self.idx[block]
+
+            if self.mode == 'linear':
+                # Neighbour (i - 1, j - 1) is one row down, one column left
+                r[block] = self.bilinear(flat.take(k + (Nx - 1)),
+                                         flat.take(k - 1),
+                                         flat.take(k + Nx),
+                                         flat.take(k), block)
+            else:
+                # Nearest neighbour
+                r[block] = flat.take(k)
+
+        return self.finalise(r, Z)
+
+    def bilinear(self, z00, z01, z10, z11, block):
+        """Evaluate bilinear interpolation formula (5) in place
+
+        Input
+            z00, z01, z10, z11: Values at the four neighbours of the points
+                                in block. They are overwritten.
+            block: Slice of points
+
+        Output
+            Interpolated values for the points in block
+        """
+
+        # Precision used for evaluating the formula
+        work = numpy.promote_types(z00.dtype, self.dtype)
+        z00 = numpy.asarray(z00, dtype=work)
+        z01 = numpy.asarray(z01, dtype=work)
+        z10 = numpy.asarray(z10, dtype=work)
+        z11 = numpy.asarray(z11, dtype=work)
 
-    # Internal check (index == 0 is OK)
-    msg = ('Interpolation point outside domain. This should never happen. '
-           'Please email Ole.Moller.Nielsen@gmail.com')
-    if len(idx) > 0:
-        assert max(idx) < len(x), msg
-    if len(idy) > 0:
-        assert max(idy) < len(y), msg
-
-    # Get the four neighbours for each interpolation point
-    x0 = x[idx - 1]
-    x1 = x[idx]
-    y0 = y[idy - 1]
-    y1 = y[idy]
-
-    z00 = Z[idx - 1, idy - 1]
-    z01 = Z[idx - 1, idy]
-    z10 = Z[idx, idy - 1]
-    z11 = Z[idx, idy]
-
-    # Coefficients for weighting between lower and upper bounds
-    alpha = (xi - x0) / (x1 - x0)
-    beta = (eta - y0) / (y1 - y0)
-
-    if mode == 'linear':
-        # Bilinear interpolation formula
         dx = z10 - z00
         dy = z01 - z00
-        z = z00 + alpha * dx + beta * dy + alpha * beta * (z11 - dx - dy - z00)
+
+        z11 -= dx
+        z11 -= dy
+        z11 -= z00
+        z11 *= self.alpha_beta[block]
+        dx *= self.alpha[block]
+        dy *= self.beta[block]
+
+        z00 += dx
+        z00 += dy
+        z00 += z11
+        return z00
+
+    def finalise(self, r, Z):
+        """Assign NaN to points outside domain and check result
+
+        Input
+            r: Interpolated values for all points
+            Z: Array that was interpolated
+
+        Output
+            r
+        """
+
+        # NaN for values outside
+        r[self.outside] = numpy.nan
+
+        # Self test
+        if len(r) > 0:
+            mz = numpy.nanmax(r)
+            mZ = numpy.array(numpy.nanmax(Z), dtype=self.dtype)
+            msg = ('Internal check failed. Max interpolated value %.15f '
+                   'exceeds max grid value %.15f ' % (mz, mZ))
+            if not(numpy.isnan(mz) or numpy.isnan(mZ)):
+                assert mz <= mZ, msg
+
+        return r
+
+
+def get_regular_spacing(x):
+    """Get spacing of equidistant coordinates
+
+    Input
+        x: 1D array of monotonically increasing coordinates
+
+    Output
+        Spacing dx if x[i] is equal to x[0] + i * dx up to a small fraction
+        of dx (e.g. as generated by numpy.linspace), otherwise None
+    """
+
+    n = len(x)
+    if n < 2:
+        return None
+
+    dx = (x[-1] - x[0]) / (n - 1)
+    if not dx > 0:
+        return None
+
+    deviation = numpy.max(numpy.abs(x - (x[0] + numpy.arange(n) * dx)))
+    if deviation < 0.1 * dx:
+        return dx
     else:
-        # Piecewise constant (as verified in input_check)
+        return None
 
-        # Set up masks for the quadrants
-        left = alpha < 0.5
-        right = -left
-        lower = beta < 0.5
-        upper = -lower
 
-        lower_left = lower * left
-        lower_right = lower * right
-        upper_left = upper * left
+def find_neighbours(x, xi, inside, spacing=None):
+    """Find upper neighbour and weight for each point
 
-        # Initialise result array with all elements set to upper right
-        z = z11
+    Input
+        x: 1D array of monotonically increasing coordinates
+        xi: 1D array of point coordinates
+        inside: 1D boolean array flagging points inside the domain
+        spacing: Spacing of x if it is equidistant (see get_regular_spacing)
+                 or None
 
-        # Then set the other quadrants
-        z[lower_left] = z00[lower_left]
-        z[lower_right] = z10[lower_right]
-        z[upper_left] = z01[upper_left]
+    Output
+        idx: Array of indices such that x[idx - 1] <= xi <= x[idx]
+        alpha: Array of weights (xi - x[idx - 1]) / (x[idx] - x[idx - 1])
 
-    # Self test
-    if len(z) > 0:
-        mz = numpy.nanmax(z)
-        mZ = numpy.nanmax(Z)
-        msg = ('Internal check failed. Max interpolated value %.15f '
-               'exceeds max grid value %.15f ' % (mz, mZ))
-        if not(numpy.isnan(mz) or numpy.isnan(mZ)):
-            assert mz <= mZ, msg
+    If x has at least two elements, idx is at least 1 so that x[idx - 1]
+    is always the lower neighbour. Points outside get idx == 1.
 
-    # Populate result with interpolated values for points inside domain
-    # and NaN for values outside
-    r = numpy.zeros(len(points))
-    r[inside] = z
-    r[outside] = numpy.nan
+    If spacing is given, indices are computed arithmetically rather than
+    by searching x. Weights are computed from x in either case.
+    """
 
-    return r
+    if spacing is None:
+        # Smallest indices i such that x[i] >= xi
+        idx = numpy.searchsorted(x, xi, side='left')
+    else:
+        # Position of points in units of spacing
+        position = xi - x[0]
+        position /= spacing
+        position[numpy.logical_not(inside)] = 0
+
+        # Same as for searchsorted. The estimate is at most one off as
+        # x deviates by less than a tenth of the spacing, so correct it
+        # once in either direction.
+        idx = numpy.ceil(position).astype('i4')
+        numpy.clip(idx, 0, len(x) - 1, out=idx)
+        idx += x[idx] < xi
+        idx -= (idx > 0) & (x[idx - 1] >= xi)
+
+    # Use lower neighbour of first interval for points on the boundary
+    # and a valid index for points outside
+    lower = min(1, len(x) - 1)
+    idx[numpy.logical_not(inside)] = lower
+    numpy.maximum(idx, lower, out=idx)
+
+    # Weights are taken from the actual coordinates as x may deviate
+    # slightly from the equidistant coordinates the indices were
+    # estimated from
+    alpha = (xi - x[idx - 1]) / (x[idx] - x[idx - 1])
+
+    # Internal check
+    msg = ('Interpolation point outside domain. This should never happen. '
+           'Please email Ole.Moller.Nielsen@gmail.com')
+    if len(idx) > 0:
+        assert idx.max() < len(x), msg
+
+    return idx, alpha
 
 
 def interpolate_raster(x, y, Z, points, mode='linear', bounds_error=False):
@@ -147,22 +380,50 @@ def interpolate_raster(x, y, Z, points, mode='linear', bounds_error=False):
     See interpolate2d for details of the interpolation routine
     """
 
+    # Find neighbours and weights and apply them to Z
+    plan = InterpolationPlan(x, y, points, mode=mode,
+                             bounds_error=bounds_error)
+    return plan.interpolate_raster(Z)
+
+
+def raster2mesh(Z):
+    """Organise raster data as required by interpolate2d
+
+    Input
+        Z: Raster data with latitudes from top down along the first
+           dimension and longitudes from west to east along the second
+
+    Output
+        View of Z with longitudes along the first dimension and
+        latitudes from bottom up along the second dimension.
+    """
+
     # Flip matrix Z up-down so that scipy will interpret latitudes correctly.
     Z = numpy.flipud(Z)
 
     # Transpose Z to have y coordinates along the first axis and x coordinates
     # along the second axis
-    Z = Z.transpose()
-
-    # Call underlying interpolation routine and return
-    res = interpolate2d(x, y, Z, points, mode=mode, bounds_error=bounds_error)
-    return res
+    return Z.transpose()
 
 
 def check_inputs(x, y, Z, points, mode, bounds_error):
     """Check inputs for interpolate2d function
     """
 
+    x, y, xi, eta = check_mesh_and_points(x, y, points, mode, bounds_error)
+    Z = check_array(Z, (len(x), len(y)))
+
+    return x, y, Z, xi, eta
+
+
+def check_mesh_and_points(x, y, points, mode, bounds_error):
+    """Check mesh and interpolation points for interpolate2d function
+
+    Output
+        x, y: Mesh coordinates as numpy arrays
+        xi, eta: Coordinates of interpolation points as numpy arrays
+    """
+
     msg = 'Only mode "linear" and "constant" are implemented. I got %s' % mode
     assert mode in ['linear', 'constant'], msg
 
@@ -196,21 +457,6 @@ def check_inputs(x, y, Z, points, mode, bounds_error):
            'max(y) == %.15f, but y[-1] == %.15f' % (max(y), y[-1]))
     assert max(y) == y[-1], msg
 
-    try:
-        Z = numpy.array(Z)
-        m, n = Z.shape
-    except Exception, e:
-        msg = 'Z must be a 2D numpy array: %s' % str(e)
-        raise Exception(msg)
-
-    Nx = len(x)
-    Ny = len(y)
-    msg = ('Input array Z must have dimensions %i x %i corresponding to the '
-           'lengths of the input coordinates x and y. However, '
-           'Z has dimensions %i x %i.' % (Nx, Ny, m, n))
-    assert Nx == m, msg
-    assert Ny == n, msg
-
     # Get interpolation points
     points = numpy.array(points)
     xi = points[:, 0]
@@ -237,7 +483,35 @@ def check_inputs(x, y, Z, points, mode, bounds_error):
         if eta[-1] > y[-1]:
             raise Exception(msg)
 
-    return x, y, Z, xi, eta
+    return x, y, xi, eta
+
+
+def check_array(Z, shape):
+    """Check that Z is a 2D array with dimensions matching the mesh
+
+    Input
+        Z: 2D array of values
+        shape: Tuple (len(x), len(y)) with the size of the mesh
+
+    Output
+        Z as a numpy array (not copied if it already was one)
+    """
+
+    try:
+        Z = numpy.asarray(Z)
+        m, n = Z.shape
+    except Exception, e:
+        msg = 'Z must be a 2D numpy array: %s' % str(e)
+        raise Exception(msg)
+
+    Nx, Ny = shape
+    msg = ('Input array Z must have dimensions %i x %i corresponding to the '
+           'lengths of the input coordinates x and y. However, '
+           'Z has dimensions %i x %i.' % (Nx, Ny, m, n))
+    assert Nx == m, msg
+    assert Ny == n, msg
+
+    return Z
 
 """
 Bilinear interpolation is based on the standard 1D linear interpolation
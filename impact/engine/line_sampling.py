@@ -0,0 +1,157 @@
+"""Sampling of raster data along lines
+
+This module
+* splits all lines of a layer at the grid lines of a raster layer so that
+  each piece lies within one grid cell (grid traversal)
+* assigns each piece the value of the cell it lies in
+* merges consecutive pieces of the same line with the same class into
+  sub-lines (run-length merging)
+
+All lines are processed together using numpy vector operations, so the
+work is proportional to the number of cells crossed by the lines.
+"""
+
+import numpy
+
+
+def sample_raster_along_lines(R, coordinates, offsets):
+    """Split lines at grid cell boundaries and sample raster in each cell
+
+    Input
+        R: Raster layer (north up grid without rotation)
+        coordinates: Mx2 array of vertices of all lines (see pack_geometry)
+        offsets: Integer array of length N + 1 such that the vertices of
+                 line i are coordinates[offsets[i]:offsets[i + 1]]
+
+    Output
+        start, end: Kx2 arrays of start and end points of pieces
+        parent: Array of K indices of the line each piece belongs to
+        values: Array of K values of the cells containing the pieces.
+                NaN where there is no data or the piece is outside R.
+
+    Pieces of each line are listed in order along the line so the end of
+    a piece is the start of the next one of the same line. Pieces of zero
+    length are left out.
+    """
+
+    g = R.get_geotransform()
+    msg = ('Only north up grids without rotation are supported. '
+           'I got geotransform %s' % str(g))
+    assert g[2] == 0 and g[4] == 0, msg
+
+    P = numpy.array(coordinates, dtype='d', copy=False)
+    offsets = numpy.array(offsets, dtype='i8', copy=False)
+    N = len(offsets) - 1
+    M = len(P)
+
+    # Segments between consecutive vertices of the same line
+    counts = numpy.diff(offsets)
+    line = numpy.repeat(numpy.arange(N), counts)
+    valid = numpy.ones(max(M - 1, 0), dtype=bool)
+    last = offsets[1:][counts > 0] - 1
+    valid[last[last < M - 1]] = False
+    valid &= numpy.any(P[1:] != P[:-1], axis=1)
+    seg = numpy.flatnonzero(valid)
+
+    # Vertices in units of grid cells relative to the upper left corner
+    u = (P[:, 0] - g[0]) / g[1]
+    v = (P[:, 1] - g[3]) / g[5]
+
+    # Parameters 0 <= t <= 1 along each segment where it crosses a grid
+    # line. Segment ends are included as t = 0 and t = 1.
+    t = [numpy.zeros(len(seg)), numpy.ones(len(seg))]
+    owner = [numpy.arange(len(seg)), numpy.arange(len(seg))]
+    for w in [u, v]:
+        w0 = w[seg]
+        w1 = w[seg + 1]
+        k0 = numpy.floor(numpy.minimum(w0, w1)).astype('i8') + 1
+        k1 = numpy.ceil(numpy.maximum(w0, w1)).astype('i8')
+        n = numpy.maximum(k1 - k0, 0)
+
+        s = numpy.repeat(numpy.arange(len(seg)), n)
+        k = numpy.arange(len(s)) - numpy.repeat(numpy.cumsum(n) - n, n)
+        k += k0[s]
+        t.append((k - w0[s]) / (w1[s] - w0[s]))
+        owner.append(s)
+
+    t = numpy.concatenate(t)
+    owner = numpy.concatenate(owner)
+    order = numpy.lexsort((t, owner))
+    t = t[order]
+    owner = owner[order]
+
+    # Pieces between consecutive parameters of the same segment
+    I = numpy.flatnonzero((owner[1:] == owner[:-1]) & (t[1:] > t[:-1]))
+    s = owner[I]
+    a = P[seg[s]]
+    d = P[seg[s] + 1] - a
+    start = a + d * t[I, numpy.newaxis]
+    end = a + d * t[I + 1, numpy.newaxis]
+
+    # Use vertices exactly so that pieces of consecutive segments connect
+    first = t[I] == 0
+    start[first] = a[first]
+    final = t[I + 1] == 1
+    end[final] = P[seg[s[final]] + 1]
+    parent = line[seg[s]]
+
+    # Cell containing the middle of each piece
+    middle = (start + end) / 2
+    col = numpy.floor((middle[:, 0] - g[0]) / g[1]).astype('i8')
+    row = numpy.floor((middle[:, 1] - g[3]) / g[5]).astype('i8')
+    inside = (row >= 0) & (row < R.rows) & (col >= 0) & (col < R.columns)
+
+    values = numpy.zeros(len(s), dtype='d')
+    values[:] = numpy.nan
+    K = numpy.flatnonzero(inside)
+    if len(K) > 0:
+        # Read only the block of data crossed by the lines
+        yoff = row[K].min()
+        xoff = col[K].min()
+        A = R.get_data(nan=True, window=(xoff, yoff,
+                                         col[K].max() + 1 - xoff,
+                                         row[K].max() + 1 - yoff))
+        values[K] = A[row[K] - yoff, col[K] - xoff]
+
+    return start, end, parent, values
+
+
+def merge_line_pieces(start, end, parent, classes):
+    """Merge consecutive pieces of the same line and class into lines
+
+    Input
+        start, end, parent: Pieces as returned by sample_raster_along_lines
+        classes: Array with class of each piece
+
+    Output
+        coordinates, offsets: Packed geometry of merged lines
+        runs: Array of indices of the first piece of each merged line.
+              Use e.g. parent[runs] and classes[runs] to get the line and
+              class of each merged line.
+    """
+
+    classes = numpy.asarray(classes)
+    K = len(parent)
+    if K == 0:
+        return (numpy.zeros((0, 2), dtype='d'),
+                numpy.zeros(1, dtype='i8'),
+                numpy.zeros(0, dtype='i8'))
+
+    # A new line starts where line or class changes or pieces are not
+    # connected (such as at lines of zero length)
+    change = parent[1:] != parent[:-1]
+    change |= classes[1:] != classes[:-1]
+    change |= numpy.any(end[:-1] != start[1:], axis=1)
+    runs = numpy.concatenate([[0], numpy.flatnonzero(change) + 1])
+    runs = runs.astype('i8')
+
+    # Vertices are the start points of the pieces followed by the end
+    # point of the last piece of each run
+    last = numpy.concatenate([runs[1:], [K]]) - 1
+    coordinates = numpy.insert(start, last + 1, end[last], axis=0)
+
+    offsets = numpy.zeros(len(runs) + 1, dtype='i8')
+    offsets[:-1] = runs + numpy.arange(len(runs))
+    offsets[-1] = len(coordinates)
+
+    return coordinates, offsets, runs
@@ -0,0 +1,335 @@
+"""Resampling of raster data from one grid to another
+
+This module
+* provides nearest neighbour ('constant'), bilinear ('linear') as well as
+  area weighted 'sum' and 'average' resampling between north up grids
+* exploits that both grids are products of a row and a column axis so
+  indices and weights are computed once per axis rather than per pixel
+* processes the target grid in bands of rows so that only the block of
+  source data overlapping each band is read and held in memory
+
+Nearest neighbour and bilinear resampling follow the conventions of
+interpolate2d with target pixel centres as interpolation points.
+Missing values propagate as NaN and pixels that cannot be interpolated
+are NaN.
+
+Sum and average resampling integrate the source data over the area of
+each target pixel. Sum conserves totals, e.g. of population counts,
+whereas average is suitable for densities and other intensive
+quantities. Missing values are left out of both.
+"""
+
+import numpy
+from impact.engine.interpolation2d import find_neighbours
+
+# Number of target pixels computed at a time
+BLOCK_SIZE = 262144
+
+
+def resample_raster(R, geotransform, columns, rows, mode='linear',
+                    scaling=False):
+    """Resample raster layer to another grid
+
+    Input
+        R: Raster layer
+        geotransform: GDAL geotransform of target grid. Rotation terms must
+                      be zero and the pixel sizes must have the same signs
+                      as those of R.
+        columns, rows: Dimensions of target grid
+        mode: Resampling method. Admissible values are
+              'constant': Nearest neighbour
+              'linear': Bilinear interpolation (default)
+              'sum': Sum of source pixels weighted by the fraction of
+                     their area lying inside each target pixel
+              'average': Area weighted average of source pixels
+        scaling: Scaling applied to the source data (see Raster.get_data)
+
+    Output
+        rows x columns array of resampled data with NaN where no data is
+        available
+    """
+
+    # Input checks
+    msg = ('Only north up grids without rotation can be resampled. '
+           'I got geotransforms %s and %s'
+           % (str(R.get_geotransform()), str(geotransform)))
+    source = R.get_geotransform()
+    assert source[2] == 0 and source[4] == 0, msg
+    assert geotransform[2] == 0 and geotransform[4] == 0, msg
+    assert source[1] * geotransform[1] > 0, msg
+    assert source[5] * geotransform[5] > 0, msg
+
+    msg = ('Resampling mode must be one of "constant", "linear", "sum" '
+           'or "average". I got %s' % mode)
+    assert mode in ['constant', 'linear', 'sum', 'average'], msg
+
+    columns = int(columns)
+    rows = int(rows)
+    msg = ('Target grid must have positive dimensions. I got %i x %i'
+           % (rows, columns))
+    assert columns > 0 and rows > 0, msg
+
+    # Axes as (origin, pixel size, number of pixels)
+    source_x = (source[0], source[1], R.columns)
+    source_y = (source[3], source[5], R.rows)
+    target_x = (geotransform[0], geotransform[1], columns)
+    target_y = (geotransform[3], geotransform[5], rows)
+
+    if mode in ['constant', 'linear']:
+        return interpolate_grid(R, source_x, source_y,
+                                target_x, target_y, mode, scaling)
+    else:
+        return integrate_grid(R, source_x, source_y,
+                              target_x, target_y, mode, scaling)
+
+
+def interpolate_grid(R, source_x, source_y, target_x, target_y, mode,
+                     scaling):
+    """Nearest neighbour or bilinear resampling
+
+    Input
+        R: Raster layer
+        source_x, source_y, target_x, target_y: Axes of source and target
+                                                grids (see get_axis_neighbours)
+        mode: 'constant' or 'linear'
+        scaling: Scaling applied to the source data
+
+    Output
+        Array of resampled data (see resample_raster)
+    """
+
+    ix0, ix1, alpha, inside_x = get_axis_neighbours(source_x, target_x, mode)
+    iy0, iy1, beta, inside_y = get_axis_neighbours(source_y, target_y, mode)
+
+    columns = target_x[2]
+    rows = target_y[2]
+    result = numpy.zeros((rows, columns), dtype='d')
+    result[:] = numpy.nan
+
+    if not numpy.any(inside_x) or not numpy.any(inside_y):
+        return result
+
+    # Source columns needed for all target pixels
+    I = numpy.flatnonzero(inside_x)
+    ix0 = ix0[I]
+    ix1 = ix1[I]
+    alpha = alpha[I]
+    xoff = ix0.min()
+    xsize = ix1.max() + 1 - xoff
+    ix0 -= xoff
+    ix1 -= xoff
+
+    rows_per_block = max(1, BLOCK_SIZE // columns)
+    J = numpy.flatnonzero(inside_y)
+    for start in range(0, len(J), rows_per_block):
+        band = J[start:start + rows_per_block]
+
+        # Source rows needed for this band of target rows
+        yoff = iy0[band].min()
+        ysize = iy1[band].max() + 1 - yoff
+        A = R.get_data(nan=True, scaling=scaling,
+                       window=(xoff, yoff, xsize, ysize))
+
+        if mode == 'linear':
+            # Interpolate between rows and then between columns
+            upper = A[iy0[band] - yoff]
+            lower = A[iy1[band] - yoff]
+            lower -= upper
+            lower *= beta[band][:, numpy.newaxis]
+            upper += lower
+
+            left = upper[:, ix0]
+            right = upper[:, ix1]
+            right -= left
+            right *= alpha
+            left += right
+            values = left
+        else:
+            # Nearest neighbours
+            values = A[iy0[band] - yoff][:, ix0]
+
+        result[band[:, numpy.newaxis], I] = values
+
+    return result
+
+
+def integrate_grid(R, source_x, source_y, target_x, target_y, mode,
+                   scaling):
+    """Area weighted sum or average resampling
+
+    Input
+        R: Raster layer
+        source_x, source_y, target_x, target_y: Axes of source and target
+                                                grids (see get_axis_overlaps)
+        mode: 'sum' or 'average'
+        scaling: Scaling applied to the source data
+
+    Output
+        Array of resampled data (see resample_raster)
+    """
+
+    src_x, tgt_x, weight_x = get_axis_overlaps(source_x, target_x)
+    src_y, tgt_y, weight_y = get_axis_overlaps(source_y, target_y)
+
+    columns = target_x[2]
+    rows = target_y[2]
+    result = numpy.zeros((rows, columns), dtype='d')
+    result[:] = numpy.nan
+
+    if len(src_x) == 0 or len(src_y) == 0:
+        return result
+
+    # Source columns needed for all target pixels
+    xoff = src_x.min()
+    xsize = src_x.max() + 1 - xoff
+    src_x = src_x - xoff
+
+    rows_per_block = max(1, BLOCK_SIZE // columns)
+    for start in range(0, rows, rows_per_block):
+        # Overlaps with this band of target rows
+        I = numpy.flatnonzero((tgt_y >= start) &
+                              (tgt_y < start + rows_per_block))
+        if len(I) == 0:
+            continue
+
+        # Source rows needed for this band
+        yoff = src_y[I].min()
+        ysize = src_y[I].max() + 1 - yoff
+        A = R.get_data(nan=True, scaling=scaling,
+                       window=(xoff, yoff, xsize, ysize))
+
+        # Integrate data and area covered by data, ignoring missing values
+        valid = numpy.logical_not(numpy.isnan(A))
+        A[numpy.logical_not(valid)] = 0
+        totals = []
+        for B in [A, valid.astype('d')]:
+            B = sum_segments(B, src_x, tgt_x, weight_x, columns, axis=1)
+            B = sum_segments(B, src_y[I] - yoff, tgt_y[I] - start,
+                             weight_y[I], min(rows_per_block, rows - start),
+                             axis=0)
+            totals.append(B)
+        S, area = totals
+
+        # Target pixels without any data are NaN
+        missing = area <= 0
+        if mode == 'average':
+            area[missing] = 1
+            S /= area
+        S[missing] = numpy.nan
+
+        result[start:start + S.shape[0]] = S
+
+    return result
+
+
+def get_axis_neighbours(source, target, mode):
+    """Find source neighbours of target pixel centres along one axis
+
+    Input
+        source, target: Axes given as (origin, pixel size, number of pixels)
+        mode: 'constant' or 'linear'
+
+    Output
+        i0, i1: Indices of the lower and upper neighbouring source pixels.
+                For mode 'constant' both are the nearest source pixel.
+        alpha: Weight of the upper neighbour
+        inside: Boolean array flagging target pixels that lie between the
+                outermost source pixel centres
+
+    Positions are measured in units of source pixels along the axis so the
+    source pixel centres are 0, 1, ..., N - 1.
+    """
+
+    origin, spacing, N = source
+    target_origin, target_spacing, M = target
+
+    # Target pixel centres relative to source pixel centres
+    position = target_origin - origin - 0.5 * spacing
+    position += (numpy.arange(M) + 0.5) * target_spacing
+    position /= spacing
+
+    inside = (position >= 0) & (position <= N - 1)
+    idx, alpha = find_neighbours(numpy.arange(N, dtype='d'), position,
+                                 inside.copy(), spacing=1.0)
+
+    # Upper neighbour and lower neighbour which is the same in case of
+    # a single source pixel
+    i1 = idx
+    i0 = numpy.maximum(idx - 1, 0)
+
+    if mode == 'constant':
+        i0 = numpy.where(alpha < 0.5, i0, i1)
+        i1 = i0
+
+    return i0, i1, alpha, inside
+
+
+def get_axis_overlaps(source, target):
+    """Find overlaps between source and target pixels along one axis
+
+    Input
+        source, target: Axes given as (origin, pixel size, number of pixels)
+
+    Output
+        src: Indices of source pixels
+        tgt: Indices of target pixels in non-decreasing order
+        weight: Length of each overlap as a fraction of the source pixel
+
+    Each segment of the axis lying inside both a source and a target pixel
+    is listed once.
+    """
+
+    origin, spacing, N = source
+    target_origin, target_spacing, M = target
+
+    # Target pixel edges in units of source pixels
+    edges = target_origin - origin
+    edges += numpy.arange(M + 1) * target_spacing
+    edges /= spacing
+
+    # Split axis at all edges of both grids within the source
+    breaks = numpy.union1d(numpy.arange(N + 1),
+                           numpy.clip(edges, 0, N))
+    weight = numpy.diff(breaks)
+    middle = breaks[:-1] + weight / 2
+
+    src = numpy.floor(middle).astype('i4')
+    tgt = numpy.searchsorted(edges, middle, side='right') - 1
+
+    I = numpy.flatnonzero((weight > 0) & (tgt >= 0) & (tgt < M) &
+                          (src < N))
+    return src[I], tgt[I], weight[I]
+
+
+def sum_segments(A, src, tgt, weight, M, axis):
+    """Sum weighted source pixels for each target pixel along one axis
+
+    Input
+        A: 2D array of source data
+        src, tgt, weight: Overlaps as returned by get_axis_overlaps
+        M: Number of target pixels along the axis
+        axis: Axis of A corresponding to src (0 for rows, 1 for columns)
+
+    Output
+        Array like A with M elements along axis instead
+    """
+
+    if axis == 0:
+        B = A[src] * weight[:, numpy.newaxis]
+    else:
+        B = A[:, src] * weight
+
+    # Overlaps are grouped by target pixel
+    starts = numpy.flatnonzero(numpy.diff(tgt)) + 1
+    starts = numpy.concatenate([[0], starts])
+    sums = numpy.add.reduceat(B, starts, axis=axis)
+
+    shape = list(A.shape)
+    shape[axis] = M
+    result = numpy.zeros(shape, dtype='d')
+    if axis == 0:
+        result[tgt[starts]] = sums
+    else:
+        result[:, tgt[starts]] = sums
+
+    return result
@@ -8,3 +8,34 @@ MAXFLOAT = float(sys.maxint)
 
 # Mandatory keywords that must be present in layers
 REQUIRED_KEYWORDS = ['category', 'subcategory']
+
+
+def merge_statistics(total, statistics):
+    """Accumulate statistics computed for one part of a calculation
+
+    Input
+        total: Dictionary of statistics accumulated so far or None
+        statistics: Dictionary of statistics (numbers or numpy arrays)
+                    for one chunk or tile
+
+    Output
+        Dictionary with the sum of total and statistics for each key
+
+    This is used to combine counts and sums when impact functions are
+    run in parts (see calculate_impact). Impact functions must therefore
+    report statistics which can be added up, e.g. counts rather than
+    fractions.
+    """
+
+    if total is None:
+        return dict(statistics)
+
+    msg = ('Statistics must have the same keys for all parts. '
+           'I got %s and %s' % (total.keys(), statistics.keys()))
+    assert set(total.keys()) == set(statistics.keys()), msg
+
+    merged = {}
+    for key in total:
+        merged[key] = total[key] + statistics[key]
+
+    return merged
@@ -0,0 +1,187 @@
+"""Statistics of raster data over polygons
+
+This module
+* rasterizes all polygons of a layer in one pass onto the grid of a raster
+  layer using a vectorized scanline algorithm
+* aggregates the pixels of each polygon by sum, average or maximum in one
+  vectorized pass (numpy.bincount and numpy.maximum.reduceat)
+
+A pixel belongs to a polygon if its centre lies inside the polygon.
+Polygons that contain no pixel centre at all, such as building footprints
+smaller than a pixel, are represented by the pixel containing their
+centroid weighted by the fraction of the pixel they cover.
+"""
+
+import numpy
+from impact.storage.utilities import calculate_polygon_moments
+
+
+def rasterize_polygons(coordinates, offsets, geotransform, columns, rows):
+    """Find pixels of grid whose centres lie inside polygons
+
+    Input
+        coordinates: Mx2 array of polygon vertices (see get_packed_geometry)
+        offsets: Integer array of length N + 1 such that the vertices of
+                 polygon i are coordinates[offsets[i]:offsets[i + 1]]
+        geotransform: GDAL geotransform of grid without rotation
+        columns, rows: Dimensions of grid
+
+    Output
+        labels: Array of polygon indices in non-decreasing order
+        I, J: Arrays of row and column indices such that pixel (I[k], J[k])
+              lies inside polygon labels[k]
+
+    Polygons may overlap in which case their common pixels are listed once
+    for each polygon. Rings need not be closed explicitly.
+    """
+
+    msg = ('Only north up grids without rotation are supported. '
+           'I got geotransform %s' % str(geotransform))
+    assert geotransform[2] == 0 and geotransform[4] == 0, msg
+
+    offsets = numpy.asarray(offsets, dtype='i8')
+    N = len(offsets) - 1
+    M = len(coordinates)
+
+    # Vertices in units of pixels relative to the centre of pixel (0, 0)
+    u = (coordinates[:, 0] - geotransform[0]) / geotransform[1] - 0.5
+    v = (coordinates[:, 1] - geotransform[3]) / geotransform[5] - 0.5
+
+    # Edges from each vertex to the next one in the same polygon
+    counts = numpy.diff(offsets)
+    polygon = numpy.repeat(numpy.arange(N), counts)
+    start = numpy.arange(M)
+    end = start + 1
+    last = offsets[1:][counts > 0] - 1
+    end[last] = offsets[:-1][counts > 0]
+
+    # Rows whose centres are crossed by each edge, counting an edge
+    # as crossing at its lower but not its upper end
+    v0 = v[start]
+    v1 = v[end]
+    r0 = numpy.ceil(numpy.minimum(v0, v1)).astype('i8')
+    r1 = numpy.ceil(numpy.maximum(v0, v1)).astype('i8')
+    numpy.clip(r0, 0, rows, out=r0)
+    numpy.clip(r1, 0, rows, out=r1)
+    n = numpy.maximum(r1 - r0, 0)
+
+    # Intersections of edges with row centres
+    edge = numpy.repeat(numpy.arange(M), n)
+    row = numpy.arange(len(edge)) - numpy.repeat(numpy.cumsum(n) - n, n)
+    row += r0[edge]
+
+    u0 = u[start][edge]
+    v0 = v0[edge]
+    slope = (u[end][edge] - u0) / (v1[edge] - v0)
+    x = u0 + (row - v0) * slope
+
+    # Sort by polygon, row and position along the row. Each polygon
+    # crosses each row an even number of times so consecutive pairs of
+    # intersections delimit the parts of the row inside the polygon.
+    polygon = polygon[edge]
+    order = numpy.lexsort((x, row, polygon))
+    x = x[order]
+    row = row[order][0::2]
+    polygon = polygon[order][0::2]
+
+    c0 = numpy.ceil(x[0::2]).astype('i8')
+    c1 = numpy.ceil(x[1::2]).astype('i8')
+    numpy.clip(c0, 0, columns, out=c0)
+    numpy.clip(c1, 0, columns, out=c1)
+    n = numpy.maximum(c1 - c0, 0)
+
+    # Expand spans of columns into pixels
+    span = numpy.repeat(numpy.arange(len(n)), n)
+    J = numpy.arange(len(span)) - numpy.repeat(numpy.cumsum(n) - n, n)
+    J += c0[span]
+
+    return polygon[span], row[span], J
+
+
+def zonal_statistics(R, coordinates, offsets, mode='average'):
+    """Calculate statistics of raster data for each polygon
+
+    Input
+        R: Raster layer
+        coordinates, offsets: Packed polygon geometry in the projection
+                              of R (see rasterize_polygons)
+        mode: Statistic to compute for each polygon. One of
+              'sum': Sum of the pixels in the polygon, e.g. total population
+              'average': Average of the pixels in the polygon (default)
+              'max': Maximum of the pixels in the polygon
+
+    Output
+        Array of values, one for each polygon. Missing values are ignored
+        and polygons without data are NaN.
+    """
+
+    msg = ('Zonal statistics mode must be one of "sum", "average" '
+           'or "max". I got %s' % mode)
+    assert mode in ['sum', 'average', 'max'], msg
+
+    geotransform = R.get_geotransform()
+    N = len(offsets) - 1
+    labels, I, J = rasterize_polygons(coordinates, offsets, geotransform,
+                                      R.columns, R.rows)
+    weights = numpy.ones(len(labels), dtype='d')
+
+    # Use pixel containing centroid for polygons without any pixels
+    empty = numpy.bincount(labels, minlength=N) == 0
+    empty &= numpy.diff(offsets) > 0
+    if numpy.any(empty):
+        area, centroid = calculate_polygon_moments(coordinates, offsets)
+        K = numpy.flatnonzero(empty)
+        c = numpy.floor((centroid[K, 0] - geotransform[0]) / geotransform[1])
+        r = numpy.floor((centroid[K, 1] - geotransform[3]) / geotransform[5])
+        inside = (r >= 0) & (r < R.rows) & (c >= 0) & (c < R.columns)
+        K = K[inside]
+
+        if len(K) > 0:
+            pixel_area = abs(geotransform[1] * geotransform[5])
+            labels = numpy.concatenate([labels, K])
+            I = numpy.concatenate([I, r[inside].astype('i8')])
+            J = numpy.concatenate([J, c[inside].astype('i8')])
+            weights = numpy.concatenate([weights,
+                                         numpy.abs(area[K]) / pixel_area])
+
+            order = numpy.argsort(labels, kind='mergesort')
+            labels = labels[order]
+            I = I[order]
+            J = J[order]
+            weights = weights[order]
+
+    values = numpy.zeros(N, dtype='d')
+    values[:] = numpy.nan
+    if len(labels) == 0:
+        return values
+
+    # Read only the block of data covering the polygons
+    yoff = I.min()
+    xoff = J.min()
+    A = R.get_data(nan=True, window=(xoff, yoff,
+                                     J.max() + 1 - xoff,
+                                     I.max() + 1 - yoff))
+    data = A[I - yoff, J - xoff]
+
+    # Leave out missing values
+    K = numpy.flatnonzero(numpy.logical_not(numpy.isnan(data)))
+    labels = labels[K]
+    data = data[K]
+    weights = weights[K]
+
+    count = numpy.bincount(labels, weights=weights, minlength=N)
+    available = count > 0
+
+    if mode == 'max':
+        # Labels are sorted so each polygon is a contiguous group
+        starts = numpy.flatnonzero(numpy.diff(labels)) + 1
+        starts = numpy.concatenate([[0], starts]).astype('i8')
+        if len(data) > 0:
+            values[labels[starts]] = numpy.maximum.reduceat(data, starts)
+    else:
+        total = numpy.bincount(labels, weights=data * weights, minlength=N)
+        if mode == 'average':
+            total[available] /= count[available]
+        values[available] = total[available]
+
+    return values
@@ -0,0 +1,606 @@
+"""Queue of impact calculations run by a pool of local workers
+
+Calculations requested through the API are stored as Calculation objects
+with status 'queued' and picked up by worker threads of this process.
+The database is the queue, so a worker may also pick up calculations
+submitted by another web server process.
+
+Each calculation passes through the stages listed in STAGES. The stage
+reached and the time it was reached is recorded in the progress field
+of the Calculation object as the work goes along.
+
+The number of worker threads per process is given by the setting
+RISIKO_CALCULATION_WORKERS. If it is 0, calculations are run in the
+thread that submits them.
+
+While a calculation runs, a heartbeat thread of the process running it
+regularly records the time in the heartbeat field. Calculations still
+'running' without a heartbeat for RISIKO_CALCULATION_TIMEOUT seconds
+were abandoned by a process that died and are marked as failed. When a
+process exits, the calculations its workers are running are queued
+again for other or restarted processes.
+"""
+
+import sys
+import atexit
+import inspect
+import datetime
+import threading
+
+from django.utils import simplejson as json
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from impact.storage.io import download_layers, get_metadata
+from impact.storage.io import bboxlist2string
+from impact.storage.io import save_to_geonode
+from impact.plugins.core import get_plugin
+from impact.engine.core import calculate_impact
+from impact.engine.core import get_common_resolution, get_bounding_boxes
+from impact.engine.core import get_linked_layers
+from impact.models import Calculation
+
+from urlparse import urljoin
+
+import logging
+logger = logging.getLogger('risiko')
+
+# Stages of a calculation in the order they are reached.
+# A calculation ends in either 'finished' or 'failed'.
+STAGES = ['queued', 'metadata', 'downloading', 'calculating',
+          'uploading', 'finished', 'failed']
+
+# Worker threads of this process and event used to wake them up
+workers = []
+workers_lock = threading.Lock()
+job_available = threading.Event()
+
+# Ids of calculations run by this process keyed by thread
+running = {}
+
+# Heartbeat thread of this process and event set when the process exits
+heartbeat_thread = None
+stopping = threading.Event()
+
+# Seconds between looking for calculations queued by other processes
+POLL_INTERVAL = 5
+
+# Seconds between heartbeats of running calculations
+HEARTBEAT_INTERVAL = 60
+
+
+class WorkerStopped(Exception):
+    """Raised in a worker when its calculation was queued again because
+    the process is exiting
+    """
+    pass
+
+
+def exception_format(e):
+    """Convert an exception object into a string,
+    complete with stack trace info, suitable for display.
+    """
+    import traceback
+    info = ''.join(traceback.format_tb(sys.exc_info()[2]))
+    return str(e) + '\n\n' + info
+
+
+def record_stage(calculation, stage):
+    """Record that calculation has reached given stage and save it
+
+    Input
+        calculation: Calculation object
+        stage: One of STAGES
+    """
+
+    msg = 'Unknown stage %s. Valid stages are %s' % (stage, STAGES)
+    assert stage in STAGES, msg
+
+    now = datetime.datetime.now()
+    calculation.heartbeat = now
+    calculation.stage = stage
+    calculation.progress += '%s %s\n' % (now.isoformat(), stage)
+    calculation.save()
+
+
+def get_progress(calculation):
+    """Get stages reached by calculation
+
+    Input
+        calculation: Calculation object
+
+    Output
+        List of dictionaries with keys 'stage' and 'time' in the order
+        the stages were reached
+    """
+
+    progress = []
+    for line in calculation.progress.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            progress.append({'time': fields[0], 'stage': fields[1]})
+    return progress
+
+
+def get_status(calculation):
+    """Get status of calculation suitable for the status endpoint
+
+    Input
+        calculation: Calculation object
+
+    Output
+        Dictionary with id, status, stage, progress and errors
+    """
+
+    errors = calculation.errors
+    if not errors:
+        errors = None
+
+    return {'id': calculation.id,
+            'status': calculation.status,
+            'stage': calculation.stage,
+            'progress': get_progress(calculation),
+            'run_duration': calculation.run_duration,
+            'errors': errors}
+
+
+def get_number_of_workers():
+    """Get maximal number of concurrent calculations in this process
+    """
+
+    n = getattr(settings, 'RISIKO_CALCULATION_WORKERS', 2)
+
+    msg = ('Setting RISIKO_CALCULATION_WORKERS must be a non-negative '
+           'integer. I got %s' % str(n))
+    assert isinstance(n, int) and n >= 0, msg
+
+    return n
+
+
+def get_calculation_timeout():
+    """Get seconds without heartbeat before a calculation is abandoned
+    """
+
+    timeout = getattr(settings, 'RISIKO_CALCULATION_TIMEOUT', 600)
+
+    msg = ('Setting RISIKO_CALCULATION_TIMEOUT must be larger than the '
+           'heartbeat interval of %i seconds. I got %s'
+           % (HEARTBEAT_INTERVAL, str(timeout)))
+    assert timeout > HEARTBEAT_INTERVAL, msg
+
+    return timeout
+
+
+def submit(calculation):
+    """Queue calculation to be run by a worker
+
+    Input
+        calculation: Calculation object with input layers, requested_bbox
+                     and impact function filled in
+
+    Output
+        calculation: The same object after it has been saved and queued.
+                     If no workers are configured it has been run.
+    """
+
+    calculation.status = 'queued'
+    calculation.stage = 'queued'
+    calculation.progress = ''
+    record_stage(calculation, 'queued')
+
+    start_workers()
+    if get_number_of_workers() == 0:
+        claim_calculation(calculation.id)
+        run_calculation(calculation)
+    else:
+        job_available.set()
+
+    return calculation
+
+
+def start_workers():
+    """Start heartbeat and worker threads of this process unless they are
+    running
+    """
+
+    global heartbeat_thread
+
+    workers_lock.acquire()
+    try:
+        if heartbeat_thread is None or not heartbeat_thread.isAlive():
+            heartbeat_thread = threading.Thread(target=beat,
+                                                name='risiko-heartbeat')
+            heartbeat_thread.setDaemon(True)
+            heartbeat_thread.start()
+
+        for worker in workers[:]:
+            if not worker.isAlive():
+                workers.remove(worker)
+
+        while len(workers) < get_number_of_workers():
+            worker = threading.Thread(target=work,
+                                      name='risiko-worker-%i' % len(workers))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+    finally:
+        workers_lock.release()
+
+
+def claim_calculation(calculation_id):
+    """Mark queued calculation as running
+
+    Input
+        calculation_id: Primary key of Calculation object
+
+    Output
+        True if this call claimed the calculation. False if it was not
+        queued, e.g. because another worker claimed it first.
+    """
+
+    now = datetime.datetime.now()
+    rows = Calculation.objects.filter(id=calculation_id,
+                                      status='queued').update(status='running',
+                                                              heartbeat=now)
+    return rows == 1
+
+
+def next_calculation():
+    """Claim the oldest queued calculation
+
+    Output
+        Calculation object or None if nothing is queued
+    """
+
+    if stopping.isSet():
+        return None
+
+    queued = Calculation.objects.filter(status='queued').order_by('id')
+    for calculation_id in queued.values_list('id', flat=True)[:10]:
+        if claim_calculation(calculation_id):
+            return Calculation.objects.get(id=calculation_id)
+
+    return None
+
+
+def fail_abandoned_calculations():
+    """Mark calculations without recent heartbeat as failed
+
+    Output
+        Number of calculations marked as failed
+
+    Calculations are not queued again, as the process running them may
+    have died because of them, e.g. by running out of memory.
+    """
+
+    timeout = get_calculation_timeout()
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+    abandoned = Calculation.objects.filter(status='running')
+    abandoned = abandoned.filter(Q(heartbeat__lt=cutoff) |
+                                 Q(heartbeat__isnull=True))
+
+    count = 0
+    for calculation in abandoned:
+        # Claim it unless its heartbeat has been recorded since
+        rows = Calculation.objects.filter(id=calculation.id,
+                                          status='running',
+                                          heartbeat=calculation.heartbeat)
+        if rows.update(status='failed') == 1:
+            errors = ('Calculation was abandoned by its worker. No '
+                      'progress was recorded for %i seconds.' % timeout)
+            calculation.errors = errors
+            calculation.status = 'failed'
+            calculation.result = json.dumps({'errors': errors,
+                                             'stacktrace': None})
+            record_stage(calculation, 'failed')
+            logger.error('Calculation %i: %s' % (calculation.id, errors))
+            count += 1
+
+    return count
+
+
+def beat():
+    """Record heartbeat of running calculations until the process exits
+
+    Abandoned calculations are looked for when the thread starts and at
+    every heartbeat.
+    """
+
+    while not stopping.isSet():
+        workers_lock.acquire()
+        try:
+            ids = running.values()
+        finally:
+            workers_lock.release()
+
+        try:
+            if len(ids) > 0:
+                now = datetime.datetime.now()
+                Calculation.objects.filter(id__in=ids,
+                                           status='running').update(
+                                               heartbeat=now)
+            fail_abandoned_calculations()
+        except Exception, e:
+            msg = 'Calculation heartbeat failed: %s' % exception_format(e)
+            logger.error(msg)
+        finally:
+            connection.close()
+
+        stopping.wait(HEARTBEAT_INTERVAL)
+
+
+def stop_workers():
+    """Queue calculations run by this process again as it exits
+
+    This is registered with atexit. Worker threads are daemons that are
+    killed when the process exits, so instead of waiting for calculations
+    that may take a long time they are queued to be run again. Workers
+    stop at their next stage rather than record results.
+    """
+
+    stopping.set()
+    job_available.set()
+
+    workers_lock.acquire()
+    try:
+        ids = running.values()
+    finally:
+        workers_lock.release()
+
+    for calculation_id in ids:
+        try:
+            rows = Calculation.objects.filter(id=calculation_id,
+                                              status='running')
+            if rows.update(status='queued', heartbeat=None) == 1:
+                calculation = Calculation.objects.get(id=calculation_id)
+                record_stage(calculation, 'queued')
+        except Exception, e:
+            msg = ('Could not queue calculation %i again: %s'
+                   % (calculation_id, exception_format(e)))
+            logger.error(msg)
+
+atexit.register(stop_workers)
+
+
+def check_stopping():
+    """Stop calculation of worker if the process is exiting
+    """
+
+    if stopping.isSet():
+        raise WorkerStopped('Process is exiting')
+
+
+def work():
+    """Run queued calculations one at a time until the process exits
+    """
+
+    while not stopping.isSet():
+        job_available.clear()
+        try:
+            calculation = next_calculation()
+            if calculation is not None:
+                run_calculation(calculation)
+        except Exception, e:
+            # Workers must survive e.g. database errors
+            msg = 'Calculation worker failed: %s' % exception_format(e)
+            logger.error(msg)
+            calculation = None
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+        if calculation is None:
+            job_available.wait(POLL_INTERVAL)
+
+
+def advance(calculation, stage):
+    """Record stage reached by calculation of this process
+
+    Raises WorkerStopped instead if the process is exiting, as the
+    calculation has then been queued again.
+    """
+
+    check_stopping()
+    record_stage(calculation, stage)
+
+
+def run_calculation(calculation, save_output=save_to_geonode):
+    """Run claimed calculation and store its result
+
+    Input
+        calculation: Calculation object with status 'running'
+        save_output: Function used to upload the impact layer
+
+    Output
+        None. The JSON result of the calculation or its errors is stored
+        in the result field of calculation and the final stage is
+        'finished' or 'failed'. If the process exits before then, the
+        calculation is queued again and not updated further.
+    """
+
+    workers_lock.acquire()
+    try:
+        running[threading.currentThread().ident] = calculation.id
+    finally:
+        workers_lock.release()
+
+    try:
+        run_stages(calculation, save_output)
+    except WorkerStopped:
+        logger.info('Calculation %i stopped as process is exiting'
+                    % calculation.id)
+    finally:
+        workers_lock.acquire()
+        try:
+            del running[threading.currentThread().ident]
+        finally:
+            workers_lock.release()
+
+
+def run_stages(calculation, save_output):
+    """Run stages of calculation (see run_calculation)
+    """
+
+    # Duration is measured from when the calculation starts
+    start = datetime.datetime.now()
+    calculation.run_date = start
+    calculation.status = 'running'
+    theuser = calculation.user
+
+    # Wrap main computation loop in try except to catch and present
+    # messages and stack traces in the application
+    try:
+        # Get metadata
+        advance(calculation, 'metadata')
+        haz_metadata = get_metadata(calculation.hazard_server,
+                                    calculation.hazard_layer)
+        exp_metadata = get_metadata(calculation.exposure_server,
+                                    calculation.exposure_layer)
+
+        # Determine common resolution in case of raster layers
+        raster_resolution = get_common_resolution(haz_metadata, exp_metadata)
+
+        # Get reconciled bounding boxes
+        requested_bbox = calculation.requested_bbox
+        haz_bbox, exp_bbox, imp_bbox = get_bounding_boxes(haz_metadata,
+                                                          exp_metadata,
+                                                          requested_bbox)
+
+        # Record layers to download
+        layers_to_download = [(calculation.exposure_server,
+                            calculation.exposure_layer,
+                            exp_bbox, exp_metadata),
+                           (calculation.hazard_server,
+                            calculation.hazard_layer,
+                            haz_bbox, haz_metadata)]
+
+        # Add linked layers if any
+        layers_to_download += get_linked_layers(layers_to_download)
+
+        # Get selected impact function
+        impact_function = get_plugin(calculation.impact_function)
+        impact_function_source = inspect.getsource(impact_function)
+
+        # Record information in calculation object. It is saved with
+        # the next stage.
+        calculation.impact_function_source = impact_function_source
+        calculation.bbox = bboxlist2string(imp_bbox)
+
+        # Start computation
+        msg = 'Performing requested calculation %i' % calculation.id
+        logger.info(msg)
+
+        # Download selected layer objects. Impact functions that run in
+        # chunks read vector exposure from its file one chunk at a time.
+        advance(calculation, 'downloading')
+        chunk_size = getattr(settings, 'RISIKO_CHUNK_SIZE', None)
+        in_chunks = (chunk_size is not None and
+                     hasattr(impact_function, 'run_chunk'))
+        layers = download_layers(layers_to_download,
+                                 resolution=raster_resolution,
+                                 use_cache=True,
+                                 read_vector=not in_chunks)
+
+        # Calculate result using specified impact function
+        advance(calculation, 'calculating')
+        msg = ('- Calculating impact using %s' % impact_function)
+        logger.info(msg)
+        impact_filename = calculate_impact(layers=layers,
+                                           impact_fcn=impact_function,
+                                           chunk_size=chunk_size)
+
+        # Upload result to internal GeoServer
+        advance(calculation, 'uploading')
+        msg = ('- Uploading impact layer %s' % impact_filename)
+        logger.info(msg)
+        result = save_output(impact_filename,
+                             title='output_%s' % start.isoformat(),
+                             user=theuser)
+    except WorkerStopped:
+        raise
+    except Exception, e:
+        # FIXME: Reimplement error saving for calculation.
+        # FIXME (Ole): Why should we reimplement?
+        # This is dangerous. Try to raise an exception
+        # e.g. in get_metadata_from_layer. Things will silently fail.
+        # See issue #170
+
+        logger.error(e)
+        errors = e.__str__()
+        trace = exception_format(e)
+        calculation.errors = errors
+        calculation.stacktrace = trace
+        calculation.status = 'failed'
+        calculation.result = json.dumps({'errors': errors,
+                                         'stacktrace': trace})
+        advance(calculation, 'failed')
+        return
+
+    msg = ('- Result available at %s.' % result.get_absolute_url())
+    logger.info(msg)
+
+    calculation.layer = urljoin(settings.SITEURL, result.get_absolute_url())
+    calculation.success = True
+    calculation.status = 'finished'
+    check_stopping()
+    calculation.save()
+
+    calculation.result = get_result_json(calculation, result)
+    advance(calculation, 'finished')
+
+
+def get_result_json(calculation, result):
+    """Make JSON result of finished calculation as returned by the API
+
+    Input
+        calculation: Calculation object
+        result: Uploaded impact layer
+
+    Output
+        JSON string
+    """
+
+    output = {}
+    for field in calculation._meta.fields:
+        output[field.attname] = getattr(calculation, field.attname)
+
+    # Fields of the job queue are reported by the status endpoint
+    for key in ['status', 'stage', 'progress', 'requested_bbox',
+                'keywords', 'result', 'heartbeat']:
+        del output[key]
+
+    # json.dumps does not like datetime objects,
+    # let's make it a json string ourselves
+    output['run_date'] = 'new Date("%s")' % calculation.run_date
+
+    # FIXME: This should not be needed in an ideal world
+    ows_server_url = settings.GEOSERVER_BASE_URL + 'ows',
+    output['ows_server_url'] = ows_server_url
+
+    # json.dumps does not like django users
+    output['user'] = calculation.user.username
+    downloads = result.download_links()
+    keys = [x[0] for x in downloads]
+    values = [x[2] for x in downloads]
+    download_dict = dict(zip(keys, values))
+    if 'excel' in keys:
+        output['excel'] = download_dict['excel']
+
+    # Keywords do not like caption being there.
+    # FIXME: Do proper parsing, don't assume caption is the only keyword.
+    if 'caption' in result.keywords:
+        caption = result.keywords.split('caption:')[1]
+        # FIXME (Ole): Return underscores to spaces that was put in place
+        # to store it in the first place. See issue #148
+        output['caption'] = caption.replace('_', ' ')
+    else:
+        output['caption'] = 'Calculation finished ' \
+                            'in %s' % calculation.run_duration
+
+    # If success == True and errors = '' ...
+    # ... let's make errors=None for backwards compat
+    if output['success'] and len(output['errors']) == 0:
+        output['errors'] = None
+
+    return json.dumps(output)
@@ -23,6 +23,16 @@ class Calculation(models.Model):
     stacktrace = models.TextField(null=True, blank=True)
     layer = models.CharField(max_length=255, null=True, blank=True)
 
+    # Job queue (see impact.jobs)
+    status = models.CharField(max_length=16, default='queued',
+                              db_index=True)
+    stage = models.CharField(max_length=16, default='queued')
+    progress = models.TextField(default='', blank=True)
+    requested_bbox = models.CharField(max_length=255, null=True, blank=True)
+    keywords = models.CharField(max_length=255, null=True, blank=True)
+    result = models.TextField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
     @property
     def url(self):
         return self.layer.url
@@ -33,6 +43,8 @@ class Calculation(models.Model):
     def __unicode__(self):
         if self.success:
             name = 'Sucessful Calculation'
+        elif self.status in ['queued', 'running']:
+            name = '%s Calculation' % self.status.capitalize()
         else:
             name = 'Failed Calculation'
         return '%s at %s' % (name, self.run_date)
@@ -41,6 +41,20 @@ class FunctionProvider:
     layers           A list of layers
     result           A list of layers
     ===============  =========================
+
+    Plugins may also provide the methods
+
+    run_chunk(layers)
+    make_caption(statistics)
+
+    where run_chunk computes the result layer for one chunk of exposure
+    features, or one tile of aligned raster layers, together with a
+    dictionary of statistics that can be added up across chunks
+    (e.g. counts), and make_caption creates the caption from the
+    statistics for all chunks. This allows calculate_impact to process
+    large exposure layers in chunks or tiles of bounded size.
+    Raster plugins can provide make_keywords(statistics) in addition if
+    other keywords than the caption depend on the full result.
     """
     __metaclass__ = PluginMount
 
@@ -19,6 +19,7 @@ from impact.plugins.utilities import PointZoomSize
 from impact.plugins.utilities import PointClassColor
 from impact.plugins.utilities import PointSymbol
 from impact.plugins.mappings import osm2bnpb, unspecific2bnpb, sigab2bnpb
+import numpy
 
 # Damage 'curves' for the two vulnerability classes
 damage_parameters = {'URM': [6, 7],
@@ -65,47 +66,38 @@ class EarthquakeGuidelinesFunction(FunctionProvider):
             E = unspecific2bnpb(E, target_attribute=self.vclass_tag)
 
         # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        H = H.interpolate(E, 'MMI')
 
         # Extract relevant numerical data
         coordinates = E.get_geometry()
-        shaking = H.get_data()
-        N = len(shaking)
+        mmi = H.get_data('MMI')
+        N = len(mmi)
 
         # List attributes to carry forward to result layer
         attributes = E.get_attribute_names()
 
-        # Calculate building damage
-        count3 = 0
-        count2 = 0
-        count1 = 0
-        building_damage = []
-        for i in range(N):
-            mmi = float(shaking[i].values()[0])
-
-            building_class = E.get_data(self.vclass_tag, i)
-            lo, hi = damage_parameters[building_class]
-
-            if mmi < lo:
-                damage = 1  # Low
-                count1 += 1
-            elif lo <= mmi < hi:
-                damage = 2  # Medium
-                count2 += 1
-            else:
-                damage = 3  # High
-                count3 += 1
+        # Look up damage thresholds once for each building class
+        classes, index = numpy.unique(E.get_data(self.vclass_tag),
+                                      return_inverse=True)
+        lo = numpy.zeros(len(classes))
+        hi = numpy.zeros(len(classes))
+        for i, building_class in enumerate(classes):
+            lo[i], hi[i] = damage_parameters[building_class]
+
+        # Calculate building damage: Low (1), Medium (2) or High (3)
+        damage = numpy.select([mmi < lo[index], mmi < hi[index]], [1, 2], 3)
 
-            # Collect shake level and calculated damage
-            result_dict = {self.target_field: damage,
+        # Collect shake level and calculated damage
+        building_damage = {self.target_field: damage,
                            'MMI': mmi}
 
-            # Carry all orginal attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
+        # Carry all orginal attributes forward
+        for key in attributes:
+            building_damage[key] = E.get_data(key)
 
-            # Record result for this feature
-            building_damage.append(result_dict)
+        # Calculate statistics
+        counts = numpy.bincount(damage, minlength=4)
+        count1, count2, count3 = counts[1:]
 
         # Create report
         caption = ('<table border="0" width="320px">'
@@ -19,8 +19,7 @@ class EarthquakeFatalityFunction(FunctionProvider):
                 layer_type=='raster'
     """
 
-    @staticmethod
-    def run(layers,
+    def run(self, layers,
             a=0.97429, b=11.037):
         """Risk plugin for earthquake fatalities
 
@@ -30,6 +29,23 @@ class EarthquakeFatalityFunction(FunctionProvider):
               P: Raster layer of population data on the same grid as H
         """
 
+        R, statistics = self.run_chunk(layers, a=a, b=b)
+        R.keywords['caption'] = self.make_caption(statistics)
+        return R
+
+    def run_chunk(self, layers,
+                  a=0.97429, b=11.037):
+        """Calculate fatalities for one tile of the input layers
+
+        Input
+          layers: List of layers as for run
+
+        Output
+          R: Raster layer of estimated fatalities
+          statistics: Dictionary with total population and fatalities
+                      (and their breakdown by gender if available)
+        """
+
         # Identify input layers
         intensity = get_hazard_layer(layers)
 
@@ -67,6 +83,10 @@ class EarthquakeFatalityFunction(FunctionProvider):
         # Calculate impact
         F = 10 ** (a * H - b) * P
 
+        # Sums for this study
+        statistics = {'total': numpy.nansum(P.flat),
+                      'count': numpy.nansum(F.flat)}
+
         if gender_ratio is not None:
             # Extract gender ratio at each pixel (as ratio)
             G = gender_ratio.get_data(nan=0)
@@ -80,34 +100,41 @@ class EarthquakeFatalityFunction(FunctionProvider):
             F_female = F * G
             F_male = F - F_female
 
-        # Generate text with result for this study
-        count = numpy.nansum(F.flat)
-        total = numpy.nansum(P.flat)
+            statistics['total_female'] = numpy.nansum(P_female.flat)
+            statistics['total_male'] = numpy.nansum(P_male.flat)
+            statistics['count_female'] = numpy.nansum(F_female.flat)
+            statistics['count_male'] = numpy.nansum(F_male.flat)
+
+        # Create new layer and return
+        R = Raster(F,
+                   projection=population.get_projection(),
+                   geotransform=population.get_geotransform(),
+                   name='Estimated fatalities',
+                   keywords={})
+        return R, statistics
+
+    def make_caption(self, statistics):
+        """Create report from sums of population and fatalities
+        """
+
+        gender = 'total_female' in statistics
 
-        # Create report
         caption = ('<table border="0" width="320px">'
                    '   <tr><td>%s&#58;</td><td>%i</td></tr>'
-                   % ('Jumlah Penduduk', int(total)))
-        if gender_ratio is not None:
+                   % ('Jumlah Penduduk', int(statistics['total'])))
+        if gender:
             caption += ('        <tr><td>%s&#58;</td><td>%i</td></tr>'
-                        % (' - Wanita', int(numpy.nansum(P_female.flat))))
+                        % (' - Wanita', int(statistics['total_female'])))
             caption += ('        <tr><td>%s&#58;</td><td>%i</td></tr>'
-                        % (' - Pria', int(numpy.nansum(P_male.flat))))
+                        % (' - Pria', int(statistics['total_male'])))
         caption += ('   <tr><td>%s&#58;</td><td>%i</td></tr>'
-                    % ('Perkiraan Orang Meninggal', int(count)))
+                    % ('Perkiraan Orang Meninggal', int(statistics['count'])))
 
-        if gender_ratio is not None:
+        if gender:
             caption += ('        <tr><td>%s&#58;</td><td>%i</td></tr>'
-                        % (' - Wanita', int(numpy.nansum(F_female.flat))))
+                        % (' - Wanita', int(statistics['count_female'])))
             caption += ('        <tr><td>%s&#58;</td><td>%i</td></tr>'
-                        % (' - Pria', int(numpy.nansum(F_male.flat))))
+                        % (' - Pria', int(statistics['count_male'])))
 
         caption += '</table>'
-
-        # Create new layer and return
-        R = Raster(F,
-                   projection=population.get_projection(),
-                   geotransform=population.get_geotransform(),
-                   name='Estimated fatalities',
-                   keywords={'caption': caption})
-        return R
+        return caption
@@ -56,48 +56,34 @@ class EarthquakeFatalityFunctionPodes(FunctionProvider):
         H = get_hazard_layer(layers)   # Intensity
         E = get_exposure_layer(layers)  # Exposure - population counts
 
-        # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        # Average hazard level over each polygon
+        H = H.interpolate(E, 'MMI', mode='average')
 
         # Extract relevant numerical data
         coordinates = E.get_geometry()  # Stay with polygons
-        shaking = H.get_data()
-        N = len(shaking)
+        mmi = H.get_data('MMI')
+
+        # FIXME: Hack until interpolation is fixed
+        mmi = numpy.where(mmi < 0.0, 0.0, mmi)
 
         # List attributes to carry forward to result layer
         attributes = E.get_attribute_names()
 
         # Calculate fatilities
-        count = 0
-        total = 0
-
-        result_feature_set = []
-        for i in range(N):
-            mmi = float(shaking[i].values()[0])
-            if mmi < 0.0:
-                # FIXME: Hack until interpolation is fixed
-                mmi = 0.0
-
-            population_count = E.get_data('Jumlah_Pen', i)
-
-            # Calculate impact
-            F = 10 ** (a * mmi - b) * population_count
-
-            # Collect shake level and calculated damage
-            result_dict = {self.target_field: F,
-                           'MMI': mmi}
+        population_count = E.get_data('Jumlah_Pen')
+        F = 10 ** (a * mmi - b) * population_count
 
-            # Carry all orginal attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
+        # Collect shake level and calculated damage
+        result_feature_set = {self.target_field: F,
+                              'MMI': mmi}
 
-            # Record result for this feature
-            result_feature_set.append(result_dict)
+        # Carry all orginal attributes forward
+        for key in attributes:
+            result_feature_set[key] = E.get_data(key)
 
-            # Calculate statistics
-            if not numpy.isnan(F):
-                count += F
-            total += population_count
+        # Calculate statistics
+        count = numpy.sum(F[numpy.logical_not(numpy.isnan(F))])
+        total = numpy.sum(population_count)
 
         # Create report
         caption = ('<table border="0" width="320px">'
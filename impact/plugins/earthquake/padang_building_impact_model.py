@@ -27,8 +27,9 @@ from django.utils.translation import ugettext as _
 from impact.plugins.utilities import PointZoomSize
 from impact.plugins.utilities import PointClassColor
 from impact.plugins.utilities import PointSymbol
+from impact.plugins.utilities import Fragility_table
 from impact.plugins.mappings import osm2padang, sigab2padang
-import scipy.stats
+import numpy
 
 
 # Damage curves for each of the nine classes derived from the Padang survey
@@ -42,6 +43,9 @@ damage_curves = {'1': dict(median=7.5, beta=0.11),
                  '8': dict(median=8.9, beta=0.07),
                  '9': dict(median=10.5, beta=0.15)}
 
+# Damage curves tabulated once for MMI 0 to 15 (see Fragility_table)
+damage_table = Fragility_table(damage_curves, minimum=0.0, maximum=15.0)
+
 
 class PadangEarthquakeBuildingDamageFunction(FunctionProvider):
     """Risk plugin for Padang earthquake damage to buildings
@@ -57,6 +61,9 @@ class PadangEarthquakeBuildingDamageFunction(FunctionProvider):
                     datatype in ['osm', 'itb', 'sigab']
     """
 
+    # Use 'table' for lookup in damage_table rather than exact curves
+    fragility_mode = 'exact'
+
     def run(self, layers):
         """Risk plugin for earthquake school damage
         """
@@ -77,56 +84,35 @@ class PadangEarthquakeBuildingDamageFunction(FunctionProvider):
             vclass_tag = 'TestBLDGCl'
 
         # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        H = H.interpolate(E, 'MMI')
 
         # Extract relevant numerical data
         coordinates = E.get_geometry()
-        shaking = H.get_data()
-        N = len(shaking)
+        mmi = H.get_data('MMI')
+        N = len(mmi)
 
         # List attributes to carry forward to result layer
         attributes = E.get_attribute_names()
 
-        # Calculate building damage
-        count50 = 0
-        count25 = 0
-        count10 = 0
-        count0 = 0
-        building_damage = []
-        for i in range(N):
-            mmi = float(shaking[i].values()[0])
-
-            building_class = E.get_data(vclass_tag, i)
-
-            building_type = str(int(building_class))
-            damage_params = damage_curves[building_type]
-            percent_damage = scipy.stats.lognorm.cdf(mmi,
-                                                     damage_params['beta'],
-                                                     scale=damage_params['median']) * 100
-
-            # Collect shake level and calculated damage
-            result_dict = {self.target_field: percent_damage,
-                           'MMI': mmi}
-
-            # Carry all orginal attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
+        # Calculate building damage for all buildings
+        building_class = E.get_data(vclass_tag)
+        percent_damage = damage_table(mmi, building_class,
+                                      key=lambda c: str(int(c)),
+                                      mode=self.fragility_mode) * 100
 
-            # Record result for this feature
-            building_damage.append(result_dict)
-
-            # Calculate statistics
-            if percent_damage < 10:
-                count0 += 1
-
-            if 10 <= percent_damage < 25:
-                count10 += 1
+        # Collect shake level and calculated damage
+        building_damage = {self.target_field: percent_damage,
+                           'MMI': mmi}
 
-            if 25 <= percent_damage < 50:
-                count25 += 1
+        # Carry all orginal attributes forward
+        for key in attributes:
+            building_damage[key] = E.get_data(key)
 
-            if 50 <= percent_damage:
-                count50 += 1
+        # Calculate statistics. Buildings without data are not counted.
+        damage_class = numpy.digitize(percent_damage, [10, 25, 50])
+        valid = numpy.logical_not(numpy.isnan(percent_damage))
+        counts = numpy.bincount(damage_class[valid], minlength=4)
+        count0, count10, count25, count50 = counts
 
         # Create report
         caption = ('<font size="3"> <table border="0" width="320px">'
@@ -19,8 +19,10 @@ class EarthquakePopulationExposureFunction(FunctionProvider):
                 layer_type=='raster'
     """
 
-    @staticmethod
-    def run(layers):
+    # MMI classes considered (1-10)
+    mmi_classes = range(1, 11)
+
+    def run(self, layers):
         """Calculate population exposed to different levels of ground shaking
 
         Input
@@ -29,6 +31,23 @@ class EarthquakePopulationExposureFunction(FunctionProvider):
               P: Raster layer of population density
         """
 
+        R, statistics = self.run_chunk(layers)
+        R.keywords.update(self.make_keywords(statistics))
+        R.keywords['caption'] = self.make_caption(statistics)
+        return R
+
+    def run_chunk(self, layers):
+        """Calculate exposure for one tile of the input layers
+
+        Input
+          layers: List of layers as for run
+
+        Output
+          R: Raster layer of estimated fatalities
+          statistics: Dictionary with total population, fatalities and
+                      population in each MMI class
+        """
+
         # Identify input layers
         intensity = get_hazard_layer(layers)
         population = get_exposure_layer(layers)
@@ -38,46 +57,58 @@ class EarthquakePopulationExposureFunction(FunctionProvider):
         P = population.get_data(nan=0)
 
         # Calculate exposure to MMI impact
-        mmi_classes = range(1, 11)  # MMI classes considered (1-10)
-
-        # Form result as keyword strings
-        mmi_str = str(mmi_classes)[1:-1]  # Get rid of []
-        count_str = ''
-
-        for i in mmi_classes:
+        mmi_counts = numpy.zeros(len(self.mmi_classes))
+        for k, i in enumerate(self.mmi_classes):
             # Identify cells where MMI is in class i
             mask = (H >= i - 0.5) * (H < i + 0.5)
 
             # Count population affected by this shake level
-            count = round(numpy.nansum(P[mask]))
-            if numpy.isnan(count):
-                count = 0
-
-            # Update keyword string
-            count_str += '%i ' % count
+            mmi_counts[k] = numpy.nansum(P[mask])
 
         # Calculate fatality map (FIXME (Ole): Need to replaced by USGS model)
         a = 0.97429
         b = 11.037
         F = 10 ** (a * H - b) * P
 
-        # Generate text with result for this study
-        count = numpy.nansum(F.flat)
-        total = numpy.nansum(P.flat)
-
-        # Create report
-        caption = ('<table border="0" width="320px">'
-                   '   <tr><td>%s&#58;</td><td>%i</td></tr>'
-                   '   <tr><td>%s&#58;</td><td>%i</td></tr>'
-                   '</table>' % ('Jumlah Penduduk', int(total),
-                                 'Perkiraan Orang Meninggal', int(count)))
+        # Sums for this study
+        statistics = {'total': numpy.nansum(P.flat),
+                      'count': numpy.nansum(F.flat),
+                      'mmi_counts': mmi_counts}
 
         # Create new layer and return
         R = Raster(F,
                    projection=population.get_projection(),
                    geotransform=population.get_geotransform(),
                    name='Estimated fatalities',
-                   keywords={'caption': caption,
-                             'mmi-classes': mmi_str,
-                             'affected-population': count_str})
-        return R
+                   keywords={})
+        return R, statistics
+
+    def make_keywords(self, statistics):
+        """Form population counts for each MMI class as keyword strings
+        """
+
+        mmi_str = str(self.mmi_classes)[1:-1]  # Get rid of []
+        count_str = ''
+
+        for count in statistics['mmi_counts']:
+            count = round(count)
+            if numpy.isnan(count):
+                count = 0
+
+            # Update keyword string
+            count_str += '%i ' % count
+
+        return {'mmi-classes': mmi_str,
+                'affected-population': count_str}
+
+    def make_caption(self, statistics):
+        """Create report from sums of population and fatalities
+        """
+
+        caption = ('<table border="0" width="320px">'
+                   '   <tr><td>%s&#58;</td><td>%i</td></tr>'
+                   '   <tr><td>%s&#58;</td><td>%i</td></tr>'
+                   '</table>' % ('Jumlah Penduduk', int(statistics['total']),
+                                 'Perkiraan Orang Meninggal',
+                                 int(statistics['count'])))
+        return caption
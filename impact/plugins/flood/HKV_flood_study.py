@@ -20,8 +20,10 @@ class FloodImpactFunction(FunctionProvider):
                     layer_type=='raster'
     """
 
-    @staticmethod
-    def run(layers):
+    # Depth above which people are regarded affected [m]
+    threshold = 0.1
+
+    def run(self, layers):
         """Risk plugin for earthquake fatalities
 
         Input
@@ -30,8 +32,23 @@ class FloodImpactFunction(FunctionProvider):
               P: Raster layer of population data on the same grid as H
         """
 
-        # Depth above which people are regarded affected [m]
-        threshold = 0.1
+        R, statistics = self.run_chunk(layers)
+        R.keywords['caption'] = self.make_caption(statistics)
+        return R
+
+    def run_chunk(self, layers):
+        """Calculate people affected for one tile of the input layers
+
+        Input
+          layers: List of layers as for run
+
+        Output
+          R: Raster layer of people affected
+          statistics: Dictionary with total and affected population
+                      (and their breakdown by gender if available)
+        """
+
+        threshold = self.threshold
         thresholds = [0.1, 0.2, 0.3, 0.5, 0.8, 1.0]
 
         # Identify hazard and exposure layers
@@ -79,6 +96,10 @@ class FloodImpactFunction(FunctionProvider):
             P = population.get_data(nan=0.0, scaling=True)
             I = numpy.where(D > threshold, P, 0)
 
+        # Sums for this study
+        statistics = {'total': sum(P.flat),
+                      'count': sum(I.flat)}
+
         if gender_ratio is not None:
             # Extract gender ratio at each pixel (as ratio)
             G = gender_ratio.get_data(nan=0.0)
@@ -92,19 +113,36 @@ class FloodImpactFunction(FunctionProvider):
             I_female = I * G
             I_male = I - I_female
 
+            statistics['total_female'] = sum(P_female.flat)
+            statistics['total_male'] = sum(P_male.flat)
+            statistics['count_female'] = sum(I_female.flat)
+            statistics['count_male'] = sum(I_male.flat)
+
+        # Create raster object and return
+        R = Raster(I,
+                   projection=inundation.get_projection(),
+                   geotransform=inundation.get_geotransform(),
+                   name='People affected',
+                   keywords={})
+        return R, statistics
+
+    def make_caption(self, statistics):
+        """Create report from sums of total and affected population
+        """
 
         # Generate text with result for this study
-        total = str(int(sum(P.flat) / 1000))
-        count = str(int(sum(I.flat) / 1000))
+        total = str(int(statistics['total'] / 1000))
+        count = str(int(statistics['count'] / 1000))
+        gender = 'total_female' in statistics
 
         # Create report
         caption = ('<table border="0" width="320px">'
                    '   <tr><td><b>%s&#58;</b></td>'
                    '<td align="right"><b>%s</b></td></tr>'
                    % ('Jumlah Penduduk', total))
-        if gender_ratio is not None:
-            total_female = str(int(sum(P_female.flat) / 1000))
-            total_male = str(int(sum(P_male.flat) / 1000))
+        if gender:
+            total_female = str(int(statistics['total_female'] / 1000))
+            total_male = str(int(statistics['total_male'] / 1000))
 
 
             caption += ('        <tr><td>%s&#58;</td>'
@@ -117,12 +155,12 @@ class FloodImpactFunction(FunctionProvider):
 
         caption += ('   <tr><td><b>%s&#58;</b></td>'
                     '<td align="right"><b>%s</b></td></tr>'
-                    % ('Perkiraan Jumlah Terdampak (> %.1fm)' % threshold,
+                    % ('Perkiraan Jumlah Terdampak (> %.1fm)' % self.threshold,
                        count))
 
-        if gender_ratio is not None:
-            affected_female = str(int(sum(I_female.flat) / 1000))
-            affected_male = str(int(sum(I_male.flat) / 1000))
+        if gender:
+            affected_female = str(int(statistics['count_female'] / 1000))
+            affected_male = str(int(statistics['count_male'] / 1000))
 
 
             caption += ('        <tr><td>%s&#58;</td>'
@@ -137,13 +175,7 @@ class FloodImpactFunction(FunctionProvider):
         caption += '<br>'  # Blank separation row
         caption += 'Catatan&#58; Semua nomor x 1000'
 
-        # Create raster object and return
-        R = Raster(I,
-                   projection=inundation.get_projection(),
-                   geotransform=inundation.get_geotransform(),
-                   name='People affected',
-                   keywords={'caption': caption})
-        return R
+        return caption
 
     def generate_style(self, data):
         """Generates and SLD file based on the data values
@@ -6,6 +6,7 @@ from django.utils.translation import ugettext as _
 from impact.plugins.utilities import PointZoomSize
 from impact.plugins.utilities import PointClassColor
 from impact.plugins.utilities import PointSymbol
+import numpy
 import scipy.stats
 
 
@@ -27,49 +28,60 @@ class FloodBuildingImpactFunction(FunctionProvider):
         """Risk plugin for tsunami population
         """
 
+        V, statistics = self.run_chunk(layers)
+        V.keywords['caption'] = self.make_caption(statistics)
+        return V
+
+    def run_chunk(self, layers):
+        """Calculate impact for one chunk of buildings
+
+        Output
+            V: Vector layer with impact for each building in this chunk
+            statistics: Dictionary with number of buildings in total and
+                        number of inundated buildings
+        """
+
         # Extract data
         H = get_hazard_layer(layers)    # Depth
         E = get_exposure_layer(layers)  # Building locations
 
         # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        H = H.interpolate(E, 'DEPTH')
 
         # Extract relevant numerical data
         coordinates = E.get_geometry()
-        depth = H.get_data()
+        depth = H.get_data('DEPTH')
         N = len(depth)
 
         # List attributes to carry forward to result layer
         attributes = E.get_attribute_names()
 
-        #print attributes
-        #print 'Number of population points', N
+        # Tag and count inundated buildings
+        inundated = depth > 0.1
+        count = int(numpy.sum(inundated))
 
-        # Calculate population impact
-        count = 0
-        building_impact = []
-        for i in range(N):
-            dep = float(depth[i].values()[0])
+        # Collect depth and calculated damage
+        building_impact = {'AFFECTED': numpy.where(inundated, 99.5, 0),
+                           'DEPTH': depth}
 
-            # Tag and count
-            if dep > 0.1:
-                affected = 99.5
-                count += 1
-            else:
-                affected = 0
+        # Carry all original attributes forward
+        for key in attributes:
+            building_impact[key] = E.get_data(key)
 
-            # Collect depth and calculated damage
-            result_dict = {'AFFECTED': affected,
-                           'DEPTH': dep}
-
-            # Carry all original attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
+        # Create vector layer and return
+        V = Vector(data=building_impact,
+                   projection=E.get_projection(),
+                   geometry=coordinates,
+                   name='Estimated buildings affected',
+                   keywords={})
+        return V, {'total': N, 'inundated': count}
 
-            # Record result for this feature
-            building_impact.append(result_dict)
+    def make_caption(self, statistics):
+        """Create report from statistics for all buildings
+        """
 
-        # Create report
+        N = statistics['total']
+        count = statistics['inundated']
         caption = ('<table border="0" width="320px">'
                    '   <tr><th><b>%s</b></th><th><b>%s</b></th></th>'
                     '   <tr></tr>'
@@ -80,14 +92,7 @@ class FloodBuildingImpactFunction(FunctionProvider):
                                   _('All'), N,
                                   _('Inundated'), count,
                                   _('Not inundated'), N - count))
-
-        # Create vector layer and return
-        V = Vector(data=building_impact,
-                   projection=E.get_projection(),
-                   geometry=coordinates,
-                   name='Estimated buildings affected',
-                   keywords={'caption': caption})
-        return V
+        return caption
 
     def generate_style(self, data):
         """Generates and SLD file based on the data values
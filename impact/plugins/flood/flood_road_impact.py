@@ -6,8 +6,9 @@ from django.utils.translation import ugettext as _
 from impact.plugins.utilities import PointZoomSize
 from impact.plugins.utilities import PointClassColor
 from impact.plugins.utilities import PointSymbol
-from impact.storage.vector import convert_line_to_points
-import scipy.stats
+from impact.engine.line_sampling import sample_raster_along_lines
+from impact.engine.line_sampling import merge_line_pieces
+import numpy
 import ogr
 
 class FloodRoadImpactFunction(FunctionProvider):
@@ -25,101 +26,60 @@ class FloodRoadImpactFunction(FunctionProvider):
     target_field = 'AFFECTED'
 
     def run(self, layers):
-        """Risk plugin for tsunami population
+        """Risk plugin for flood impact on roads
         """
 
         # Extract data
         H = get_hazard_layer(layers)    # Depth
-        R = get_exposure_layer(layers)  # Building locations
+        R = get_exposure_layer(layers)  # Roads
 
-        # Make the delta 10 times the size of the resolution.
-        delta = abs(H.get_geotransform()[1])*10
         min_value, max_value = H.get_extrema()
 
-        E = convert_line_to_points(R, delta)
+        # Split roads where they cross grid cells of the hazard layer
+        # and get depth in each cell
+        coordinates, offsets = R.get_packed_geometry()
+        start, end, parent, depth = sample_raster_along_lines(H,
+                                                              coordinates,
+                                                              offsets)
 
-        # Interpolate hazard level to building locations
-        H = H.interpolate(E)
-
-        # Extract relevant numerical data
-        coordinates = E.get_geometry()
-        depth = H.get_data()
-        N = len(depth)
-
-        # List attributes to carry forward to result layer
-        attributes = E.get_attribute_names()
-
-        #print attributes
-        #print 'Number of population points', N
-
-        # Calculate population impact
-        road_impact = []
+        # Classify depth relative to the range of the hazard layer into
+        # the highest of num_classes levels exceeded. Pieces without data
+        # are in the lowest class.
         num_classes = 10
-        classes = range(num_classes)
         difference = (max_value - min_value) / num_classes
-        # We are going to do the analysis by segments.
-        # Since we have N-1 segments, one data point has
-        # to be ignored, we will assign each segment the attributes of
-        # N-1, therefore the value in the last point will be ignored.
-        temp_line = []
-        affected_line_data = []
-        affected_line_coordinates = []
-        for i in range(N):
-            dep = float(depth[i].values()[0])
-            affected = classes[0]
-            for level in classes:
-                normalized_depth = dep - min_value
-                level_value = level * difference
-                if normalized_depth > level_value:
-                    affected = level
-
-            # Collect depth and calculated damage
-            result_dict = {'AFFECTED': affected,
-                           'DEPTH': dep}
-
-            # Carry all original attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
-
-            road_impact.append(result_dict)
-
-            if len(temp_line) == 0:
-                # This is the first feature, as explained above,
-                # ignore it for the line calculation.
-                temp_line = [coordinates[i]]
-                continue
-            
-            # Group items into lines when they have the same level
-            # and attributes.
-            same_name = road_impact[i-1]['NAME'] == result_dict['NAME']
-            same_level = road_impact[i-1]['AFFECTED'] == result_dict['AFFECTED']
-
-            if not same_name:
-                affected_line_coordinates.append(temp_line)
-                affected_line_data.append(road_impact[i-1])
-                temp_line = []
-            else:
-                temp_line.append(coordinates[i])
-                if not same_level:
-                    affected_line_coordinates.append(temp_line)
-                    affected_line_data.append(road_impact[i-1])
-                    temp_line = [coordinates[i],]
+        levels = numpy.arange(num_classes) * difference
+        normalized_depth = depth - min_value
+        affected = numpy.digitize(normalized_depth, levels, right=True) - 1
+        affected = numpy.maximum(affected, 0)
+        affected[numpy.isnan(depth)] = 0
+
+        # Merge consecutive pieces of each road at the same level
+        coordinates, offsets, runs = merge_line_pieces(start, end, parent,
+                                                       affected)
+
+        # Maximal depth of each merged line
+        if len(runs) > 0:
+            merged_depth = numpy.fmax.reduceat(depth, runs)
+        else:
+            merged_depth = numpy.zeros(0)
+
+        # Carry all original attributes forward
+        data = {'AFFECTED': affected[runs],
+                'DEPTH': merged_depth}
+        for key in R.get_attribute_names():
+            data[key] = R.get_data(key)[parent[runs]]
 
         # Create report
         caption = ('')
 
-        # Make sure the data and coordinates are in sync.
-        msg = 'Coordinates and data arrays for lines should have the same length'
-        assert len(affected_line_data) == len(affected_line_coordinates), msg
-
         # Create vector layer and return
-        V = Vector(data=affected_line_data,
-                   projection=E.get_projection(),
-                   geometry=affected_line_coordinates,
+        V = Vector(data=data,
+                   projection=R.get_projection(),
+                   geometry=coordinates,
+                   offsets=offsets,
                    name='Estimated roads affected',
                    keywords={'caption': caption},
-                   geometry_type = ogr.wkbLineString,
-                   )
+                   geometry_type=ogr.wkbLineString)
         return V
 
     def generate_style(self, data):
@@ -1,8 +1,377 @@
 """Collection of mappings for standard vulnerability classes
+
+Mappings are expressed as rule tables:
+
+* Bands of numbers of levels given as (minimum, class) pairs. The first
+  band whose minimum does not exceed the number of levels applies.
+  A class of None means that the class depends on the structure.
+* String rules given as (test, patterns, class) triples where test is one
+  of 'equals', 'startswith' or 'contains'. The first matching rule
+  applies.
+
+String rules are evaluated once for each distinct attribute value
+(categorical codes) and bands are evaluated for whole columns, so
+the cost of a mapping is dominated by reading the columns once.
+Mapped classes are cached by a checksum of the attributes they
+depend on.
 """
 import numpy
+import hashlib
+import threading
 from impact.storage.vector import Vector
 
+# Number of mapped class columns kept for reuse (see get_mapping)
+MAPPING_CACHE_SIZE = 4
+mapping_cache = []
+mapping_cache_lock = threading.Lock()
+
+# OSM levels to Padang classes
+OSM_PADANG_LEVELS = [(10, 6),    # High: Concrete shear
+                     (4, 4),     # Mid: RC mid
+                     (1, None)]  # Low: See OSM_PADANG_STRUCTURE
+
+# OSM structure of low buildings to Padang classes (default 2: URM)
+OSM_PADANG_STRUCTURE = [('equals', ['plastered',
+                                    'reinforced masonry',
+                                    'reinforced_masonry'], 7),  # RC low
+                        ('equals', ['confined_masonry'], 8),   # Confined
+                        ('contains', ['kayu', 'wood'], 9)]      # Wood
+
+# SIGAB levels to Padang classes
+SIGAB_PADANG_LEVELS = [(2, 7),     # RC low
+                       (-numpy.inf, None)]
+
+# SIGAB structure of one level buildings to Padang classes (default 2)
+SIGAB_PADANG_STRUCTURE = [('equals', ['beton bertulang'], 6),  # Concrete
+                          ('startswith', ['rangka'], 8),       # Confined
+                          ('contains', ['kayu', 'wood'], 9)]   # Wood
+
+# OSM levels to BNPB classes
+OSM_BNPB_LEVELS = [(4, 'RM'),     # High
+                   (1, None)]     # Low: See OSM_BNPB_STRUCTURE
+
+# OSM structure of low buildings to BNPB classes (default URM)
+OSM_BNPB_STRUCTURE = [('equals', ['reinforced masonry',
+                                  'reinforced_masonry',
+                                  'confined_masonry'], 'RM'),
+                      ('contains', ['kayu', 'wood'], 'RM')]
+
+# SIGAB structure to BNPB classes regardless of levels
+SIGAB_BNPB_STRUCTURE = [('startswith', ['beton', 'kayu'], 'RM')]
+
+# SIGAB levels to BNPB classes for other structures
+SIGAB_BNPB_LEVELS = [(2, 'RM'),
+                     (-numpy.inf, 'URM')]
+
+
+def get_checksum(columns):
+    """Checksum of attribute columns
+
+    Input
+        columns: List of attribute columns (numpy arrays)
+
+    Output
+        Tuple with a checksum of the values of each column
+
+    Numeric columns are identified by a SHA1 digest of their values.
+    Columns of objects such as strings are identified by the hash of
+    their values, which Python computes much faster than a digest of
+    their text. Different object columns may have the same hash, so
+    they must still be compared if their checksums agree.
+    """
+
+    checksum = []
+    for column in columns:
+        if column.dtype.kind == 'O':
+            value = hash(tuple(column.tolist()))
+        else:
+            value = hashlib.sha1(numpy.ascontiguousarray(column)).hexdigest()
+        checksum.append((str(column.dtype), len(column), value))
+
+    return tuple(checksum)
+
+
+def get_mapping(key, columns, function):
+    """Get classes mapped from attribute columns reusing earlier results
+
+    Input
+        key: Name identifying the mapping
+        columns: List of attribute columns the classes depend on
+        function: Function computing the classes from columns
+
+    Output
+        Array of classes as returned by function(*columns). It belongs
+        to the caller and can be modified.
+
+    Classes are cached by key and a checksum of the columns so that
+    mapping the same exposure layer again, e.g. for another hazard
+    scenario, does not repeat the work. The cache keeps its own copies
+    of the classes and of object columns to compare them (see
+    get_checksum).
+    """
+
+    key = (key, get_checksum(columns))
+
+    mapping_cache_lock.acquire()
+    try:
+        for i, (mapping_key, mapping_columns,
+                classes) in enumerate(mapping_cache):
+            if mapping_key != key:
+                continue
+
+            equal = True
+            for column, mapping_column in zip(columns, mapping_columns):
+                if mapping_column is not None and \
+                        not numpy.array_equal(column, mapping_column):
+                    equal = False
+            if equal:
+                # Move to front as most recently used
+                mapping_cache.insert(0, mapping_cache.pop(i))
+                return classes.copy()
+    finally:
+        mapping_cache_lock.release()
+
+    # Map classes without holding the lock
+    classes = function(*columns)
+    mapping_columns = []
+    for column in columns:
+        if column.dtype.kind == 'O':
+            mapping_columns.append(column.copy())
+        else:
+            mapping_columns.append(None)
+    entry = (key, mapping_columns, classes.copy())
+
+    mapping_cache_lock.acquire()
+    try:
+        mapping_cache.insert(0, entry)
+        del mapping_cache[MAPPING_CACHE_SIZE:]
+    finally:
+        mapping_cache_lock.release()
+
+    return classes
+
+
+def encode_categories(column):
+    """Categorical codes for attribute column
+
+    Input
+        column: Array of N attribute values (any hashable values)
+
+    Output
+        values: List of distinct values in order of first appearance
+        codes: Integer array of length N such that
+               column[i] == values[codes[i]]
+    """
+
+    table = {}
+    codes = numpy.fromiter((table.setdefault(x, len(table))
+                            for x in column),
+                           dtype='i8', count=len(column))
+
+    values = [None] * len(table)
+    for x, code in table.iteritems():
+        values[code] = x
+
+    return values, codes
+
+
+def map_categories(column, function):
+    """Apply function to attribute column once for each distinct value
+
+    Input
+        column: Array of N attribute values
+        function: Function of one attribute value
+
+    Output
+        Array of N results, i.e. function(column[i]) for each i
+    """
+
+    values, codes = encode_categories(column)
+    results = numpy.empty(len(values), dtype=object)
+    for i, x in enumerate(values):
+        results[i] = function(x)
+
+    if len(values) > 0 and all([isinstance(x, (int, long, float))
+                                for x in results]):
+        results = numpy.array(results.tolist())
+
+    return results[codes]
+
+
+def match_rules(value, rules, default):
+    """Class of string value according to the first matching rule
+
+    Input
+        value: String
+        rules: List of (test, patterns, class) rules (see module header)
+        default: Class to use if no rule matches
+
+    Output
+        Class of value
+    """
+
+    for test, patterns, result in rules:
+        for pattern in patterns:
+            if test == 'equals':
+                match = value == pattern
+            elif test == 'startswith':
+                match = value.startswith(pattern)
+            elif test == 'contains':
+                match = pattern in value
+            else:
+                msg = 'Unknown test in mapping rule: %s' % test
+                raise Exception(msg)
+
+            if match:
+                return result
+
+    return default
+
+
+def map_rules(column, rules, default):
+    """Map column of strings to classes using rules
+
+    Input
+        column: Array of N strings
+        rules: List of (test, patterns, class) rules (see module header)
+        default: Class to use if no rule matches
+
+    Output
+        Array of N classes
+    """
+
+    return map_categories(column,
+                          lambda x: match_rules(x, rules, default))
+
+
+def apply_bands(levels, bands):
+    """Find band of numbers of levels
+
+    Input
+        levels: Array of N numbers of levels (NaN if missing)
+        bands: List of (minimum, class) bands (see module header)
+
+    Output
+        Integer array with index of the first band whose minimum does not
+        exceed the number of levels or -1 if there is no such band.
+    """
+
+    conditions = [levels >= minimum for minimum, result in bands]
+    return numpy.select(conditions, range(len(bands)), -1)
+
+
+def get_missing(column):
+    """Find missing (None) values in attribute column
+    """
+
+    if column.dtype.kind == 'O':
+        return numpy.equal(column, None)
+    else:
+        return numpy.zeros(len(column), dtype=bool)
+
+
+def get_levels(column, missing):
+    """Convert column of numbers of levels to floating point values
+
+    Input
+        column: Array of numbers of levels
+        missing: Boolean array which is True where levels are unknown
+
+    Output
+        Array of levels with NaN where missing is True
+    """
+
+    levels = numpy.zeros(len(column), dtype='d')
+    levels[:] = numpy.nan
+
+    I = numpy.logical_not(missing)
+    levels[I] = column[I].astype('d')
+    return levels
+
+
+def make_classes(N, default):
+    """Create array of N classes all equal to default
+    """
+
+    if isinstance(default, basestring):
+        classes = numpy.empty(N, dtype=object)
+    else:
+        classes = numpy.empty(N, dtype=type(default))
+    classes[:] = default
+    return classes
+
+
+def map_osm_levels_and_structure(levels, structure, level_bands,
+                                 structure_rules, default):
+    """Map OSM levels and structure to vulnerability classes
+
+    Input
+        levels, structure: OSM attribute columns
+        level_bands: Bands of levels (see module header)
+        structure_rules: Rules for structures of buildings in bands
+                         with class None
+        default: Class of buildings without levels or structure,
+                 with 0 levels and with structures matching no rule
+
+    Output
+        Array of classes
+    """
+
+    N = len(levels)
+    missing = get_missing(levels) | get_missing(structure)
+    values = get_levels(levels, missing)
+
+    classes = make_classes(N, default)
+    band = apply_bands(values, level_bands)
+    for i, (minimum, result) in enumerate(level_bands):
+        I = numpy.flatnonzero((band == i) & numpy.logical_not(missing))
+        if result is None:
+            classes[I] = map_rules(structure[I], structure_rules, default)
+        else:
+            classes[I] = result
+
+    # A few buildings exist with 0 levels.
+    # In general, we should be assigning here the most
+    # frequent building in the area which could be defined
+    # by admin boundaries.
+    zero = numpy.abs(values) <= 1.0e-8
+
+    unknown = (band == -1) & numpy.logical_not(missing | zero)
+    if numpy.any(unknown):
+        msg = 'Unknown number of levels: %s' % levels[unknown][0]
+        raise Exception(msg)
+
+    return classes
+
+
+def add_class_attribute(E, classes, target_attribute, name):
+    """Create vector layer like E with one new attribute
+
+    Input
+        E: Vector layer
+        classes: Array of values of new attribute
+        target_attribute: Name of new attribute
+        name: Name of new layer
+
+    Output
+        Vector layer with the geometry and attributes of E and the
+        new attribute. Attribute columns are shared with E.
+    """
+
+    data = {}
+    for key in E.get_attribute_names():
+        data[key] = E.get_data(key)
+    data[target_attribute] = classes
+
+    coordinates, offsets = E.get_packed_geometry()
+    return Vector(data=data,
+                  projection=E.get_projection(),
+                  geometry=coordinates,
+                  offsets=offsets,
+                  geometry_type=E.geometry_type,
+                  name=name,
+                  keywords=E.get_keywords())
+
 
 def osm2padang(E):
     """Map OSM attributes to Padang vulnerability classes
@@ -36,6 +405,8 @@ def osm2padang(E):
        building type = 8 "Confined Masonry"
     6. Where height band = low and structure = unreinforced_masonry then
        building type = 2 "URM with Metal Roof"
+
+    The rules are given in OSM_PADANG_LEVELS and OSM_PADANG_STRUCTURE.
     """
 
     # Input check
@@ -47,68 +418,37 @@ def osm2padang(E):
         assert attribute in actual, msg
 
     # Start mapping
-    N = len(E)
-    attributes = E.get_data()
-    count = 0
-    for i in range(N):
-        levels = E.get_data('levels', i)
-        structure = E.get_data('structure', i)
-        if levels is None or structure is None:
-            vulnerability_class = 2
-            count += 1
-        else:
-            if levels >= 10:
-                # High
-                vulnerability_class = 6  # Concrete shear
-            elif 4 <= levels < 10:
-                # Mid
-                vulnerability_class = 4  # RC mid
-            elif 1 <= levels < 4:
-                # Low
-                if structure in ['plastered',
-                                 'reinforced masonry',
-                                 'reinforced_masonry']:
-                    vulnerability_class = 7  # RC low
-                elif structure == 'confined_masonry':
-                    vulnerability_class = 8  # Confined
-                elif 'kayu' in structure or 'wood' in structure:
-                    vulnerability_class = 9  # Wood
-                else:
-                    vulnerability_class = 2  # URM
-            elif numpy.allclose(levels, 0):
-                # A few buildings exist with 0 levels.
-
-                # In general, we should be assigning here the most
-                # frequent building in the area which could be defined
-                # by admin boundaries.
-                vulnerability_class = 2
-            else:
-                msg = 'Unknown number of levels: %s' % levels
-                raise Exception(msg)
-
-        # Store new attribute value
-        attributes[i]['VCLASS'] = vulnerability_class
-
-        # Selfcheck for use with osm_080811.shp
-        if E.get_name() == 'osm_080811':
-            if levels > 0:
-                msg = ('Got %s expected %s. levels = %f, structure = %s'
-                       % (vulnerability_class,
-                          attributes[i]['TestBLDGCl'],
-                          levels,
-                          structure))
-                assert numpy.allclose(attributes[i]['TestBLDGCl'],
-                                      vulnerability_class), msg
-
-    #print 'Got %i without levels or structure (out of %i total)' % (count, N)
+    levels = E.get_data('levels')
+    structure = E.get_data('structure')
+    def function(levels, structure):
+        return map_osm_levels_and_structure(levels, structure,
+                                            OSM_PADANG_LEVELS,
+                                            OSM_PADANG_STRUCTURE, 2)
+
+    vulnerability_class = get_mapping('osm2padang', [levels, structure],
+                                      function)
+
+    # Selfcheck for use with osm_080811.shp
+    if E.get_name() == 'osm_080811':
+        values = get_levels(levels, get_missing(levels))
+        I = numpy.flatnonzero(values > 0)
+        expected = E.get_data('TestBLDGCl')[I]
+        ok = numpy.isclose(numpy.array(expected, dtype='d'),
+                           vulnerability_class[I])
+        if not numpy.all(ok):
+            i = I[numpy.logical_not(ok)][0]
+            msg = ('Got %s expected %s. levels = %f, structure = %s'
+                   % (vulnerability_class[i],
+                      E.get_data('TestBLDGCl')[i],
+                      values[i],
+                      structure[i]))
+            raise AssertionError(msg)
 
     # Create new vector instance and return
-    V = Vector(data=attributes,
-               projection=E.get_projection(),
-               geometry=E.get_geometry(),
-               name=E.get_name() + ' mapped to Padang vulnerability classes',
-               keywords=E.get_keywords())
-    return V
+    return add_class_attribute(E, vulnerability_class, 'VCLASS',
+                               E.get_name() + ' mapped to Padang '
+                               'vulnerability classes')
+
 
 def sigab2padang(E):
     """Map SIGAB attributes to Padang vulnerability classes
@@ -120,6 +460,7 @@ def sigab2padang(E):
         Vector object like E, but with one new attribute ('VCLASS')
         representing the vulnerability class used in the Padang dataset
 
+    The rules are given in SIGAB_PADANG_LEVELS and SIGAB_PADANG_STRUCTURE.
     """
 
     # Input check
@@ -131,52 +472,35 @@ def sigab2padang(E):
     for attribute in required:
         assert attribute in actual, msg
 
-    # Start mapping
-    N = len(E)
-    attributes = E.get_data()
-    for i in range(N):
-        levels = E.get_data('Tingkat', i).lower()
-        structure = E.get_data('Struktur_B', i).lower()
-        roof_type = E.get_data('Atap', i).lower()
-        wall_type = E.get_data('Dinding', i).lower()
-        floor_type = E.get_data('Lantai', i).lower()
-        if levels == 'none' or structure == 'none':
-            vulnerability_class = 2
-        else:
-            if int(levels) >= 2:
-                vulnerability_class = 7  # RC low
+    def function(levels, structure):
+        levels = map_categories(levels, lambda x: x.lower())
+        structure = map_categories(structure, lambda x: x.lower())
+
+        vulnerability_class = make_classes(len(levels), 2)
+        I = numpy.flatnonzero((levels != 'none') & (structure != 'none'))
+        values = map_categories(levels[I], int)
+        band = apply_bands(values, SIGAB_PADANG_LEVELS)
+        for i, (minimum, result) in enumerate(SIGAB_PADANG_LEVELS):
+            J = I[band == i]
+            if result is None:
+                vulnerability_class[J] = map_rules(structure[J],
+                                                   SIGAB_PADANG_STRUCTURE,
+                                                   2)
             else:
-                # Low
-                if structure in ['beton bertulang']:
-                    vulnerability_class = 6  # Concrete shear
-                elif structure.startswith('rangka'):
-                    vulnerability_class = 8  # Confined
-                elif 'kayu' in structure or 'wood' in structure:
-                    vulnerability_class = 9  # Wood
-                else:
-                    vulnerability_class = 2  # URM
-
-        # Store new attribute value
-        attributes[i]['VCLASS'] = vulnerability_class
-
-        # Selfcheck for use with osm_080811.shp
-        if E.get_name() == 'osm_080811':
-            if levels > 0:
-                msg = ('Got %s expected %s. levels = %f, structure = %s'
-                       % (vulnerability_class,
-                          attributes[i]['TestBLDGCl'],
-                          levels,
-                          structure))
-                assert numpy.allclose(attributes[i]['TestBLDGCl'],
-                                      vulnerability_class), msg
+                vulnerability_class[J] = result
+
+        return vulnerability_class
+
+    # Start mapping
+    vulnerability_class = get_mapping('sigab2padang',
+                                      [E.get_data('Tingkat'),
+                                       E.get_data('Struktur_B')],
+                                      function)
 
     # Create new vector instance and return
-    V = Vector(data=attributes,
-               projection=E.get_projection(),
-               geometry=E.get_geometry(),
-               name=E.get_name() + ' mapped to Padang vulnerability classes',
-               keywords=E.get_keywords())
-    return V
+    return add_class_attribute(E, vulnerability_class, 'VCLASS',
+                               E.get_name() + ' mapped to Padang '
+                               'vulnerability classes')
 
 
 def osm2bnpb(E, target_attribute='VCLASS'):
@@ -196,6 +520,8 @@ def osm2bnpb(E, target_attribute='VCLASS'):
     Output:
         Vector object like E, but with one new attribute (e.g. 'VCLASS')
         representing the vulnerability class used in the guidelines
+
+    The rules are given in OSM_BNPB_LEVELS and OSM_BNPB_STRUCTURE.
     """
 
     # Input check
@@ -207,53 +533,20 @@ def osm2bnpb(E, target_attribute='VCLASS'):
         assert attribute in actual, msg
 
     # Start mapping
-    N = len(E)
-    attributes = E.get_data()
-    count = 0
-    for i in range(N):
-        levels = E.get_data('levels', i)
-        structure = E.get_data('structure', i)
-        if levels is None or structure is None:
-            vulnerability_class = 'URM'
-            count += 1
-        else:
-            if levels >= 4:
-                # High
-                vulnerability_class = 'RM'
-            elif 1 <= levels < 4:
-                # Low
-                if structure in ['reinforced masonry',
-                                 'reinforced_masonry']:
-                    vulnerability_class = 'RM'
-                elif structure == 'confined_masonry':
-                    vulnerability_class = 'RM'
-                elif 'kayu' in structure or 'wood' in structure:
-                    vulnerability_class = 'RM'
-                else:
-                    vulnerability_class = 'URM'
-            elif numpy.allclose(levels, 0):
-                # A few buildings exist with 0 levels.
-
-                # In general, we should be assigning here the most
-                # frequent building in the area which could be defined
-                # by admin boundaries.
-                vulnerability_class = 'URM'
-            else:
-                msg = 'Unknown number of levels: %s' % levels
-                raise Exception(msg)
-
-        # Store new attribute value
-        attributes[i][target_attribute] = vulnerability_class
+    def function(levels, structure):
+        return map_osm_levels_and_structure(levels, structure,
+                                            OSM_BNPB_LEVELS,
+                                            OSM_BNPB_STRUCTURE, 'URM')
 
-    #print 'Got %i without levels or structure (out of %i total)' % (count, N)
+    vulnerability_class = get_mapping('osm2bnpb',
+                                      [E.get_data('levels'),
+                                       E.get_data('structure')],
+                                      function)
 
     # Create new vector instance and return
-    V = Vector(data=attributes,
-               projection=E.get_projection(),
-               geometry=E.get_geometry(),
-               name=E.get_name() + ' mapped to BNPB vulnerability classes',
-               keywords=E.get_keywords())
-    return V
+    return add_class_attribute(E, vulnerability_class, target_attribute,
+                               E.get_name() + ' mapped to BNPB '
+                               'vulnerability classes')
 
 
 def unspecific2bnpb(E, target_attribute='VCLASS'):
@@ -273,21 +566,11 @@ def unspecific2bnpb(E, target_attribute='VCLASS'):
         representing the vulnerability class used in the guidelines
     """
 
-    # Start mapping
-    N = len(E)
-    attributes = E.get_data()
-    count = 0
-    for i in range(N):
-        # Store new attribute value
-        attributes[i][target_attribute] = 'URM'
-
     # Create new vector instance and return
-    V = Vector(data=attributes,
-               projection=E.get_projection(),
-               geometry=E.get_geometry(),
-               name=E.get_name() + ' mapped to BNPB vulnerability class URM',
-               keywords=E.get_keywords())
-    return V
+    return add_class_attribute(E, make_classes(len(E), 'URM'),
+                               target_attribute,
+                               E.get_name() + ' mapped to BNPB '
+                               'vulnerability class URM')
 
 
 def sigab2bnpb(E, target_attribute='VCLASS'):
@@ -302,6 +585,8 @@ def sigab2bnpb(E, target_attribute='VCLASS'):
     Output:
         Vector object like E, but with one new attribute (e.g. 'VCLASS')
         representing the vulnerability class used in the guidelines
+
+    The rules are given in SIGAB_BNPB_STRUCTURE and SIGAB_BNPB_LEVELS.
     """
 
     # Input check
@@ -313,35 +598,35 @@ def sigab2bnpb(E, target_attribute='VCLASS'):
     for attribute in required:
         assert attribute in actual, msg
 
-    # Start mapping
-    N = len(E)
-    attributes = E.get_data()
-    for i in range(N):
-        levels = E.get_data('Tingkat', i).lower()
-        structure = E.get_data('Struktur_B', i).lower()
-        roof_type = E.get_data('Atap', i).lower()
-        wall_type = E.get_data('Dinding', i).lower()
-        floor_type = E.get_data('Lantai', i).lower()
-        if levels == 'none' or structure == 'none':
-            vulnerability_class = 'URM'
-        elif structure.startswith('beton') or structure.startswith('kayu'):
-            vulnerability_class = 'RM'
-        else:
-            if int(levels) >= 2:
-                vulnerability_class = 'RM'
-            else:
-                vulnerability_class = 'URM'
+    def function(levels, structure):
+        levels = map_categories(levels, lambda x: x.lower())
+        structure = map_categories(structure, lambda x: x.lower())
 
-        # Store new attribute value
-        attributes[i][target_attribute] = vulnerability_class
+        vulnerability_class = make_classes(len(levels), 'URM')
+        I = numpy.flatnonzero((levels != 'none') & (structure != 'none'))
+        vulnerability_class[I] = map_rules(structure[I],
+                                           SIGAB_BNPB_STRUCTURE, None)
+
+        # Other structures depend on the number of levels
+        I = I[numpy.equal(vulnerability_class[I], None)]
+        values = map_categories(levels[I], int)
+        band = apply_bands(values, SIGAB_BNPB_LEVELS)
+        results = numpy.array([result for minimum, result
+                               in SIGAB_BNPB_LEVELS], dtype=object)
+        vulnerability_class[I] = results[band]
+
+        return vulnerability_class
+
+    # Start mapping
+    vulnerability_class = get_mapping('sigab2bnpb',
+                                      [E.get_data('Tingkat'),
+                                       E.get_data('Struktur_B')],
+                                      function)
 
     # Create new vector instance and return
-    V = Vector(data=attributes,
-               projection=E.get_projection(),
-               geometry=E.get_geometry(),
-               name=E.get_name() + ' mapped to BNPB vulnerability classes',
-               keywords=E.get_keywords())
-    return V
+    return add_class_attribute(E, vulnerability_class, target_attribute,
+                               E.get_name() + ' mapped to BNPB '
+                               'vulnerability classes')
 
 
 
@@ -2,6 +2,7 @@ from django.template.loader import render_to_string
 from impact.plugins.core import FunctionProvider
 from impact.plugins.core import get_hazard_layer, get_exposure_layer
 from impact.storage.vector import Vector
+import numpy
 
 # FIXME: Need style for this and allow the name to
 # be different from Percen_da
@@ -32,47 +33,23 @@ class TephraImpactFunction(FunctionProvider):
         # Interpolate hazard level to building locations
         H = H.interpolate(E, 'load')
 
-        # Calculate building damage
-        count3 = 0
-        count2 = 0
-        count1 = 0
-        count0 = 0
-        result = []
-        for i in range(len(E)):
-
-            #-------------------
-            # Extract parameters
-            #-------------------
-            load = H.get_data('load', i)
-
-            #------------------------
-            # Compute damage level
-            #------------------------
-
-            # FIXME: The thresholds have been greatly reduced
-            # for the purpose of demonstration. Any real analyis
-            # should bring them back to 0, 90, 150, 300
-            if 0.01 <= load < 0.5:
-                # Loss of crops and livestock
-                impact = 0
-                count0 += 1
-            elif 0.5 <= load < 2.0:
-                # Cosmetic damage
-                impact = 1
-                count1 += 1
-            elif 2.0 <= load < 10.0:
-                # Partial building collapse
-                impact = 2
-                count2 += 1
-            elif load >= 10.0:
-                # Complete building collapse
-                impact = 3
-                count3 += 1
-            else:
-                impact = 0
-                count0 += 1
-
-            result.append({'DAMAGE': impact, 'ASHLOAD': load})
+        # Extract parameters
+        load = H.get_data('load')
+
+        # Compute damage level
+        # FIXME: The thresholds have been greatly reduced
+        # for the purpose of demonstration. Any real analyis
+        # should bring them back to 0, 90, 150, 300
+        #   0: Loss of crops and livestock (and loads below 0.01)
+        #   1: Cosmetic damage
+        #   2: Partial building collapse
+        #   3: Complete building collapse
+        impact = numpy.select([load >= 10.0, load >= 2.0, load >= 0.5],
+                              [3, 2, 1], 0)
+        result = {'DAMAGE': impact, 'ASHLOAD': load}
+
+        # Count buildings in each damage level
+        count0, count1, count2, count3 = numpy.bincount(impact, minlength=4)
 
         # Create report
         caption = ('<font size="3"> <table border="0" width="320px">'
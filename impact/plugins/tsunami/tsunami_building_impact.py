@@ -6,6 +6,7 @@ from django.utils.translation import ugettext as _
 from impact.plugins.utilities import PointZoomSize
 from impact.plugins.utilities import PointClassColor
 from impact.plugins.utilities import PointSymbol
+import numpy
 import scipy.stats
 
 
@@ -36,47 +37,30 @@ class TsunamiBuildingImpactFunction(FunctionProvider):
         #print 'Number of polygons', len(E)
 
         # Interpolate hazard level to building locations
-        H = H.interpolate(E)
+        H = H.interpolate(E, 'DEPTH')
 
         # Extract relevant numerical data
         coordinates = E.get_geometry()
-        depth = H.get_data()
-        N = len(depth)
+        depth = H.get_data('DEPTH')
 
         # List attributes to carry forward to result layer
         attributes = E.get_attribute_names()
 
-        # Calculate building impact according to guidelines
-        count3 = 0
-        count1 = 0
-        count0 = 0
-        population_impact = []
-        for i in range(N):
-
-            # Get depth
-            dep = float(depth[i].values()[0])
-
-            # Classify buildings according to depth
-            if dep >= 3:
-                affected = 3  # FIXME: Colour upper bound is 100 but
-                count3 += 1          # does not catch affected == 100
-            elif 1 <= dep < 3:
-                affected = 2
-                count1 += 1
-            else:
-                affected = 1
-                count0 += 1
-
-            # Collect depth and calculated damage
-            result_dict = {self.target_field: affected,
-                           'DEPTH': dep}
-
-            # Carry all original attributes forward
-            for key in attributes:
-                result_dict[key] = E.get_data(key, i)
-
-            # Record result for this feature
-            population_impact.append(result_dict)
+        # Classify buildings according to depth
+        # FIXME: Colour upper bound is 100 but does not catch affected == 100
+        affected = numpy.select([depth >= 3, depth >= 1], [3, 2], 1)
+
+        # Collect depth and calculated damage
+        population_impact = {self.target_field: affected,
+                             'DEPTH': depth}
+
+        # Carry all original attributes forward
+        for key in attributes:
+            population_impact[key] = E.get_data(key)
+
+        # Count buildings in each class
+        counts = numpy.bincount(affected, minlength=4)
+        count0, count1, count3 = counts[1:]
 
         # Create report
         caption = ('<table border="0" width="320px">'
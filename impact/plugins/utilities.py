@@ -1,8 +1,10 @@
-"""Module to create damage curves from point data
+"""Module to create damage curves from point data and to evaluate
+fragility curves
 """
 
 import numpy
 from scipy.interpolate import interp1d
+from scipy.special import ndtr
 
 
 class Damage_curve:
@@ -28,10 +30,239 @@ class Damage_curve:
 
         self.curve = interp1d(x, y)
 
+        # Hazard levels where the curve may have kinks
+        self.breakpoints = x
+
     def __call__(self, x):
         return self.curve(x)
 
 
+def lognormal_cdf(x, median, beta):
+    """Cumulative lognormal distribution evaluated for arrays
+
+    Input
+        x: Array of hazard levels, e.g. MMI
+        median: Median of distribution (scalar or array like x)
+        beta: Standard deviation of log(x) (scalar or array like x)
+
+    Output
+        Array of probabilities. Levels <= 0 give 0 and NaN gives NaN.
+
+    This is the same as scipy.stats.lognorm.cdf(x, beta, scale=median)
+    but evaluated in one call to scipy.special.ndtr without the
+    overhead of scipy.stats distributions.
+    """
+
+    x = numpy.asarray(x, dtype='d')
+    median = numpy.asarray(median, dtype='d')
+    beta = numpy.asarray(beta, dtype='d')
+
+    # Avoid log(0) and log of negative numbers where the result is 0
+    positive = x > 0
+    y = numpy.where(positive, x, 1.0) / median
+
+    P = ndtr(numpy.log(y) / beta)
+    P = numpy.where(positive, P, 0.0)
+    return numpy.where(numpy.isnan(x), numpy.nan, P)
+
+
+def lognormal_fragility(x, classes, curves, key=None):
+    """Evaluate lognormal fragility curves for features of several classes
+
+    Input
+        x: Array of hazard levels, one for each feature
+        classes: Array of class labels, one for each feature
+        curves: Dictionary of lognormal curves for each class given as
+                dictionaries with keys 'median' and 'beta'
+        key: Optional function mapping class labels to keys of curves,
+             e.g. lambda c: str(int(c)). Default is to use labels as keys.
+
+    Output
+        Array of probabilities of damage, one for each feature
+
+    Curve parameters are looked up once for each distinct class and
+    gathered into arrays, so that all features are evaluated together.
+    """
+
+    labels, index = numpy.unique(classes, return_inverse=True)
+    medians = numpy.zeros(len(labels))
+    betas = numpy.zeros(len(labels))
+    for i, label in enumerate(labels):
+        if key is not None:
+            label = key(label)
+
+        msg = ('No fragility curve for class %s. Available classes '
+               'are %s' % (label, curves.keys()))
+        assert label in curves, msg
+
+        medians[i] = curves[label]['median']
+        betas[i] = curves[label]['beta']
+
+    return lognormal_cdf(x, medians[index], betas[index])
+
+
+class Fragility_table:
+    """Fragility curves tabulated on a fine grid of hazard levels
+
+    Input
+        curves: Dictionary of curves for each class. Each curve is either
+                a dictionary with keys 'median' and 'beta' for a lognormal
+                curve or a function of hazard level such as Damage_curve.
+        minimum, maximum: Range of hazard levels covered by the table
+        step: Spacing of hazard levels in the table
+
+    All curves are evaluated once on the grid of hazard levels when the
+    table is created, e.g. when a plugin is loaded. Calling the table
+    then evaluates the curves for any number of features by indexed
+    lookup and linear blending between the two nearest grid levels.
+
+    The attribute error_bound is the largest difference between table
+    lookup and exact evaluation of the curves. For smooth curves the
+    error of linear interpolation is largest at the midpoints between
+    grid levels, where it is about step**2 / 8 times the largest second
+    derivative of the curve. This is less than 1.0e-6 for the Padang
+    curves with the default step. Piecewise linear curves such as
+    Damage_curve have their largest error at one of their breakpoints,
+    which are therefore measured too. For other functions of hazard
+    level the bound is only as good as their smoothness between grid
+    levels. Hazard levels outside the table are evaluated exactly.
+    """
+
+    def __init__(self, curves, minimum=0.0, maximum=15.0, step=0.001):
+
+        msg = ('Table must cover at least one step. I got minimum = %f, '
+               'maximum = %f and step = %f' % (minimum, maximum, step))
+        assert step > 0 and maximum - minimum >= step, msg
+
+        self.curves = curves
+        self.labels = sorted(curves.keys())
+        self.minimum = minimum
+        self.step = step
+
+        # Parameters of lognormal curves by row
+        self.medians = None
+        self.betas = None
+        if all([isinstance(curves[label], dict) for label in self.labels]):
+            self.medians = numpy.array([curves[label]['median']
+                                        for label in self.labels])
+            self.betas = numpy.array([curves[label]['beta']
+                                      for label in self.labels])
+
+        n = int(round((maximum - minimum) / step)) + 1
+        self.levels = minimum + numpy.arange(n) * step
+        midpoints = self.levels[:-1] + step / 2
+
+        self.table = numpy.zeros((len(self.labels), n))
+        self.error_bound = 0.0
+        for k, label in enumerate(self.labels):
+            self.table[k, :] = self.evaluate_curve(label, self.levels)
+
+            # Measure error at midpoints and breakpoints inside the table
+            x = midpoints
+            breakpoints = getattr(self.curves[label], 'breakpoints', None)
+            if breakpoints is not None:
+                breakpoints = numpy.asarray(breakpoints, dtype='d')
+                I = (breakpoints > self.levels[0]) & \
+                    (breakpoints < self.levels[-1])
+                x = numpy.concatenate([x, breakpoints[I]])
+
+            exact = self.evaluate_curve(label, x)
+            approximate = self(x, [label] * len(x))
+            error = numpy.nanmax(numpy.abs(exact - approximate))
+            self.error_bound = max(self.error_bound, error)
+
+    def evaluate_curve(self, label, x):
+        """Evaluate curve for one class exactly
+
+        Input
+            label: Class label (key in curves)
+            x: Array of hazard levels
+
+        Output
+            Array of values of the curve
+        """
+
+        curve = self.curves[label]
+        if isinstance(curve, dict):
+            return lognormal_cdf(x, curve['median'], curve['beta'])
+        else:
+            return numpy.asarray(curve(x), dtype='d')
+
+    def __call__(self, x, classes, key=None, mode='table'):
+        """Evaluate curves for features of several classes
+
+        Input
+            x: Array of hazard levels, one for each feature
+            classes: Array of class labels, one for each feature
+            key: Optional function mapping class labels to keys of curves,
+                 e.g. lambda c: str(int(c)). Default is to use labels.
+            mode: 'table' (default) for table lookup or 'exact' for
+                  evaluating the curves directly
+
+        Output
+            Array of values of the curves, one for each feature
+        """
+
+        msg = ('Fragility table mode must be either "table" or "exact". '
+               'I got %s' % mode)
+        assert mode in ['table', 'exact'], msg
+
+        x = numpy.asarray(x, dtype='d')
+
+        # Row of table for each feature
+        labels, index = numpy.unique(classes, return_inverse=True)
+        rows = numpy.zeros(len(labels), dtype='i8')
+        for i, label in enumerate(labels):
+            if key is not None:
+                label = key(label)
+
+            msg = ('No fragility curve for class %s. Available classes '
+                   'are %s' % (label, self.labels))
+            assert label in self.curves, msg
+
+            rows[i] = self.labels.index(label)
+        rows = rows[index]
+
+        P = numpy.zeros(len(x), dtype='d')
+        if mode == 'table':
+            # Position of hazard levels in the table
+            n = len(self.levels)
+            u = (x - self.minimum) / self.step
+            inside = (u >= 0) & (u <= n - 1)
+
+            I = numpy.flatnonzero(inside)
+            i = numpy.minimum(numpy.floor(u[I]).astype('i8'), n - 2)
+            w = u[I] - i
+
+            # Blend the two nearest table entries
+            table = self.table.ravel()
+            f = rows[I] * n + i
+            P[I] = table.take(f) * (1 - w) + table.take(f + 1) * w
+
+            # Levels outside table or without data
+            J = numpy.flatnonzero(numpy.logical_not(inside))
+        else:
+            J = numpy.arange(len(x))
+
+        # Evaluate remaining levels exactly
+        if self.medians is not None:
+            # Lognormal curves are evaluated for all classes together
+            P[J] = lognormal_cdf(x[J], self.medians[rows[J]],
+                                 self.betas[rows[J]])
+            return P
+
+        # Other curves are evaluated one class at a time
+        J = J[numpy.argsort(rows[J], kind='mergesort')]
+        bounds = numpy.searchsorted(rows[J],
+                                    numpy.arange(len(self.labels) + 1))
+        for k, label in enumerate(self.labels):
+            K = J[bounds[k]:bounds[k + 1]]
+            if len(K) > 0:
+                P[K] = self.evaluate_curve(label, x[K])
+
+        return P
+
+
 class ColorMapEntry:
     """Representation of color map entry in SLD file
 
@@ -0,0 +1,388 @@
+"""Cache of downloaded layers on disk
+
+Downloaded layer files (GeoTIFF or shapefile with keywords) are kept in
+a directory for each entry of the cache. Entries are keyed by server,
+layer name, bounding box, resolution and a checksum of the source (see
+layer_cache_key).
+
+The data of raster layers is also stored in their entry as a raw numpy
+array (.npy) that can be memory mapped, so repeated calculations over
+the same area neither download nor decode the data again.
+
+The least recently used entries, including their raster data, are
+deleted when the cache exceeds a given number of bytes. Entries used
+within the last MIN_AGE seconds are never deleted as they may still be
+being read. Entries record the name of their layer so that they can be
+removed when the layer is uploaded again (see remove_layer_from_cache).
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy
+import hashlib
+import tempfile
+
+from impact.storage.raster import Raster
+
+# Seconds after their last use during which entries are not deleted
+MIN_AGE = 60
+
+# File within each entry recording the layer it holds
+LAYER_INFO = 'layer.json'
+
+
+def metadata_checksum(metadata):
+    """Calculate checksum identifying the revision of a layer
+
+    Input
+        metadata: Dictionary of layer metadata as returned by get_metadata
+
+    Output
+        Hexadecimal SHA1 digest of the metadata.
+
+    The metadata (bounding box, geotransform, keywords, etc) changes when
+    a layer is uploaded again so this identifies the source data without
+    having to download it.
+    """
+
+    s = json.dumps(metadata, sort_keys=True, default=str)
+    return hashlib.sha1(s).hexdigest()
+
+
+def layer_cache_key(server_url, layer_name, bbox, resolution, checksum):
+    """Make cache key for downloaded layer
+
+    Input
+        server_url: URL of server providing the layer
+        layer_name: Name of layer
+        bbox: Bounding box as a list or string [west, south, east, north]
+        resolution: 2-tuple (resx, resy) or None for vector layers
+        checksum: String identifying the source data (see metadata_checksum)
+
+    Output
+        Hexadecimal SHA1 digest to be used as the name of the cache entry
+
+    Bounding box and resolution are normalised so that equivalent requests
+    get the same key.
+    """
+
+    if isinstance(bbox, basestring):
+        bbox = bbox.split(',')
+
+    bbox_string = ','.join(['%.6f' % float(x) for x in bbox])
+    if resolution is None:
+        res_string = 'native'
+    else:
+        res_string = ','.join(['%.12f' % float(x) for x in resolution])
+
+    s = '|'.join([server_url, layer_name, bbox_string, res_string, checksum])
+    return hashlib.sha1(s).hexdigest()
+
+
+def write_raster_to_cache(R, cachedir, key):
+    """Store raster data in cache
+
+    Input
+        R: Raster layer
+        cachedir: Directory holding the cache
+        key: Name of cache entry (see layer_cache_key). The entry is
+             created if needed, but is usually the one holding the file
+             R was read from (see add_file_to_cache).
+
+    Data is stored as double precision with nodata values represented by
+    the standard -9999 assumed for raster layers in memory. It is first
+    written to temporary files and then renamed so that concurrent
+    readers never see incomplete data.
+    """
+
+    entry = os.path.join(cachedir, key)
+    if not os.path.isdir(entry):
+        try:
+            os.makedirs(entry)
+        except OSError:
+            # Directory may have been created by another process
+            pass
+
+    A = R.get_data(nan=False, scaling=False)
+    A = numpy.array(A, dtype='d', copy=False)
+
+    nodata = R.get_nodata_value()
+    if nodata != -9999:
+        A[A == nodata] = -9999
+
+    header = {'projection': R.get_projection(),
+              'geotransform': list(R.get_geotransform()),
+              'name': R.get_name(),
+              'keywords': R.get_keywords()}
+
+    basename = os.path.join(entry, 'raster')
+
+    try:
+        # Header first as presence of the data file marks complete data
+        fid, tmpname = tempfile.mkstemp(dir=entry, suffix='.tmp')
+        f = os.fdopen(fid, 'w')
+        json.dump(header, f)
+        f.close()
+        os.rename(tmpname, basename + '.json')
+
+        fid, tmpname = tempfile.mkstemp(dir=entry, suffix='.tmp')
+        f = os.fdopen(fid, 'wb')
+        numpy.save(f, A)
+        f.close()
+        os.rename(tmpname, basename + '.npy')
+    except (OSError, IOError):
+        # Entry was evicted by another process
+        pass
+
+
+def read_raster_from_cache(cachedir, key):
+    """Get raster layer from cache
+
+    Input
+        cachedir: Directory holding the cache
+        key: Name of cache entry (see layer_cache_key)
+
+    Output
+        Raster layer whose data is memory mapped from the cache (read only)
+        or None if key is not in the cache.
+
+    The entry is marked as used so that it is evicted last.
+    """
+
+    entry = os.path.join(cachedir, key)
+    basename = os.path.join(entry, 'raster')
+    try:
+        os.utime(entry, None)
+        f = open(basename + '.json')
+        header = json.load(f)
+        f.close()
+
+        A = numpy.load(basename + '.npy', mmap_mode='r')
+    except (OSError, IOError):
+        # Not in cache or evicted by another process
+        return None
+
+    # JSON strings are unicode
+    keywords = {}
+    for key, value in header['keywords'].items():
+        if value is not None:
+            value = value.encode('utf-8')
+        keywords[key.encode('utf-8')] = value
+
+    return Raster(A,
+                  projection=str(header['projection']),
+                  geotransform=tuple(header['geotransform']),
+                  name=header['name'].encode('utf-8'),
+                  keywords=keywords)
+
+
+def get_cached_file(cachedir, key):
+    """Get downloaded layer file from cache
+
+    Input
+        cachedir: Directory holding the download cache
+        key: Name of cache entry (see layer_cache_key)
+
+    Output
+        Name of cached .tif or .shp file or None if key is not in the cache
+
+    The entry is marked as used so that it is evicted last.
+    """
+
+    entry = os.path.join(cachedir, key)
+    if not os.path.isdir(entry):
+        return None
+
+    for dirpath, _, filenames in os.walk(entry):
+        for filename in filenames:
+            if os.path.splitext(filename)[1] in ['.tif', '.shp']:
+                try:
+                    os.utime(entry, None)
+                except OSError:
+                    # Evicted by another process
+                    return None
+                return os.path.join(dirpath, filename)
+
+    return None
+
+
+def add_file_to_cache(filename, cachedir, key, max_bytes=None,
+                      replace=False, layer_name=None):
+    """Move downloaded layer file into cache
+
+    Input
+        filename: Name of .tif or .shp file. All files in its directory,
+                  such as the .keywords, .dbf and .prj files, are moved
+                  into the cache with it. The directory must contain
+                  nothing else.
+        cachedir: Directory holding the download cache. It is created if
+                  needed.
+        key: Name of cache entry (see layer_cache_key)
+        max_bytes: Optional maximal size of the cache. Least recently used
+                   entries are deleted to keep the cache within it.
+        replace: Optional flag. If True, an existing entry for key is
+                 replaced. Otherwise the existing entry is kept.
+        layer_name: Optional name of layer, e.g. geonode:test, recorded
+                    in the entry (see remove_layer_from_cache)
+
+    Output
+        Name of file in the cache
+
+    The directory is renamed into place so that concurrent readers never
+    see incomplete entries. If the entry already exists, e.g. because it
+    was added by a concurrent download, that entry is used unless replace
+    is True.
+    """
+
+    if not os.path.isdir(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            # Directory may have been created by another process
+            pass
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    basename = os.path.basename(filename)
+    entry = os.path.join(cachedir, key)
+
+    # Temporary name within cache so that renaming is atomic
+    tmpdir = tempfile.mkdtemp(dir=cachedir, suffix='.tmp')
+    shutil.move(dirname, os.path.join(tmpdir, key))
+    if layer_name is not None:
+        f = open(os.path.join(tmpdir, key, LAYER_INFO), 'w')
+        json.dump({'layer_name': layer_name}, f)
+        f.close()
+    if replace and os.path.isdir(entry):
+        shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.rename(os.path.join(tmpdir, key), entry)
+    except OSError:
+        # Entry exists already
+        pass
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if max_bytes is not None:
+        evict_from_cache(cachedir, max_bytes, keep=key)
+
+    return os.path.join(entry, basename)
+
+
+def get_cache_entries(cachedir):
+    """Get entries of download cache
+
+    Input
+        cachedir: Directory holding the download cache
+
+    Output
+        List of (time of last use, size in bytes, key) for each entry
+    """
+
+    entries = []
+    for key in os.listdir(cachedir):
+        entry = os.path.join(cachedir, key)
+        if not os.path.isdir(entry) or key.endswith('.tmp'):
+            continue
+
+        try:
+            size = 0
+            for dirpath, _, filenames in os.walk(entry):
+                for filename in filenames:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+            entries.append((os.path.getmtime(entry), size, key))
+        except OSError:
+            # Evicted by another process
+            pass
+
+    return entries
+
+
+def evict_from_cache(cachedir, max_bytes, keep=None, min_age=None):
+    """Delete least recently used entries of download cache
+
+    Input
+        cachedir: Directory holding the download cache
+        max_bytes: Maximal total size of entries
+        keep: Optional key of entry that must not be deleted, e.g. the one
+              just added
+        min_age: Optional number of seconds since their last use within
+                 which entries are not deleted. Default is MIN_AGE.
+
+    Output
+        List of keys of deleted entries
+
+    Entries returned by get_cached_file are read after that, so deleting
+    recently used entries could break concurrent calculations. The cache
+    may therefore stay above max_bytes for up to min_age seconds.
+    """
+
+    if min_age is None:
+        min_age = MIN_AGE
+
+    entries = get_cache_entries(cachedir)
+    total = sum([size for _, size, _ in entries])
+    cutoff = time.time() - min_age
+
+    deleted = []
+    for used, size, key in sorted(entries):
+        if total <= max_bytes or used > cutoff:
+            break
+
+        if key == keep:
+            continue
+
+        shutil.rmtree(os.path.join(cachedir, key), ignore_errors=True)
+        total -= size
+        deleted.append(key)
+
+    return deleted
+
+
+def remove_layer_from_cache(cachedir, layer_name, min_age=None):
+    """Delete entries of download cache holding given layer
+
+    Input
+        cachedir: Directory holding the download cache
+        layer_name: Name of layer as passed to add_file_to_cache, e.g.
+                    geonode:test
+        min_age: Optional number of seconds since their last use within
+                 which entries are not deleted. Default is MIN_AGE.
+
+    Output
+        List of keys of deleted entries
+
+    This is used when a layer is uploaded again. Its old entries are
+    never used after that as their keys include a checksum of the old
+    metadata. Entries that were used recently are left to be evicted
+    later as they may still be being read. Entries of all servers are
+    deleted as the same server may be known under several urls.
+    """
+
+    if min_age is None:
+        min_age = MIN_AGE
+
+    if not os.path.isdir(cachedir):
+        return []
+
+    cutoff = time.time() - min_age
+
+    deleted = []
+    for used, _, key in get_cache_entries(cachedir):
+        if used > cutoff:
+            continue
+
+        entry = os.path.join(cachedir, key)
+        try:
+            f = open(os.path.join(entry, LAYER_INFO))
+            info = json.load(f)
+            f.close()
+        except (OSError, IOError, ValueError):
+            # Entry without layer name or evicted by another process
+            continue
+
+        if info['layer_name'] == layer_name:
+            shutil.rmtree(entry, ignore_errors=True)
+            deleted.append(key)
+
+    return deleted
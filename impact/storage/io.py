@@ -5,9 +5,14 @@
 """
 
 import os
+import sys
+import copy
 import time
 import numpy
-import urllib2
+import socket
+import httplib
+import threading
+import shutil
 import tempfile
 import contextlib
 from zipfile import ZipFile
@@ -22,6 +27,13 @@ from impact.storage.utilities import unique_filename
 from impact.storage.utilities import write_keywords
 from impact.storage.utilities import extract_WGS84_geotransform
 from impact.storage.utilities import geotransform2resolution
+from impact.storage.cache import metadata_checksum, layer_cache_key
+from impact.storage.cache import get_cached_file, add_file_to_cache
+from impact.storage.cache import read_raster_from_cache
+from impact.storage.cache import write_raster_to_cache
+from impact.storage.cache import evict_from_cache
+from impact.storage.cache import remove_layer_from_cache
+from impact.storage.session import Session
 
 from owslib.wcs import WebCoverageService
 from owslib.wfs import WebFeatureService
@@ -34,6 +46,37 @@ logger = logging.getLogger('risiko')
 
 INTERNAL_SERVER_URL = os.path.join(settings.GEOSERVER_BASE_URL, 'ows')
 
+# Parsed capabilities of servers and metadata of their layers keyed by
+# server url (see get_capabilities). Entries expire after
+# settings.RISIKO_CAPABILITIES_TTL seconds so that layers added through
+# other processes are eventually seen.
+capabilities_cache = {}
+capabilities_lock = threading.Lock()
+server_locks = {}
+CAPABILITIES_TTL = 300
+
+# Seconds within which capabilities are not fetched again when a layer
+# is not found in them (see get_metadata)
+CAPABILITIES_MIN_AGE = 10
+
+# Time at which servers were last found to answer (see check_server_url)
+checked_servers = {}
+
+# HTTP session shared by all OWS requests (see get_session)
+session = None
+session_lock = threading.Lock()
+
+# Semaphores limiting concurrent downloads from each server keyed by
+# server url (see download_layers)
+server_semaphores = {}
+semaphores_lock = threading.Lock()
+DOWNLOADS_PER_SERVER = 4
+
+# Bytes read at a time by get_file and number of times a broken download
+# is resumed
+DOWNLOAD_CHUNK_SIZE = 2 ** 18
+DOWNLOAD_RETRIES = 3
+
 
 def read_layer(filename):
     """Read spatial layer from file.
@@ -274,6 +317,179 @@ def get_metadata_from_layer(layer):
     return metadata
 
 
+def get_session():
+    """Get HTTP session shared by all OWS requests of this process
+
+    The session keeps connections to servers alive (see
+    impact.storage.session). It is configured by the settings
+    RISIKO_HTTP_POOL_SIZE (connections per host), RISIKO_HTTP_TIMEOUT
+    (seconds) and RISIKO_HTTP_RETRIES.
+    """
+
+    global session
+
+    session_lock.acquire()
+    try:
+        if session is None:
+            session = Session(
+                pool_size=getattr(settings, 'RISIKO_HTTP_POOL_SIZE', 4),
+                timeout=getattr(settings, 'RISIKO_HTTP_TIMEOUT', 60),
+                retries=getattr(settings, 'RISIKO_HTTP_RETRIES', 2))
+        return session
+    finally:
+        session_lock.release()
+
+
+def get_url(url):
+    """Get body of HTTP response through the shared session
+
+    Input
+        url: URL to get
+
+    Output
+        String with body of response.
+        An exception is raised if the server responds with anything but
+        status 200, e.g. an error or a redirect that was not followed.
+    """
+
+    with contextlib.closing(get_session().request('GET', url)) as f:
+        data = f.read()
+
+    if f.status != 200:
+        msg = ('Request failed with HTTP status %i.\n'
+               'URL: %s\n'
+               'Response: %s' % (f.status, url, data))
+        raise Exception(msg)
+
+    return data
+
+
+def get_capabilities_xml(server_url, service):
+    """Get capabilities document of OWS server
+
+    Input
+        server_url: e.g. http://localhost:8001/geoserver-geonode-dev/ows
+        service: 'WCS' or 'WFS'
+
+    Output
+        Capabilities XML for version 1.0.0 of the service
+    """
+
+    if '?' in server_url:
+        separator = '&'
+    else:
+        separator = '?'
+
+    url = ('%s%sservice=%s&version=1.0.0&request=GetCapabilities'
+           % (server_url, separator, service))
+    return get_url(url)
+
+
+def check_server_url(server_url):
+    """Check that server answers requests
+
+    Input
+        server_url: e.g. http://localhost:8001/geoserver-geonode-dev/ows
+
+    An exception is raised if the server can not be reached or responds
+    with an error. The check is a HEAD request and is only repeated
+    after settings.RISIKO_CAPABILITIES_TTL seconds.
+    """
+
+    ttl = getattr(settings, 'RISIKO_CAPABILITIES_TTL', CAPABILITIES_TTL)
+    checked = checked_servers.get(server_url)
+    if checked is not None and time.time() - checked < ttl:
+        return
+
+    try:
+        f = get_session().request('HEAD', server_url)
+        f.close()
+
+        # Servers that do not allow HEAD requests still answered
+        if f.status not in [200, 405]:
+            raise Exception('HTTP status %i' % f.status)
+    except Exception, e:
+        msg = ('Argument server_url doesn\'t appear to be a valid URL'
+               'I got %s. Error message was: %s' % (server_url, str(e)))
+        raise Exception(msg)
+
+    checked_servers[server_url] = time.time()
+
+
+def get_capabilities(server_url, max_age=None):
+    """Get parsed WCS and WFS capabilities of server
+
+    Input
+        server_url: e.g. http://localhost:8001/geoserver-geonode-dev/ows
+        max_age: Optional number of seconds after which capabilities are
+                 fetched again. Default is settings.RISIKO_CAPABILITIES_TTL.
+
+    Output
+        entry: Dictionary with the WebCoverageService ('wcs') and the
+               WebFeatureService ('wfs') of the server, the time they
+               were fetched ('time') and metadata of layers derived from
+               them so far ('metadata')
+
+    Capabilities are fetched and parsed once for each server and reused
+    for settings.RISIKO_CAPABILITIES_TTL seconds (see capabilities_cache).
+    """
+
+    if max_age is None:
+        max_age = getattr(settings, 'RISIKO_CAPABILITIES_TTL',
+                          CAPABILITIES_TTL)
+
+    # Only one thread fetches capabilities of a given server at a time
+    capabilities_lock.acquire()
+    try:
+        if server_url not in server_locks:
+            server_locks[server_url] = threading.Lock()
+        lock = server_locks[server_url]
+    finally:
+        capabilities_lock.release()
+
+    lock.acquire()
+    try:
+        entry = capabilities_cache.get(server_url)
+        if entry is None or time.time() - entry['time'] >= max_age:
+            wcs = WebCoverageService(server_url, version='1.0.0',
+                                     xml=get_capabilities_xml(server_url,
+                                                              'WCS'))
+            wfs = WebFeatureService(server_url, version='1.0.0',
+                                    xml=get_capabilities_xml(server_url,
+                                                             'WFS'))
+            entry = {'time': time.time(),
+                     'wcs': wcs,
+                     'wfs': wfs,
+                     'metadata': {}}
+            capabilities_cache[server_url] = entry
+    finally:
+        lock.release()
+
+    return entry
+
+
+def invalidate_capabilities(server_url=None):
+    """Forget cached capabilities and layer metadata
+
+    Input
+        server_url: Server to forget. If None (default) all servers are
+                    forgotten.
+
+    This must be called when layers are added or changed. It is done by
+    save_to_geonode for all servers as the local GeoServer may be known
+    under several urls.
+    """
+
+    capabilities_lock.acquire()
+    try:
+        if server_url is None:
+            capabilities_cache.clear()
+        elif server_url in capabilities_cache:
+            del capabilities_cache[server_url]
+    finally:
+        capabilities_lock.release()
+
+
 def get_metadata(server_url, layer_name=None):
     """Uses OWSLib to get the metadata for a given layer
 
@@ -286,11 +502,17 @@ def get_metadata(server_url, layer_name=None):
     Output
         metadata: Dictionary of metadata fields for specified layer or,
                   if layer_name is None, a dictionary of metadata dictionaries
+
+    Capabilities of the server and metadata of each layer are cached
+    (see get_capabilities). Copies are returned so that callers can
+    modify them. Capabilities not listing the requested layer are fetched
+    again unless they are less than CAPABILITIES_MIN_AGE seconds old.
     """
 
     # Get all metadata from server
-    wcs = WebCoverageService(server_url, version='1.0.0')
-    wfs = WebFeatureService(server_url, version='1.0.0')
+    entry = get_capabilities(server_url)
+    wcs = entry['wcs']
+    wfs = entry['wfs']
 
     # Take care of input options
     if layer_name is None:
@@ -298,9 +520,22 @@ def get_metadata(server_url, layer_name=None):
     else:
         layer_names = [layer_name]
 
+        # Layer may have been added since capabilities were fetched.
+        # Lookups of layers that do not exist must not fetch them each
+        # time and concurrent lookups fetch them only once.
+        if layer_name not in wcs.contents and layer_name not in wfs.contents:
+            entry = get_capabilities(server_url,
+                                     max_age=CAPABILITIES_MIN_AGE)
+            wcs = entry['wcs']
+            wfs = entry['wfs']
+
     # Get metadata for requested layer(s)
     metadata = {}
     for name in layer_names:
+        if name in entry['metadata']:
+            metadata[name] = copy.deepcopy(entry['metadata'][name])
+            continue
+
         if name in wcs.contents:
             layer = wcs.contents[name]
             layer.datatype = 'raster'  # Monkey patch layer type
@@ -314,7 +549,9 @@ def get_metadata(server_url, layer_name=None):
                                            wcs.contents, wfs.contents))
             raise Exception(msg)
 
-        metadata[name] = get_metadata_from_layer(layer)
+        layer_metadata = get_metadata_from_layer(layer)
+        entry['metadata'][name] = layer_metadata
+        metadata[name] = copy.deepcopy(layer_metadata)
 
     # Return metadata for one or all layers
     if layer_name is not None:
@@ -387,28 +624,139 @@ def get_layer_descriptors(url):
     return x
 
 
+def is_service_exception(content_type, data):
+    """Determine if response from OWS server is an error message
+
+    Input
+        content_type: Value of the Content-Type header or None
+        data: The first bytes of the response
+
+    Output
+        True if the response is an XML service exception rather than
+        the requested data (GeoTIFF or zipped shapefile).
+    """
+
+    if content_type is not None:
+        # e.g. application/vnd.ogc.se_xml or text/xml
+        if 'se_xml' in content_type or content_type.endswith('/xml'):
+            return True
+
+    start = data.lstrip()
+    return start.startswith('<?xml') or '<ServiceException' in start
+
+
 def get_file(download_url, suffix):
     """Download a file from an HTTP server.
+
+    Input
+        download_url: URL of file, e.g. a WCS or WFS request
+        suffix: Extension of the downloaded file, e.g. '.tif'
+
+    Output
+        Name of downloaded file in a new temporary directory
+
+    The response is written to the file in chunks of DOWNLOAD_CHUNK_SIZE
+    bytes as it arrives. If the connection breaks, the download is
+    resumed with a range request up to DOWNLOAD_RETRIES times. Servers
+    that do not support ranges send everything again.
+
+    Servers may take long to produce e.g. coverages, so requests wait for
+    settings.RISIKO_DOWNLOAD_TIMEOUT seconds. Downloads that time out are
+    not retried as that would ask the server for the same work again.
+
+    An exception is raised if the server responds with a service
+    exception rather than the data. The temporary directory is removed
+    if the download fails.
     """
 
-    tempdir = '/tmp/%s' % str(time.time())
-    os.mkdir(tempdir)
+    # Unique directory as downloads may run concurrently
+    tempdir = tempfile.mkdtemp(prefix=str(time.time()), dir='/tmp')
     t = tempfile.NamedTemporaryFile(delete=False,
                                     suffix=suffix,
                                     dir=tempdir)
+    filename = os.path.abspath(t.name)
 
-    with contextlib.closing(urllib2.urlopen(download_url)) as f:
-        data = f.read()
+    timeout = getattr(settings, 'RISIKO_DOWNLOAD_TIMEOUT', 3600)
 
-    if '<ServiceException>' in data:
-        msg = ('File download failed.\n'
-               'URL: %s\n'
-               'Error message: %s' % (download_url, data))
-        raise Exception(msg)
+    t0 = time.time()
+    size = 0
+    retries = 0
+    # Leave nothing behind if the download fails
+    success = False
+    try:
+        with contextlib.closing(t):
+            while True:
+                headers = {}
+                if size > 0:
+                    headers['Range'] = 'bytes=%i-' % size
+
+                f = get_session().request('GET', download_url, headers=headers,
+                                          timeout=timeout)
+                with contextlib.closing(f):
+                    if f.status not in [200, 206]:
+                        msg = ('File download failed.\n'
+                               'URL: %s\n'
+                               'Error message: HTTP status %i: %s'
+                               % (download_url, f.status, f.read()))
+                        raise Exception(msg)
+
+                    if size > 0 and f.status != 206:
+                        # Range not supported - start again
+                        t.seek(0)
+                        t.truncate()
+                        size = 0
+
+                    length = f.getheader('Content-Length')
+                    received = 0
+                    try:
+                        while True:
+                            data = f.read(DOWNLOAD_CHUNK_SIZE)
+                            if not data:
+                                break
+
+                            if size == 0:
+                                content_type = f.getheader('Content-Type')
+                                if is_service_exception(content_type, data):
+                                    msg = ('File download failed.\n'
+                                           'URL: %s\n'
+                                           'Error message: %s'
+                                           % (download_url, data + f.read()))
+                                    raise Exception(msg)
+
+                            t.write(data)
+                            size += len(data)
+                            received += len(data)
+
+                        # Reading in chunks stops silently if connection breaks
+                        if length is not None and received < int(length):
+                            msg = ('Connection closed after %i of %s bytes'
+                                   % (received, length))
+                            raise socket.error(msg)
+                    except socket.timeout:
+                        raise
+                    except (socket.error, httplib.HTTPException), e:
+                        # Connection broke - resume from where it stopped
+                        retries += 1
+                        if retries > DOWNLOAD_RETRIES:
+                            raise
+
+                        logger.info('Download of %s interrupted after %i '
+                                    'bytes: %s. Resuming.'
+                                    % (download_url, size, e))
+                        continue
+
+                break
+
+        success = True
+    finally:
+        if not success:
+            shutil.rmtree(tempdir, ignore_errors=True)
 
-    # Write and return filename
-    t.write(data)
-    filename = os.path.abspath(t.name)
+    duration = max(time.time() - t0, 1.0e-6)
+    logger.info('Downloaded %i bytes in %.2f s (%.0f bytes/s) from %s'
+                % (size, duration, size / duration, download_url))
+
+    # Return filename
     return filename
 
 
@@ -450,7 +798,8 @@ def check_bbox_string(bbox_string):
     assert miny < maxy, msg
 
 
-def download(server_url, layer_name, bbox, resolution=None):
+def download(server_url, layer_name, bbox, resolution=None,
+             use_cache=False, bypass_cache=False, read_vector=True):
     """Download the source data of a given layer.
 
     Input
@@ -469,18 +818,26 @@ def download(server_url, layer_name, bbox, resolution=None):
                     and resy.
                     If resolution is None, the 'native' resolution of
                     the dataset is used.
+        use_cache: Optional flag. If True, downloaded files are kept in
+                   the cache in settings.RISIKO_DOWNLOAD_CACHE_DIR within
+                   settings.RISIKO_DOWNLOAD_CACHE_SIZE bytes and reused.
+                   Raster data is also stored there for memory mapping
+                   and taken from the cache if possible. Such layers have
+                   no filename. See impact.storage.cache for details.
+        bypass_cache: Optional flag. If True, the layer is downloaded even
+                      if it is cached. The new download replaces the
+                      cached data if use_cache is True.
+        read_vector: Optional flag. If False, the name of the downloaded
+                     file is returned for vector layers instead of the
+                     layer so that it can be read in chunks (see
+                     calculate_impact in impact.engine.core).
 
     Layer geometry type must be either 'vector' or 'raster'
     """
 
     # Input checks
     assert isinstance(server_url, basestring)
-    try:
-        urllib2.urlopen(server_url)
-    except Exception, e:
-        msg = ('Argument server_url doesn\'t appear to be a valid URL'
-               'I got %s. Error message was: %s' % (server_url, str(e)))
-        raise Exception(msg)
+    check_server_url(server_url)
 
     msg = ('Expected layer_name to be a basestring. '
            'Instead got %s which is of type %s' % (layer_name,
@@ -529,6 +886,16 @@ def download(server_url, layer_name, bbox, resolution=None):
     # Create REST request and download file
     template = None
     layer_metadata = get_metadata(server_url, layer_name)
+    checksum = metadata_checksum(layer_metadata)
+
+    cachedir = None
+    max_bytes = None
+    if use_cache:
+        cachedir = getattr(settings, 'RISIKO_DOWNLOAD_CACHE_DIR', None)
+        max_bytes = getattr(settings, 'RISIKO_DOWNLOAD_CACHE_SIZE', None)
+
+    # Name of previously downloaded file if available
+    filename = None
 
     data_type = layer_metadata['layer_type']
     if data_type == 'vector':
@@ -538,17 +905,25 @@ def download(server_url, layer_name, bbox, resolution=None):
                    'This can only be done for raster layers.' % layer_name)
             raise RisikoException(msg)
 
-        template = WFS_TEMPLATE
-        suffix = '.zip'
-        download_url = template % (server_url, layer_name, bbox_string)
-        thefilename = get_file(download_url, suffix)
-        dirname = os.path.dirname(thefilename)
-        t = open(thefilename, 'r')
-        zf = ZipFile(t)
-        namelist = zf.namelist()
-        zf.extractall(path=dirname)
-        (shpname,) = [name for name in namelist if '.shp' in name]
-        filename = os.path.join(dirname, shpname)
+        key = layer_cache_key(server_url, layer_name, bbox_string,
+                              None, checksum)
+        if cachedir is not None and not bypass_cache:
+            filename = get_cached_file(cachedir, key)
+
+        if filename is None:
+            template = WFS_TEMPLATE
+            suffix = '.zip'
+            download_url = template % (server_url, layer_name, bbox_string)
+            thefilename = get_file(download_url, suffix)
+            dirname = os.path.dirname(thefilename)
+            t = open(thefilename, 'r')
+            zf = ZipFile(t)
+            namelist = zf.namelist()
+            zf.extractall(path=dirname)
+            t.close()
+            os.remove(thefilename)
+            (shpname,) = [name for name in namelist if '.shp' in name]
+            downloaded_filename = os.path.join(dirname, shpname)
     elif data_type == 'raster':
 
         if resolution is None:
@@ -556,25 +931,140 @@ def download(server_url, layer_name, bbox, resolution=None):
             resolution = layer_metadata['resolution']
             #resolution = (resolution, resolution)  #FIXME (Ole): Make nicer
 
-        # Download raster using specified bounding box and resolution
-        template = WCS_TEMPLATE
-        suffix = '.tif'
-        download_url = template % (server_url, layer_name, bbox_string,
-                                   resolution[0], resolution[1])
-        filename = get_file(download_url, suffix)
-
-    # Write keywords file
-    keywords = layer_metadata['keywords']
-    write_keywords(keywords, os.path.splitext(filename)[0] + '.keywords')
+        key = layer_cache_key(server_url, layer_name, bbox_string,
+                              resolution, checksum)
+
+        # Use decoded data from previous download if available
+        if cachedir is not None and not bypass_cache:
+            lyr = read_raster_from_cache(cachedir, key)
+            if lyr is not None:
+                lyr.metadata = layer_metadata
+                return lyr
+
+        if cachedir is not None and not bypass_cache:
+            filename = get_cached_file(cachedir, key)
+
+        if filename is None:
+            # Download raster using specified bounding box and resolution
+            template = WCS_TEMPLATE
+            suffix = '.tif'
+            download_url = template % (server_url, layer_name, bbox_string,
+                                       resolution[0], resolution[1])
+            downloaded_filename = get_file(download_url, suffix)
+
+    if filename is None:
+        # Write keywords file
+        filename = downloaded_filename
+        keywords = layer_metadata['keywords']
+        write_keywords(keywords, os.path.splitext(filename)[0] + '.keywords')
+
+        # Keep downloaded files for identical requests
+        if cachedir is not None:
+            filename = add_file_to_cache(filename, cachedir, key,
+                                         max_bytes=max_bytes,
+                                         replace=bypass_cache,
+                                         layer_name=layer_name)
+
+    if data_type == 'vector' and not read_vector:
+        return filename
 
     # Instantiate layer from file
     lyr = read_layer(filename)
 
+    if data_type == 'raster' and cachedir is not None:
+        write_raster_to_cache(lyr, cachedir, key)
+        if max_bytes is not None:
+            evict_from_cache(cachedir, max_bytes, keep=key)
+
     # FIXME (Ariel) Don't monkeypatch the layer object
     lyr.metadata = layer_metadata
     return lyr
 
 
+def get_server_semaphore(server_url):
+    """Get semaphore limiting concurrent downloads from server
+
+    Input
+        server_url: Server as passed to download
+
+    Output
+        Semaphore shared by all threads of this process. It allows
+        settings.RISIKO_DOWNLOADS_PER_SERVER concurrent downloads.
+    """
+
+    semaphores_lock.acquire()
+    try:
+        if server_url not in server_semaphores:
+            n = getattr(settings, 'RISIKO_DOWNLOADS_PER_SERVER',
+                        DOWNLOADS_PER_SERVER)
+            msg = ('Setting RISIKO_DOWNLOADS_PER_SERVER must be a positive '
+                   'integer. I got %s' % str(n))
+            assert isinstance(n, int) and n > 0, msg
+
+            server_semaphores[server_url] = threading.BoundedSemaphore(n)
+        return server_semaphores[server_url]
+    finally:
+        semaphores_lock.release()
+
+
+def download_layers(layers, resolution=None, use_cache=False,
+                    read_vector=True):
+    """Download several layers concurrently
+
+    Input
+        layers: List of (server_url, layer_name, bbox) tuples. Extra
+                elements in each tuple, such as metadata, are ignored.
+        resolution, use_cache, read_vector: Passed on to download for all
+                                            layers
+
+    Output
+        List of layer objects (or file names of vector layers if
+        read_vector is False) in the same order as the input
+
+    All layers are requested at the same time, each in its own thread,
+    except that at most settings.RISIKO_DOWNLOADS_PER_SERVER requests
+    are made to the same server. Errors are the same as if the layers
+    were downloaded one after another: If downloads fail, the exception
+    of the first failing layer in the list is raised once all downloads
+    have stopped.
+    """
+
+    results = [None] * len(layers)
+    errors = [None] * len(layers)
+
+    def download_one(i):
+        server_url, layer_name, bbox = layers[i][:3]
+        semaphore = get_server_semaphore(server_url)
+        semaphore.acquire()
+        try:
+            msg = ('- Downloading layer %s from %s with bbox=%s and res=%s'
+                   % (layer_name, server_url, str(bbox), str(resolution)))
+            logger.info(msg)
+            results[i] = download(server_url, layer_name, bbox,
+                                  resolution, use_cache=use_cache,
+                                  read_vector=read_vector)
+        except:
+            errors[i] = sys.exc_info()
+        finally:
+            semaphore.release()
+
+    threads = []
+    for i in range(len(layers)):
+        thread = threading.Thread(target=download_one, args=(i,))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    # Report first error in request order with its original traceback
+    for error in errors:
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    return results
+
+
 def dummy_save(filename, title, user, metadata=''):
     """Take a file-like object and uploads it to a GeoNode
     """
@@ -857,6 +1347,15 @@ def save_file_to_geonode(filename, user=None, title=None,
         #              info in and out of GeoNode. See issue #148
         layer.keywords = ' '.join(keyword_list)
         layer.save()
+
+        # Capabilities fetched before the upload do not have the layer
+        invalidate_capabilities()
+
+        # Downloads of the previous version of the layer are stale
+        cachedir = getattr(settings, 'RISIKO_DOWNLOAD_CACHE_DIR', None)
+        if cachedir is not None:
+            layer_name = '%s:%s' % (layer.workspace, layer.name)
+            remove_layer_from_cache(cachedir, layer_name)
     except GeoNodeException, e:
         # Layer did not upload. Convert GeoNodeException to RisikoException
         raise RisikoException(e)
@@ -890,6 +1389,7 @@ def save_file_to_geonode(filename, user=None, title=None,
                     logger.debug('Metadata for layer %s not yet ready - '
                                  'trying again. Error message was: %s'
                                  % (layer.name, errmsg))
+                    invalidate_capabilities()
                     time.sleep(0.3)
                 else:
                     ok = True
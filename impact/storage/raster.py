@@ -7,10 +7,12 @@ from osgeo import gdal
 from impact.storage.projection import Projection
 from impact.storage.utilities import DRIVER_MAP
 from impact.engine.interpolation import interpolate_raster_vector
+from impact.engine.resampling import resample_raster
 from impact.storage.utilities import read_keywords
 from impact.storage.utilities import write_keywords
 from impact.storage.utilities import nanallclose
 from impact.storage.utilities import geotransform2bbox, geotransform2resolution
+from impact.storage.utilities import bbox2window, window2geotransform
 
 
 class Raster:
@@ -72,7 +74,8 @@ class Raster:
                 assert isinstance(keywords, dict), msg
                 self.keywords = keywords
 
-            self.data = numpy.array(data, dtype='d', copy=False)
+            # Keep subclasses such as numpy.memmap (see impact.storage.cache)
+            self.data = numpy.asanyarray(data, dtype='d')
 
             self.filename = None
             self.name = name
@@ -215,6 +218,9 @@ class Raster:
             msg = 'Could not read raster band from %s' % filename
             raise Exception(msg)
 
+        # Decoded data is read on demand (see get_data)
+        self.cache = None
+
     def write_to_file(self, filename):
         """Save raster data to file
 
@@ -257,35 +263,73 @@ class Raster:
         # Write keywords if any
         write_keywords(self.keywords, basename + '.keywords')
 
-    def interpolate(self, X, name=None):
+    def interpolate(self, X, name=None, mode='linear'):
         """Interpolate values of this raster layer to other layer
 
         Input
             X: Layer object defining target
             name: Optional name of interpolated layer.
                   If name is None, the name of self is used.
+            mode: Optional interpolation method. One of
+                  'constant': Nearest neighbour
+                  'linear': Bilinear interpolation (default)
+                  'sum', 'average': Area weighted sum or average of pixels
+                                    within target pixels or polygons
+                  'max': Maximum of pixels within target polygons
+                  See impact.engine.resampling for raster targets and
+                  impact.engine.zonal_statistics for polygon targets.
 
         Output
             Y: Layer object with values of this raster layer interpolated to
                geometry of input layer X
 
-        Note: If target geometry is polygon, data will be interpolated to
-        its centroids and the output is a point data set.
+        Note: If target geometry is polygon and mode is 'linear' or
+        'constant', data will be interpolated to its centroids and the
+        output is a point data set. Otherwise the output is polygon data.
+
+        Note: With mode 'sum', density layers are resampled after scaling
+        (see get_data) and the keyword resolution is dropped as the result
+        holds totals for the pixels of X.
         """
 
         if X.is_raster:
-            if self.get_geotransform() != X.get_geotransform():
-                # Need interpolation between grids
-                msg = 'Intergrid interpolation not yet implemented'
-                raise Exception(msg)
-            else:
+            if (self.get_geotransform() == X.get_geotransform() and
+                self.rows == X.rows and self.columns == X.columns):
                 # Rasters are aligned, no need to interpolate
                 return self
+
+            # Need interpolation between grids
+            msg = ('Projections of raster layers %s and %s must be the same'
+                   % (self.get_name(), X.get_name()))
+            assert self.projection == X.projection, msg
+
+            keywords = self.get_keywords().copy()
+            if mode == 'sum':
+                scaling = None
+                if 'resolution' in keywords:
+                    del keywords['resolution']
+            else:
+                scaling = False
+
+            A = resample_raster(self, X.get_geotransform(),
+                                X.columns, X.rows,
+                                mode=mode, scaling=scaling)
+            A[numpy.isnan(A)] = -9999
+
+            if name is None:
+                name = self.get_name()
+
+            return Raster(A,
+                          projection=self.get_projection(),
+                          geotransform=X.get_geotransform(),
+                          name=name,
+                          keywords=keywords)
         else:
             # Interpolate this raster layer to geometry of X
-            return interpolate_raster_vector(self, X, name)
+            return interpolate_raster_vector(self, X, name, mode=mode)
 
-    def get_data(self, nan=True, scaling=None):
+    def get_data(self, nan=True, scaling=None, window=None, bbox=None,
+                 copy=True):
         """Get raster data as numeric array
 
         Input
@@ -308,14 +352,50 @@ class Raster:
                            otherwise not. This is the default.
                      scalar value: If scaling takes a numerical scalar value,
                                    that will be use to scale the data
+            window: Optional tuple (xoff, yoff, xsize, ysize) of pixels.
+                    If specified only this block of the raster is returned.
+            bbox: Optional bounding box [west, south, east, north].
+                  If specified only the smallest block of pixels covering
+                  bbox is returned. Use either window or bbox, not both.
+            copy: Optional flag. If False and neither nodata replacement
+                  (nan=False) nor scaling is requested, a view of the
+                  data held by the layer is returned without copying.
+                  For memory mapped layers this is a numpy.memmap view
+                  which is read only.
 
+        Output
+            A: New array (rows x columns or the requested block).
+               It can be modified freely by the caller unless copy
+               is False.
+
+        Data read from file is decoded once and kept for subsequent
+        calls. If only a window is requested before that, only that block
+        is read from the file.
         """
 
+        # Determine block of pixels to get
+        if bbox is not None:
+            msg = 'Only one of window and bbox can be specified'
+            assert window is None, msg
+            window = bbox2window(bbox, self.geotransform,
+                                 self.columns, self.rows)
+
+        if window is not None:
+            xoff, yoff, xsize, ysize = [int(x) for x in window]
+            msg = ('Window %s must lie within raster %s of size %i x %i'
+                   % (str(window), self.get_name(), self.columns, self.rows))
+            assert xoff >= 0 and yoff >= 0, msg
+            assert xsize > 0 and ysize > 0, msg
+            assert xoff + xsize <= self.columns, msg
+            assert yoff + ysize <= self.rows, msg
+
         if hasattr(self, 'data'):
             A = self.data
             assert A.shape[0] == self.rows and A.shape[1] == self.columns
-        else:
-            # Read from raster file
+        elif self.cache is not None:
+            A = self.cache
+        elif window is None:
+            # Read and keep entire band from raster file
             A = self.band.ReadAsArray()
 
             M, N = A.shape
@@ -324,19 +404,11 @@ class Raster:
             assert M == self.rows, msg
             assert N == self.columns, msg
 
-        if nan is False:
-            pass
+            self.cache = A
         else:
-            if nan is True:
-                NAN = numpy.nan
-            else:
-                NAN = nan
-
-            # Replace NODATA_VALUE with NaN
-            nodata = self.get_nodata_value()
-
-            NaN = numpy.ones(A.shape, A.dtype) * NAN
-            A = numpy.where(A == nodata, NaN, A)
+            # Read only requested block from raster file
+            A = self.band.ReadAsArray(xoff, yoff, xsize, ysize)
+            window = None
 
         # Take care of possible scaling
         if scaling is None:
@@ -366,8 +438,66 @@ class Raster:
                        'number: %s' % (scaling, str(e)))
                 raise Exception(msg)
 
+        # Return view if no copy is needed
+        if window is not None:
+            A = A[yoff:yoff + ysize, xoff:xoff + xsize]
+
+        if copy is False and nan is False and sigma == 1:
+            return A
+
+        # Make the one copy that is returned
+        A = numpy.array(A)
+
+        if nan is False:
+            pass
+        else:
+            if nan is True:
+                NAN = numpy.nan
+            else:
+                NAN = nan
+
+            # Replace NODATA_VALUE with NaN in place
+            nodata = self.get_nodata_value()
+
+            if A.dtype.kind != 'f':
+                A = A.astype('d')
+            A[A == nodata] = NAN
+
         # Return possibly scaled data
-        return sigma * A
+        if sigma != 1:
+            if A.dtype.kind != 'f':
+                A = A.astype('d')
+            A *= sigma
+
+        return A
+
+    def get_tile(self, window):
+        """Get block of this raster as a new raster layer
+
+        Input
+            window: Tuple (xoff, yoff, xsize, ysize) of pixels
+
+        Output
+            Raster layer in memory with the data of this layer within window,
+            the corresponding geotransform and the same projection and
+            keywords (e.g. so that density scaling is preserved).
+
+        Nodata values are represented by the standard -9999 assumed for
+        raster layers without a band (see get_nodata_value).
+        """
+
+        A = self.get_data(nan=False, scaling=False, window=window)
+
+        nodata = self.get_nodata_value()
+        if nodata != -9999:
+            A[A == nodata] = -9999
+
+        return Raster(A,
+                      projection=self.get_projection(),
+                      geotransform=window2geotransform(window,
+                                                       self.geotransform),
+                      name=self.get_name(),
+                      keywords=self.get_keywords())
 
     def get_projection(self, proj4=False):
         """Return projection of this layer as a string.
@@ -555,3 +685,82 @@ class Raster:
     @property
     def is_vector(self):
         return False
+
+
+class RasterWriter:
+    """Write raster layer to file block by block
+
+    This allows large results to be stored without assembling the full
+    array in memory, e.g.
+
+        writer = RasterWriter(filename, projection, geotransform,
+                              columns, rows)
+        for window in windows:
+            writer.write(R, window)
+        writer.close(keywords)
+    """
+
+    def __init__(self, filename, projection, geotransform, columns, rows):
+        """Create empty raster file
+
+        Input
+            filename: filename with extension .tif
+            projection: Geospatial reference in WKT format
+            geotransform: GDAL geotransform (6-tuple) of the full grid
+            columns: Number of columns in the full grid
+            rows: Number of rows in the full grid
+        """
+
+        # Check file format
+        basename, extension = os.path.splitext(filename)
+
+        msg = ('Invalid file type for file %s. Only extension '
+               'tif allowed.' % filename)
+        assert extension in ['.tif', '.asc'], msg
+        format = DRIVER_MAP[extension]
+
+        driver = gdal.GetDriverByName(format)
+        fid = driver.Create(filename, columns, rows, 1, gdal.GDT_Float64)
+        if fid is None:
+            msg = ('Gdal could not create filename %s using '
+                   'format %s' % (filename, format))
+            raise Exception(msg)
+
+        # Write metada
+        fid.SetProjection(str(projection))
+        fid.SetGeoTransform(geotransform)
+
+        self.filename = filename
+        self.basename = basename
+        self.fid = fid
+        self.band = fid.GetRasterBand(1)
+        self.columns = columns
+        self.rows = rows
+
+    def write(self, R, window):
+        """Write raster layer into window of file
+
+        Input
+            R: Raster layer with the dimensions of window
+            window: Tuple (xoff, yoff, xsize, ysize) of pixels
+        """
+
+        xoff, yoff, xsize, ysize = window
+
+        A = R.get_data()
+        msg = ('Raster %s has shape %s but window %s was specified'
+               % (R.get_name(), str(A.shape), str(window)))
+        assert A.shape == (ysize, xsize), msg
+
+        self.band.WriteArray(A, xoff, yoff)
+
+    def close(self, keywords=None):
+        """Flush data to file and write keywords if any
+        """
+
+        self.band.FlushCache()
+        self.band = None
+        self.fid = None
+
+        if keywords is not None:
+            write_keywords(keywords, self.basename + '.keywords')
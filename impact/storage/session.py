@@ -0,0 +1,299 @@
+"""Pooled HTTP connections to OWS servers
+
+Requests made through a Session reuse connections to the same host
+(HTTP keep-alive) instead of opening a new one each time. The number of
+connections to each host is bounded by the pool size, requests time out
+after a given number of seconds and requests that fail before a
+response is received are retried on a fresh connection. This covers
+connections closed by the server while they were idle in the pool.
+Requests that time out are not retried as the server may still be
+working on them.
+
+As with urllib2, redirects are followed and proxies are taken from the
+environment, e.g. http_proxy, https_proxy and no_proxy.
+
+See get_session in impact.storage.io for the session shared by all
+OWS requests.
+"""
+
+import socket
+import urllib
+import httplib
+import urlparse
+import threading
+
+# Status codes of redirects followed by sessions
+REDIRECTS = [301, 302, 303, 307, 308]
+
+
+class Session:
+    """Pool of keep-alive HTTP connections
+
+    Input
+        pool_size: Maximal number of connections to each host
+        timeout: Seconds to wait for connections and data
+        retries: Number of times a request is retried if no response
+                 was received
+        max_redirects: Maximal number of redirects followed by a request
+    """
+
+    def __init__(self, pool_size=4, timeout=60, retries=2, max_redirects=5):
+
+        msg = 'Pool size must be a positive integer. I got %s' % pool_size
+        assert isinstance(pool_size, int) and pool_size > 0, msg
+
+        msg = 'Retries must be a non-negative integer. I got %s' % retries
+        assert isinstance(retries, int) and retries >= 0, msg
+
+        msg = ('Maximal number of redirects must be a non-negative '
+               'integer. I got %s' % max_redirects)
+        assert isinstance(max_redirects, int) and max_redirects >= 0, msg
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.max_redirects = max_redirects
+
+        # Proxies by scheme from environment, e.g. http_proxy
+        self.proxies = urllib.getproxies()
+
+        # Idle connections and semaphores limiting the number of
+        # connections keyed by (scheme, host)
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+
+    def get_proxy(self, key):
+        """Get host and port of proxy for (scheme, host) or None
+        """
+
+        scheme, host = key
+        proxy = self.proxies.get(scheme)
+        if proxy is None or urllib.proxy_bypass(host):
+            return None
+
+        # Proxies may be given with or without scheme
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return urlparse.urlsplit(proxy).netloc.split('@')[-1]
+
+    def get_connection(self, key):
+        """Get idle or new connection to host, waiting for a free slot
+        """
+
+        self.lock.acquire()
+        try:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.pool_size)
+                self.idle[key] = []
+            slot = self.slots[key]
+        finally:
+            self.lock.release()
+
+        slot.acquire()
+
+        self.lock.acquire()
+        try:
+            if len(self.idle[key]) > 0:
+                return self.idle[key].pop()
+        finally:
+            self.lock.release()
+
+        scheme, host = key
+        proxy = self.get_proxy(key)
+        if scheme == 'https':
+            if proxy is None:
+                return httplib.HTTPSConnection(host, timeout=self.timeout)
+
+            # Tunnel through proxy
+            connection = httplib.HTTPSConnection(proxy, timeout=self.timeout)
+            connection.set_tunnel(host)
+            return connection
+        else:
+            return httplib.HTTPConnection(proxy or host, timeout=self.timeout)
+
+    def release_connection(self, key, connection, reuse):
+        """Return connection to pool or close it and free its slot
+        """
+
+        if reuse:
+            self.lock.acquire()
+            try:
+                self.idle[key].append(connection)
+            finally:
+                self.lock.release()
+        else:
+            connection.close()
+
+        self.slots[key].release()
+
+    def request(self, method, url, headers=None, timeout=None):
+        """Make HTTP request
+
+        Input
+            method: HTTP method, e.g. 'GET' or 'HEAD'
+            url: Absolute http or https URL
+            headers: Optional dictionary of request headers
+            timeout: Optional seconds to wait for connection and data of
+                     this request. Default is the timeout of the session.
+
+        Output
+            Response object. Its body must be read to the end or the
+            response closed to free the connection.
+
+        Redirects are followed up to max_redirects times. After that the
+        redirect response itself is returned.
+        """
+
+        if headers is None:
+            headers = {}
+
+        if timeout is None:
+            timeout = self.timeout
+
+        redirects = 0
+        while True:
+            response = self.send(method, url, headers, timeout)
+
+            location = response.getheader('Location')
+            if (response.status not in REDIRECTS or location is None or
+                redirects >= self.max_redirects):
+                return response
+
+            # Read body of redirect so that its connection can be reused
+            response.read()
+            response.close()
+
+            url = urlparse.urljoin(url, location)
+            redirects += 1
+            if response.status == 303 and method != 'HEAD':
+                method = 'GET'
+
+    def send(self, method, url, headers, timeout):
+        """Make one HTTP request without following redirects
+
+        Input
+            method, url, headers and timeout as for request
+
+        Output
+            Response object
+        """
+
+        scheme, host, path, query, _ = urlparse.urlsplit(url)
+
+        msg = 'Only http and https URLs are supported. I got %s' % url
+        assert scheme in ['http', 'https'], msg
+
+        key = (scheme, host)
+
+        target = path or '/'
+        if query:
+            target += '?' + query
+
+        # Plain HTTP proxies get the absolute URL
+        if scheme == 'http' and self.get_proxy(key) is not None:
+            target = '%s://%s%s' % (scheme, host, target)
+
+        attempt = 0
+        while True:
+            connection = self.get_connection(key)
+
+            # Pooled connections may have been used with another timeout
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+
+            try:
+                connection.request(method, target, headers=headers)
+                response = connection.getresponse()
+            except socket.timeout:
+                self.release_connection(key, connection, reuse=False)
+                raise
+            except (socket.error, httplib.HTTPException):
+                self.release_connection(key, connection, reuse=False)
+
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+            else:
+                return Response(self, key, connection, response, method)
+
+    def close(self):
+        """Close all idle connections
+        """
+
+        self.lock.acquire()
+        try:
+            for key in self.idle:
+                for connection in self.idle[key]:
+                    connection.close()
+                self.idle[key] = []
+        finally:
+            self.lock.release()
+
+
+class Response:
+    """Response to request made through a Session
+
+    Attributes
+        status: HTTP status code, e.g. 200
+    """
+
+    def __init__(self, session, key, connection, response, method):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.released = False
+
+        # Responses without body can give back their connection now
+        if method == 'HEAD' or response.length == 0:
+            response.read()
+            self.release()
+
+    def getheader(self, name, default=None):
+        """Get value of response header
+        """
+
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        """Read body of response
+
+        Input
+            amt: Optional maximal number of bytes to read. Default is to
+                 read the rest of the body.
+
+        Output
+            String of bytes. An empty string means the end of the body.
+        """
+
+        if self.released:
+            return ''
+
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        """Free connection of this response
+        """
+
+        if not self.released:
+            self.released = True
+
+            # Connections with unread data can not be reused
+            reuse = (self.response.isclosed() and
+                     not self.response.will_close)
+            if not reuse:
+                self.response.close()
+            self.session.release_connection(self.key, self.connection,
+                                            reuse=reuse)
+
+    def close(self):
+        """Close response and free its connection
+        """
+
+        self.release()
@@ -28,6 +28,11 @@ TYPE_MAP = {type(None): ogr.OFTString,  # What else should this be?
             type(numpy.array([0.0])[0]): ogr.OFTReal,  # numpy.float64
             type(numpy.array([[0.0]])[0]): ogr.OFTReal}  # numpy.ndarray
 
+# Map between OGR field types and numpy types used for attribute columns.
+# Field types not listed here (strings, dates, ...) are stored as objects.
+DTYPE_MAP = {ogr.OFTInteger: numpy.int64,
+             ogr.OFTReal: numpy.float64}
+
 # Templates for downloading layers through rest
 WCS_TEMPLATE = '%s?version=1.0.0' + \
     '&service=wcs&request=getcoverage&format=GeoTIFF&' + \
@@ -373,6 +378,96 @@ def geotransform2bbox(geotransform, columns, rows):
     return [minx, miny, maxx, maxy]
 
 
+def bbox2window(bbox, geotransform, columns, rows):
+    """Convert bounding box to pixel window of grid
+
+    Input
+        bbox: Bounding box as a list of geographic coordinates
+              [west, south, east, north]
+        geotransform: GDAL geotransform (6-tuple) of grid
+        columns: Number of columns in grid
+        rows: Number of rows in grid
+
+    Output
+        window: Tuple (xoff, yoff, xsize, ysize) of the smallest block of
+                pixels covering bbox. It is clipped to the grid.
+    """
+
+    x_origin = geotransform[0]  # top left x
+    y_origin = geotransform[3]  # top left y
+    x_res = geotransform[1]     # w-e pixel resolution
+    y_res = - geotransform[5]   # n-s pixel resolution (positive)
+
+    west, south, east, north = [float(x) for x in bbox]
+
+    msg = ('Bounding box %s must have the form '
+           '[west, south, east, north]' % str(bbox))
+    assert west < east and south < north, msg
+
+    # Pixel indices covering bbox
+    x0 = int(numpy.floor((west - x_origin) / x_res))
+    x1 = int(numpy.ceil((east - x_origin) / x_res))
+    y0 = int(numpy.floor((y_origin - north) / y_res))
+    y1 = int(numpy.ceil((y_origin - south) / y_res))
+
+    # Clip to grid
+    x0 = max(0, min(x0, columns))
+    x1 = max(0, min(x1, columns))
+    y0 = max(0, min(y0, rows))
+    y1 = max(0, min(y1, rows))
+
+    msg = ('Bounding box %s does not overlap grid with bounding box %s'
+           % (str(bbox), geotransform2bbox(geotransform, columns, rows)))
+    assert x1 > x0 and y1 > y0, msg
+
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def window2geotransform(window, geotransform):
+    """Get geotransform of pixel window of grid
+
+    Input
+        window: Tuple (xoff, yoff, xsize, ysize) of pixels
+        geotransform: GDAL geotransform (6-tuple) of grid
+
+    Output
+        geotransform: GDAL geotransform of the block of pixels in window
+    """
+
+    xoff, yoff = window[0], window[1]
+    g = geotransform
+
+    return (g[0] + xoff * g[1] + yoff * g[2], g[1], g[2],
+            g[3] + xoff * g[4] + yoff * g[5], g[4], g[5])
+
+
+def grid2windows(columns, rows, tile_size):
+    """Split grid into windows of bounded size
+
+    Input
+        columns: Number of columns in grid
+        rows: Number of rows in grid
+        tile_size: Maximal number of pixels in each window
+
+    Output
+        List of windows (xoff, yoff, xsize, ysize) covering the grid.
+
+    Windows span whole rows so that they can be read efficiently from
+    raster files stored row by row. Each window has at least one row.
+    """
+
+    msg = 'Tile size must be a positive integer. I got %s' % str(tile_size)
+    assert tile_size > 0, msg
+
+    height = max(1, int(tile_size) // columns)
+
+    windows = []
+    for yoff in range(0, rows, height):
+        windows.append((0, yoff, columns, min(height, rows - yoff)))
+
+    return windows
+
+
 def geotransform2resolution(geotransform, isotropic=False,
                             # FIXME (Ole): Check these tolerances (issue #173)
                             rtol=5.0e-2, atol=1.0e-2):
@@ -616,6 +711,323 @@ def is_sequence(x):
         return True
 
 
+def make_column(values, dtype=None):
+    """Convert sequence of attribute values to a one dimensional array
+
+    Input
+        values: Sequence of N attribute values, one for each feature
+        dtype: Optional numpy type. If None it will be inferred from values.
+
+    Output
+        column: Numpy array of length N.
+
+    Numerical values are stored with their native numpy type. All other
+    values (strings, None or a mixture of types) are stored in an array
+    of type object so that each value is preserved exactly as given.
+    Missing values (None) are never cast to numbers.
+    """
+
+    if isinstance(values, numpy.ndarray) and values.ndim == 1:
+        if dtype is None or values.dtype == dtype:
+            return values
+
+    values = list(values)
+    N = len(values)
+
+    if not [x for x in values if x is None]:
+        try:
+            A = numpy.array(values, dtype=dtype)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if A.ndim == 1 and A.shape[0] == N and A.dtype.kind in 'biuf':
+                return A
+
+    # Fall back to generic Python objects
+    A = numpy.empty(N, dtype=object)
+    for i, x in enumerate(values):
+        A[i] = x
+    return A
+
+
+def attributes2columns(data):
+    """Convert list of attribute dictionaries to columns
+
+    Input
+        data: List of N dictionaries each with the same M field names
+
+    Output
+        names: List of the M field names
+        columns: Dictionary with one array of length N for each field name
+    """
+
+    msg = 'Data must be a sequence of dictionaries. I got %s' % type(data)
+    assert is_sequence(data) or len(data) == 0, msg
+
+    if len(data) == 0:
+        return [], {}
+
+    try:
+        names = data[0].keys()
+    except:
+        msg = ('Input parameter "data" does not contain dictionaries with '
+               'field information as expected. The first '
+               'element is %s' % data[0])
+        raise Exception(msg)
+
+    columns = {}
+    for name in names:
+        columns[name] = make_column([x[name] for x in data])
+
+    return names, columns
+
+
+def columns2attributes(names, columns, N):
+    """Convert attribute columns to list of dictionaries
+
+    Input
+        names: List of M field names
+        columns: Dictionary with one array of length N for each field name
+        N: Number of features
+
+    Output
+        data: List of N new dictionaries. Values are native Python types.
+    """
+
+    if len(names) == 0:
+        return [{} for i in range(N)]
+
+    values = [columns[name].tolist() for name in names]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def column2ogrtype(column):
+    """Determine OGR field type for storing attribute column
+
+    Input
+        column: Numpy array of attribute values
+
+    Output
+        OGR field type, e.g. ogr.OFTReal
+    """
+
+    kind = column.dtype.kind
+    if kind in 'biu':
+        return ogr.OFTInteger
+    elif kind == 'f':
+        return ogr.OFTReal
+
+    # Column of Python objects. Use type of first value as before.
+    if len(column) == 0:
+        return ogr.OFTString
+
+    py_type = type(column[0])
+    msg = 'Unknown type for storing vector data: %s' % str(py_type)[1:-1]
+    assert py_type in TYPE_MAP, msg
+
+    return TYPE_MAP[py_type]
+
+
+def pack_geometry(geometry):
+    """Pack list of polygons or lines into one coordinate array
+
+    Input
+        geometry: List of N arrays (or lists) of coordinates, each
+                  representing one polygon or line
+
+    Output
+        coordinates: Mx2 array of all vertices in the order given
+        offsets: Integer array of length N + 1 such that vertices of
+                 feature i are coordinates[offsets[i]:offsets[i + 1]]
+    """
+
+    N = len(geometry)
+    offsets = numpy.zeros(N + 1, dtype=numpy.int64)
+    for i, g in enumerate(geometry):
+        offsets[i + 1] = len(g)
+    numpy.cumsum(offsets, out=offsets)
+
+    coordinates = numpy.empty((offsets[-1], 2), dtype='d')
+    for i, g in enumerate(geometry):
+        if offsets[i + 1] > offsets[i]:
+            coordinates[offsets[i]:offsets[i + 1], :] = g
+
+    return coordinates, offsets
+
+
+def unpack_geometry(coordinates, offsets):
+    """Split packed coordinate array into one array per feature
+
+    Input
+        coordinates: Mx2 array of all vertices
+        offsets: Integer array of length N + 1 as produced by pack_geometry
+
+    Output
+        geometry: List of N arrays of coordinates. These are views into
+                  coordinates so no data is copied.
+    """
+
+    bounds = offsets.tolist()
+    return [coordinates[bounds[i]:bounds[i + 1]]
+            for i in range(len(bounds) - 1)]
+
+
+def wkb2coordinates(wkb, geometry_type):
+    """Decode batch of well known binary (WKB) geometries
+
+    Input
+        wkb: List of N WKB strings in little endian (NDR) byte order as
+             returned by ExportToWkb(ogr.wkbNDR). All geometries must be
+             two dimensional and of the same type.
+        geometry_type: One of ogr.wkbPoint, ogr.wkbLineString
+                       or ogr.wkbPolygon
+
+    Output
+        coordinates: Mx2 array of all vertices in the order given
+        counts: Integer array with the number of vertices in each geometry
+
+    All geometries are decoded together with numpy array operations
+    rather than one vertex at the time. For polygons only the outer
+    ring is decoded. WKB layouts are documented at
+    http://www.gdal.org/ogr/classOGRGeometry.html
+    """
+
+    N = len(wkb)
+    if N == 0:
+        return (numpy.zeros((0, 2), dtype='d'),
+                numpy.zeros(0, dtype=numpy.int64))
+
+    # Byte offset of each geometry in the joined buffer
+    sizes = numpy.array([len(w) for w in wkb], dtype=numpy.int64)
+    starts = numpy.zeros(N, dtype=numpy.int64)
+    starts[1:] = numpy.cumsum(sizes[:-1])
+    buf = numpy.frombuffer(''.join(wkb), dtype=numpy.uint8)
+
+    def get_uint32(positions):
+        """Read little endian 4 byte integers at given byte positions
+        """
+        idx = positions[:, numpy.newaxis] + numpy.arange(4)
+        return buf[idx].copy().view('<u4')[:, 0].astype(numpy.int64)
+
+    # Check byte order and geometry type
+    msg = 'WKB geometries must be in little endian (NDR) byte order'
+    assert numpy.all(buf[starts] == ogr.wkbNDR), msg
+
+    types = get_uint32(starts + 1)
+    if not numpy.all(types == geometry_type):
+        msg = ('Only point, line and polygon geometries are supported '
+               'and they must all be of the same type. I got types %s'
+               % str(numpy.unique(types).tolist()))
+        raise Exception(msg)
+
+    # Position of first coordinate and number of vertices
+    if geometry_type == ogr.wkbPoint:
+        header = 5
+        counts = numpy.ones(N, dtype=numpy.int64)
+    elif geometry_type == ogr.wkbLineString:
+        header = 9
+        counts = get_uint32(starts + 5)
+    elif geometry_type == ogr.wkbPolygon:
+        # Skip number of rings and read number of points in first ring.
+        # Empty polygons have no rings and hence no vertices.
+        header = 13
+        counts = numpy.zeros(N, dtype=numpy.int64)
+        rings = get_uint32(starts + 5)
+        if numpy.any(rings > 0):
+            counts[rings > 0] = get_uint32(starts[rings > 0] + 9)
+    else:
+        msg = 'Geometry type %s not implemented' % geometry_type
+        raise Exception(msg)
+
+    # Gather coordinate bytes of all geometries and reinterpret as doubles
+    nbytes = 16 * counts
+    total = numpy.sum(nbytes)
+    first = numpy.zeros(N, dtype=numpy.int64)
+    first[1:] = numpy.cumsum(nbytes[:-1])
+
+    idx = numpy.arange(total, dtype=numpy.int64)
+    idx += numpy.repeat(starts + header - first, nbytes)
+
+    coordinates = buf[idx].view('<f8').astype('d').reshape((-1, 2))
+    return coordinates, counts
+
+
+def coordinates2wkb(coordinates, offsets, geometry_type):
+    """Encode packed coordinates as well known binary (WKB) geometries
+
+    Input
+        coordinates: Mx2 array of all vertices
+        offsets: Integer array of length N + 1 such that vertices of
+                 feature i are coordinates[offsets[i]:offsets[i + 1]].
+                 None for point data where row i is point i.
+        geometry_type: One of ogr.wkbPoint, ogr.wkbLineString
+                       or ogr.wkbPolygon
+
+    Output
+        wkb: List of N WKB strings in little endian (NDR) byte order
+             suitable for ogr.CreateGeometryFromWkb
+
+    This is the inverse of wkb2coordinates. All geometries are encoded
+    together in one buffer with numpy array operations. Polygons are
+    written with one (outer) ring.
+    """
+
+    coordinates = numpy.ascontiguousarray(coordinates, dtype='<f8')
+    if offsets is None:
+        N = len(coordinates)
+        counts = numpy.ones(N, dtype=numpy.int64)
+    else:
+        N = len(offsets) - 1
+        counts = numpy.diff(offsets).astype(numpy.int64)
+
+    if N == 0:
+        return []
+
+    # Header of each geometry: byte order, type and number of vertices
+    if geometry_type == ogr.wkbPoint:
+        header = 5
+    elif geometry_type == ogr.wkbLineString:
+        header = 9
+    elif geometry_type == ogr.wkbPolygon:
+        header = 13
+    else:
+        msg = 'Geometry type %s not implemented' % geometry_type
+        raise Exception(msg)
+
+    H = numpy.zeros((N, header), dtype=numpy.uint8)
+    H[:, 0] = ogr.wkbNDR
+    H[:, 1:5] = numpy.array([geometry_type], dtype='<u4').view(numpy.uint8)
+    if geometry_type == ogr.wkbLineString:
+        H[:, 5:9] = counts.astype('<u4').view(numpy.uint8).reshape((N, 4))
+    elif geometry_type == ogr.wkbPolygon:
+        H[:, 5:9] = numpy.array([1], dtype='<u4').view(numpy.uint8)
+        H[:, 9:13] = counts.astype('<u4').view(numpy.uint8).reshape((N, 4))
+
+    # Byte offset of each geometry in the joined buffer
+    nbytes = 16 * counts
+    sizes = header + nbytes
+    starts = numpy.zeros(N + 1, dtype=numpy.int64)
+    starts[1:] = numpy.cumsum(sizes)
+
+    buf = numpy.empty(starts[-1], dtype=numpy.uint8)
+
+    # Scatter headers
+    idx = starts[:-1, numpy.newaxis] + numpy.arange(header)
+    buf[idx] = H
+
+    # Scatter coordinate bytes
+    first = numpy.zeros(N, dtype=numpy.int64)
+    first[1:] = numpy.cumsum(nbytes[:-1])
+    idx = numpy.arange(numpy.sum(nbytes), dtype=numpy.int64)
+    idx += numpy.repeat(starts[:-1] + header - first, nbytes)
+    buf[idx] = coordinates.view(numpy.uint8).ravel()
+
+    # Split into one string per geometry
+    s = buf.tostring()
+    bounds = starts.tolist()
+    return [s[bounds[i]:bounds[i + 1]] for i in range(N)]
+
+
 def array2wkt(A, geom_type='POLYGON'):
     """Convert coordinates to wkt format
 
@@ -710,25 +1122,13 @@ def calculate_polygon_area(polygon, signed=False):
     """
 
     # Make sure it is numeric
-    P = numpy.array(polygon)
+    P = numpy.array(polygon, dtype='d', copy=False)
 
     msg = ('Polygon is assumed to consist of coordinate pairs. '
            'I got second dimension %i instead of 2' % P.shape[1])
     assert P.shape[1] == 2, msg
 
-    x = P[:, 0]
-    y = P[:, 1]
-
-    # Calculate 0.5 sum_{i=0}^{N-1} (x_i y_{i+1} - x_{i+1} y_i)
-    a = x[:-1] * y[1:]
-    b = y[:-1] * x[1:]
-
-    A = numpy.sum(a - b) / 2.
-
-    if signed:
-        return A
-    else:
-        return abs(A)
+    return calculate_polygon_areas(P, [0, len(P)], signed=signed)[0]
 
 
 def calculate_polygon_centroid(polygon):
@@ -744,39 +1144,114 @@ def calculate_polygon_centroid(polygon):
     """
 
     # Make sure it is numeric
-    P = numpy.array(polygon)
+    P = numpy.array(polygon, dtype='d', copy=False)
+
+    return calculate_polygon_centroids(P, [0, len(P)])[0]
+
+
+def calculate_polygon_areas(coordinates, offsets, signed=False):
+    """Calculate areas of all polygons in packed geometry
+
+    Input
+        coordinates: Mx2 array of vertices of all polygons, each assumed
+                     to be closed (see pack_geometry)
+        offsets: Integer array of length N + 1 such that the vertices of
+                 polygon i are coordinates[offsets[i]:offsets[i + 1]]
+        signed: Optional flag deciding whether returned areas retain their
+                sign (see calculate_polygon_area). Default is False.
+
+    Output
+        Array of N areas
+    """
+
+    A, _ = calculate_polygon_moments(coordinates, offsets)
+
+    if signed:
+        return A
+    else:
+        return numpy.abs(A)
+
+
+def calculate_polygon_centroids(coordinates, offsets):
+    """Calculate centroids of all polygons in packed geometry
+
+    Input
+        coordinates: Mx2 array of vertices of all polygons, each assumed
+                     to be closed (see pack_geometry)
+        offsets: Integer array of length N + 1 such that the vertices of
+                 polygon i are coordinates[offsets[i]:offsets[i + 1]]
+
+    Output
+        Nx2 array of centroids
+    """
+
+    _, C = calculate_polygon_moments(coordinates, offsets)
+    return C
+
 
-    # Normalise to ensure numerical accurracy.
+def calculate_polygon_moments(coordinates, offsets):
+    """Calculate signed areas and centroids of all polygons at once
+
+    Input
+        coordinates, offsets: Packed polygons (see calculate_polygon_areas)
+
+    Output
+        A: Array of N signed areas
+        C: Nx2 array of centroids. Empty polygons have area 0 and
+           centroid NaN.
+
+    The terms of the area and centroid formulas are computed for all
+    pairs of consecutive vertices in one pass and summed per polygon with
+    numpy.add.reduceat.
+    """
+
+    P = numpy.array(coordinates, dtype='d', copy=False)
+    offsets = numpy.array(offsets, dtype='i8', copy=False)
+    N = len(offsets) - 1
+    M = len(P)
+
+    counts = numpy.diff(offsets)
+    starts = offsets[:-1][counts > 0]
+    nonempty = numpy.flatnonzero(counts > 0)
+
+    A = numpy.zeros(N, dtype='d')
+    C = numpy.zeros((N, 2), dtype='d')
+    C[:] = numpy.nan
+    if M == 0:
+        return A, C
+
+    # Normalise each polygon to ensure numerical accurracy.
     # This requirement in backed by tests in test_io.py and without it
     # centroids at building footprint level may get shifted outside the
     # polygon!
-    P_origin = numpy.amin(P, axis=0)
-    P = P - P_origin
-
-    # Get area. This calculation could be incorporated to save time
-    # if necessary as the two formulas are very similar.
-    A = calculate_polygon_area(polygon, signed=True)
+    P_origin = numpy.zeros((N, 2), dtype='d')
+    P_origin[nonempty] = numpy.minimum.reduceat(P, starts, axis=0)
+    P = P - P_origin[numpy.repeat(numpy.arange(N), counts)]
 
     x = P[:, 0]
     y = P[:, 1]
 
-    # Calculate
-    #Cx = sum_{i=0}^{N-1} (x_i + x_{i+1})(x_i y_{i+1} - x_{i+1} y_i)/(6A)
-
-    # Calculate
+    # Calculate for each pair of consecutive vertices
+    # x_i y_{i+1} - x_{i+1} y_i, (x_i + x_{i+1}) and (y_i + y_{i+1})
+    # omitting pairs spanning two polygons
+    terms = numpy.zeros((M, 3), dtype='d')
+    terms[:-1, 0] = x[:-1] * y[1:] - y[:-1] * x[1:]
+    terms[:-1, 1] = x[:-1] + x[1:]
+    terms[:-1, 2] = y[:-1] + y[1:]
+    terms[offsets[1:][counts > 0] - 1, 0] = 0
+    terms[:, 1] *= terms[:, 0]
+    terms[:, 2] *= terms[:, 0]
+
+    # A = sum_{i=0}^{N-1} (x_i y_{i+1} - x_{i+1} y_i)/2
+    # Cx = sum_{i=0}^{N-1} (x_i + x_{i+1})(x_i y_{i+1} - x_{i+1} y_i)/(6A)
     # Cy = sum_{i=0}^{N-1} (y_i + y_{i+1})(x_i y_{i+1} - x_{i+1} y_i)/(6A)
-    a = x[:-1] * y[1:]
-    b = y[:-1] * x[1:]
-
-    cx = x[:-1] + x[1:]
-    cy = y[:-1] + y[1:]
-
-    Cx = numpy.sum(cx * (a - b)) / (6. * A)
-    Cy = numpy.sum(cy * (a - b)) / (6. * A)
+    sums = numpy.add.reduceat(terms, starts, axis=0)
+    A[nonempty] = sums[:, 0] / 2.
+    C[nonempty] = sums[:, 1:] / (6. * A[nonempty, numpy.newaxis])
 
     # Translate back to real location
-    C = numpy.array([Cx, Cy]) + P_origin
-    return C
+    C += P_origin
+    return A, C
 
 def points_between_points(point1, point2, delta):
     """Creates an array of points between two points given a delta
@@ -815,20 +1290,98 @@ def points_along_line(line, delta):
     """
 
     # Make sure it is numeric
-    P = numpy.array(line)
-    points = []
-    for i in range(len(P)-1):
-        pts = points_between_points(P[i], P[i+1], delta)
-        # If the first point of this list is the same
-        # as the last one recorded, do not use it
-        if len(points) > 0:
-            if numpy.allclose(points[-1], pts[0]):
-                pts = pts[1:]
-        points.extend(pts)
-    C = numpy.array(points)
+    P = numpy.array(line, dtype='d', copy=False)
+
+    C, _ = densify_lines(P, [0, len(P)], delta)
     return C
 
 
+def densify_lines(coordinates, offsets, delta):
+    """Calculate points along all lines in packed geometry
+
+    Input
+        coordinates: Mx2 array of vertices of all lines (see pack_geometry)
+        offsets: Integer array of length N + 1 such that the vertices of
+                 line i are coordinates[offsets[i]:offsets[i + 1]]
+        delta: Decimal number to be used as step
+
+    Output
+        points: Kx2 array of points (longitude, latitude)
+        parent: Array of K indices of the line each point belongs to
+
+    The points are the same as those of points_along_line for each line,
+    i.e. each segment contributes its start point followed by points at
+    multiples of delta along the segment, and the start point is left out
+    if it is the same as the last point of the previous segment.
+    All segments of all lines are processed together.
+    """
+
+    P = numpy.array(coordinates, dtype='d', copy=False)
+    offsets = numpy.array(offsets, dtype='i8', copy=False)
+    N = len(offsets) - 1
+    M = len(P)
+
+    # Segments between consecutive vertices of the same line
+    counts = numpy.diff(offsets)
+    line = numpy.repeat(numpy.arange(N), counts)
+    valid = numpy.ones(max(M - 1, 0), dtype=bool)
+    last = offsets[1:][counts > 0] - 1
+    valid[last[last < M - 1]] = False
+    seg = numpy.flatnonzero(valid)
+
+    start = P[seg]
+    d = P[seg + 1] - start
+    L = numpy.sqrt(d[:, 0] ** 2 + d[:, 1] ** 2)
+    pieces = (L / delta).astype('i8')
+
+    # Unit vectors along segments (zero for segments of zero length)
+    nonzero = L > 0
+    d[nonzero] /= L[nonzero, numpy.newaxis]
+    d[numpy.logical_not(nonzero)] = 0
+
+    # Leave out start points that are the same as the last point recorded
+    # for the same line (same test as numpy.allclose). Segments of at
+    # least one piece always record points, so the last point recorded
+    # is the end of the previous such segment unless segments shorter
+    # than delta came in between. Those record only their start point
+    # and leave it out if it is the same as the end of the previous
+    # segment. Up to the tolerance of the test that is the same as the
+    # last point recorded, so the skipped segments are known in one pass.
+    end = start + d * pieces[:, numpy.newaxis] * delta
+    line = line[seg]
+    S = len(seg)
+
+    first = numpy.ones(S, dtype=bool)
+    first[1:] = line[1:] != line[:-1]
+
+    repeated = numpy.zeros(S, dtype=bool)
+    repeated[1:] = numpy.all(numpy.abs(end[:-1] - start[1:]) <=
+                             1.0e-8 + 1.0e-5 * numpy.abs(start[1:]), axis=1)
+    repeated &= numpy.logical_not(first)
+    records = (pieces > 0) | numpy.logical_not(repeated)
+
+    # Last segment before each segment that recorded points
+    previous = -numpy.ones(S, dtype='i8')
+    recorded = numpy.where(records, numpy.arange(S), -1)
+    previous[1:] = numpy.maximum.accumulate(recorded)[:-1]
+
+    skip = numpy.all(numpy.abs(end[previous] - start) <=
+                     1.0e-8 + 1.0e-5 * numpy.abs(start), axis=1)
+    skip &= (previous >= 0) & numpy.logical_not(first)
+    skip &= line[previous] == line
+    skip[pieces == 0] = repeated[pieces == 0]
+    skip = skip.astype('i8')
+
+    # Expand into steps n = skip, ..., pieces for each segment
+    n = pieces + 1 - skip
+    s = numpy.repeat(numpy.arange(len(seg)), n)
+    steps = numpy.arange(len(s)) - numpy.repeat(numpy.cumsum(n) - n, n)
+    steps += skip[s]
+
+    points = start[s] + d[s] * steps[:, numpy.newaxis] * delta
+    return points, line[s]
+
+
 def titelize(s):
     """Convert string into title
 
@@ -5,16 +5,30 @@ import os
 import numpy
 from osgeo import ogr, gdal
 from impact.storage.projection import Projection
-from impact.storage.utilities import DRIVER_MAP, TYPE_MAP
+from impact.storage.utilities import DRIVER_MAP
 from impact.storage.utilities import read_keywords
 from impact.storage.utilities import write_keywords
 from impact.storage.utilities import get_geometry_type
 from impact.storage.utilities import is_sequence
-from impact.storage.utilities import array2wkt
-from impact.storage.utilities import calculate_polygon_centroid
-from impact.storage.utilities import points_along_line
+from impact.storage.utilities import make_column
+from impact.storage.utilities import attributes2columns
+from impact.storage.utilities import columns2attributes
+from impact.storage.utilities import column2ogrtype
+from impact.storage.utilities import pack_geometry
+from impact.storage.utilities import unpack_geometry
+from impact.storage.utilities import wkb2coordinates
+from impact.storage.utilities import coordinates2wkb
+from impact.storage.utilities import DTYPE_MAP
+from impact.storage.utilities import calculate_polygon_centroids
+from impact.storage.utilities import densify_lines
 from impact.storage.utilities import geometrytype2string
 
+# Number of features decoded together when reading vector files
+WKB_BATCH_SIZE = 10000
+
+# Number of features committed together when writing vector files
+TRANSACTION_SIZE = 10000
+
 
 # FIXME (Ole): Consider using pyshp to read and write shapefiles
 #              See http://code.google.com/p/pyshp
@@ -23,7 +37,8 @@ class Vector:
     """
 
     def __init__(self, data=None, projection=None, geometry=None,
-                 name='Vector layer', keywords=None, geometry_type=None):
+                 name='Vector layer', keywords=None, geometry_type=None,
+                 offsets=None):
         """Initialise object with either geometry or filename
 
         Input
@@ -31,6 +46,8 @@ class Vector:
                 * a filename of a vector file format known to GDAL
                 * List of dictionaries of fields associated with
                   point coordinates
+                * Dictionary of attribute columns, i.e. one sequence
+                  of values for each field name
                 * None
             projection: Geospatial reference in WKT format.
                         Only used if geometry is provide as a numeric array,
@@ -45,6 +62,11 @@ class Vector:
                       Keywords can for example be used to display text
                       about the layer in a web application.
             geometry_type: Optional geometry type to avoid guessing.
+            offsets: Optional integer array of length N + 1 for line and
+                     polygon data. If given, geometry is taken to be one
+                     Mx2 array of all vertices packed together so that
+                     feature i is geometry[offsets[i]:offsets[i + 1]].
+                     In this case geometry_type must also be specified.
 
         Note that if data is a filename, all other arguments are ignored
         as they will be inferred from the file.
@@ -52,16 +74,23 @@ class Vector:
         The geometry type will be inferred from the dimensions of geometry.
         If each entry is one set of coordinates the type will be ogr.wkbPoint,
         if it is an array of coordinates the type will be ogr.wkbPolygon.
+
+        Attributes are stored internally as one numpy array per field
+        (see get_data for details). Coordinates of lines and polygons
+        are stored packed in one array together with feature offsets
+        (see get_packed_geometry).
         """
 
         if data is None and projection is None and geometry is None:
             # Instantiate empty object
             self.name = name
             self.projection = None
-            self.geometry = None
+            self.coordinates = None
+            self.offsets = None
             self.geometry_type = None
             self.filename = None
-            self.data = None
+            self.attribute_names = None
+            self.columns = None
             self.extent = None
             self.keywords = {}
             return
@@ -89,24 +118,51 @@ class Vector:
 
             msg = 'Geometry must be a sequence'
             assert is_sequence(geometry), msg
-            self.geometry = geometry
 
-            if geometry_type is None:
-                self.geometry_type = get_geometry_type(geometry)
-            else:
+            if offsets is not None:
+                msg = ('Geometry type must be specified when geometry '
+                       'is given as packed coordinates and offsets')
+                assert geometry_type is not None, msg
                 self.geometry_type = geometry_type
+                self.set_packed_geometry(geometry, offsets)
+            else:
+                if geometry_type is None:
+                    self.geometry_type = get_geometry_type(geometry)
+                else:
+                    self.geometry_type = geometry_type
+
+                if self.geometry_type == ogr.wkbPoint:
+                    self.set_packed_geometry(geometry, None)
+                else:
+                    self.set_packed_geometry(*pack_geometry(geometry))
             msg = 'Projection must be specified'
             assert projection is not None, msg
             self.projection = Projection(projection)
 
-            self.data = data
-            if data is not None:
-                msg = 'Data must be a sequence'
-                assert is_sequence(data), msg
+            if data is None:
+                self.attribute_names = None
+                self.columns = None
+            else:
+                if isinstance(data, dict):
+                    # Attributes given as columns
+                    names = data.keys()
+                    columns = {}
+                    for key in names:
+                        columns[key] = make_column(data[key])
+                else:
+                    msg = 'Data must be a sequence'
+                    assert is_sequence(data) or len(data) == 0, msg
+
+                    # Attributes given as a list of dictionaries
+                    names, columns = attributes2columns(data)
 
                 msg = ('The number of entries in geometry and data '
                        'must be the same')
-                assert len(geometry) == len(data), msg
+                for key in names:
+                    assert len(self) == len(columns[key]), msg
+
+                self.attribute_names = names
+                self.columns = columns
 
             # FIXME: Need to establish extent here
 
@@ -123,7 +179,10 @@ class Vector:
         """Size of vector layer defined as number of features
         """
 
-        return len(self.geometry)
+        if self.offsets is None:
+            return len(self.coordinates)
+        else:
+            return len(self.offsets) - 1
 
     def __eq__(self, other, rtol=1.0e-5, atol=1.0e-8):
         """Override '==' to allow comparison with other vector objecs
@@ -145,34 +204,47 @@ class Vector:
             return False
 
         # Check geometry
-        if not numpy.allclose(self.get_geometry(),
-                              other.get_geometry(),
+        if self.geometry_type != other.geometry_type:
+            return False
+
+        if self.offsets is not None:
+            if not numpy.array_equal(self.offsets, other.offsets):
+                return False
+
+        if self.coordinates.shape != other.coordinates.shape:
+            return False
+
+        if not numpy.allclose(self.coordinates,
+                              other.coordinates,
                               rtol=rtol, atol=atol):
             return False
 
         # Check keys
-        x = self.get_data()
-        y = other.get_data()
+        if self.columns is None or other.columns is None:
+            if not (self.columns is None and other.columns is None):
+                return False
+        else:
+            if set(self.attribute_names) != set(other.attribute_names):
+                return False
 
-        for key in x[0]:
-            for i in range(len(y)):
-                if key not in y[i]:
-                    return False
+            # Check data
+            for key in self.attribute_names:
+                x = self.columns[key]
+                y = other.columns[key]
 
-        for key in y[0]:
-            for i in range(len(x)):
-                if key not in x[i]:
+                if len(x) != len(y):
                     return False
 
-        # Check data
-        for i, a in enumerate(x):
-            for key in a:
-                if a[key] != y[i][key]:
-                    # Not equal, try numerical comparison with tolerances
-
-                    if not numpy.allclose(a[key], y[i][key],
-                                          rtol=rtol, atol=atol):
+                if x.dtype.kind in 'biuf' and y.dtype.kind in 'biuf':
+                    if not numpy.allclose(x, y, rtol=rtol, atol=atol):
                         return False
+                else:
+                    for a, b in zip(x.tolist(), y.tolist()):
+                        if a != b:
+                            # Not equal, try numerical comparison
+                            if not numpy.allclose(a, b,
+                                                  rtol=rtol, atol=atol):
+                                return False
 
         # Check keywords
         if self.keywords != other.keywords:
@@ -248,20 +320,7 @@ class Vector:
         self.filename = filename
         self.geometry_type = None  # In case there are no features
 
-        fid = ogr.Open(filename)
-        if fid is None:
-            msg = 'Could not open %s' % filename
-            raise IOError(msg)
-
-        # Assume that file contains all data in one layer
-        msg = 'Only one vector layer currently allowed'
-        if fid.GetLayerCount() > 1:
-            msg = ('WARNING: Number of layers in %s are %i. '
-                   'Only the first layer will currently be '
-                   'used.' % (filename, fid.GetLayerCount()))
-            raise Exception(msg)
-
-        layer = fid.GetLayerByIndex(0)
+        fid, layer = open_vector_layer(filename)
 
         # Get spatial extent
         self.extent = layer.GetExtent()
@@ -270,89 +329,38 @@ class Vector:
         p = layer.GetSpatialRef()
         self.projection = Projection(p)
 
-        # Get number of features
-        N = layer.GetFeatureCount()
-
-        # Extract coordinates and attributes for all features
-        geometry = []
-        data = []
-        for i in range(N):
-            feature = layer.GetFeature(i)
-            if feature is None:
-                msg = 'Could not get feature %i from %s' % (i, filename)
-                raise Exception(msg)
-
-            # Record coordinates ordered as Longitude, Latitude
-            G = feature.GetGeometryRef()
-            if G is None:
-                msg = ('Geometry was None in filename %s ' % filename)
-                raise Exception(msg)
+        # Read all features in batches and join them
+        names, types = get_field_definitions(layer)
+        coordinates = []
+        counts = []
+        values = dict([(name, []) for name in names])
+        batches = read_feature_batches(layer, filename, WKB_BATCH_SIZE)
+        for geometry_type, C, n, columns in batches:
+            self.geometry_type = geometry_type
+            coordinates.append(C)
+            counts.append(n)
+            for name in names:
+                values[name].append(columns[name])
+
+        # Store geometry coordinates as one packed numeric array
+        if len(counts) == 0:
+            coordinates = numpy.zeros((0, 2), dtype='d')
+            counts = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            coordinates = numpy.concatenate(coordinates)
+            counts = numpy.concatenate(counts)
+        self.set_packed_geometry(coordinates,
+                                 counts2offsets(counts, self.geometry_type))
+
+        # Store attributes as one typed array per field
+        columns = {}
+        for j, name in enumerate(names):
+            if len(values[name]) == 0:
+                columns[name] = make_column([], dtype=DTYPE_MAP.get(types[j]))
             else:
-                self.geometry_type = G.GetGeometryType()
-                if self.geometry_type == ogr.wkbPoint:
-                    geometry.append((G.GetX(), G.GetY()))
-                elif self.geometry_type == ogr.wkbLineString:
-                    M = G.GetPointCount()
-                    coordinates = []
-                    for j in range(M):
-                        coordinates.append((G.GetX(j), G.GetY(j)))
-
-                    # Record entire line as an Mx2 numpy array
-                    geometry.append(numpy.array(coordinates,
-                                                dtype='d',
-                                                copy=False))
-                elif self.geometry_type == ogr.wkbPolygon:
-                    ring = G.GetGeometryRef(0)
-                    M = ring.GetPointCount()
-                    coordinates = []
-                    for j in range(M):
-                        coordinates.append((ring.GetX(j), ring.GetY(j)))
-
-                    # Record entire polygon ring as an Mx2 numpy array
-                    geometry.append(numpy.array(coordinates,
-                                                dtype='d',
-                                                copy=False))
-                #elif self.geometry_type == ogr.wkbMultiPolygon:
-                #    # FIXME: Unpact multiple polygons to simple polygons
-                #    # For hints on how to unpact see http://osgeo-org.1803224.n2.nabble.com/gdal-dev-Shapefile-Multipolygon-with-interior-rings-td5391090.html
-
-                #    ring = G.GetGeometryRef(0)
-                #    M = ring.GetPointCount()
-                #    coordinates = []
-                #    for j in range(M):
-                #        coordinates.append((ring.GetX(j), ring.GetY(j)))
-
-                #    # Record entire polygon ring as an Mx2 numpy array
-                #    geometry.append(numpy.array(coordinates,
-                #                                dtype='d',
-                #                                copy=False))
-
-                else:
-                    msg = ('Only point, line and polygon geometries are '
-                           'supported. '
-                           'Geometry type in filename %s '
-                           'was %s.' % (filename,
-                                        self.geometry_type))
-                    raise Exception(msg)
-
-            # Record attributes by name
-            number_of_fields = feature.GetFieldCount()
-            fields = {}
-            for j in range(number_of_fields):
-                name = feature.GetFieldDefnRef(j).GetName()
-
-                # FIXME (Ole): Ascertain the type of each field?
-                #              We need to cast each appropriately?
-                #              This is issue #66
-                #feature_type = feature.GetFieldDefnRef(j).GetType()
-                fields[name] = feature.GetField(j)
-                #print 'Field', name, feature_type, j, fields[name]
-
-            data.append(fields)
-
-        # Store geometry coordinates as a compact numeric array
-        self.geometry = geometry
-        self.data = data
+                columns[name] = numpy.concatenate(values[name])
+        self.attribute_names = names
+        self.columns = columns
 
     def write_to_file(self, filename):
         """Save vector data to file
@@ -366,157 +374,16 @@ class Vector:
         this issue: http://www.gdal.org/ogr/drv_shapefile.html
         """
 
-        # Check file format
-        basename, extension = os.path.splitext(filename)
-
-        msg = ('Invalid file type for file %s. Only extensions '
-               'shp or gml allowed.' % filename)
-        assert extension == '.shp' or extension == '.gml', msg
-        driver = DRIVER_MAP[extension]
-
-        # FIXME (Ole): Tempory flagging of GML issue (ticket #18)
-        if extension == '.gml':
-            msg = ('OGR GML driver does not store geospatial reference.'
-                   'This format is disabled for the time being. See '
-                   'https://github.com/AIFDR/riab/issues/18')
+        if self.columns is not None and len(self) == 0:
+            msg = ('Input parameter "data" was specified '
+                   'but appears to be empty')
             raise Exception(msg)
 
-        # Derive layername from filename (excluding preceding dirs)
-        layername = os.path.split(basename)[-1]
-
-        # Get vector data
-        geometry = self.get_geometry()
-        data = self.get_data()
-
-        N = len(geometry)
-
-        # Clear any previous file of this name (ogr does not overwrite)
-        try:
-            os.remove(filename)
-        except:
-            pass
-
-        # Create new file with one layer
-        drv = ogr.GetDriverByName(driver)
-        if drv is None:
-            msg = 'OGR driver %s not available' % driver
-            raise Exception(msg)
-
-        ds = drv.CreateDataSource(filename)
-        if ds is None:
-            msg = 'Creation of output file %s failed' % filename
-            raise Exception(msg)
-
-        lyr = ds.CreateLayer(layername,
-                             self.projection.spatial_reference,
-                             self.geometry_type)
-        if lyr is None:
-            msg = 'Could not create layer %s' % layername
-            raise Exception(msg)
-
-        # Define attributes if any
-        store_attributes = False
-        if data is not None:
-            if len(data) > 0:
-                try:
-                    fields = data[0].keys()
-                except:
-                    msg = ('Input parameter "attributes" was specified '
-                           'but it does not contain dictionaries with '
-                           'field information as expected. The first'
-                           'element is %s' % data[0])
-                    raise Exception(msg)
-                else:
-                    # Establish OGR types for each element
-                    ogrtypes = {}
-                    for name in fields:
-                        att = data[0][name]
-                        py_type = type(att)
-                        msg = ('Unknown type for storing vector '
-                               'data: %s, %s' % (name, str(py_type)[1:-1]))
-                        assert py_type in TYPE_MAP, msg
-                        ogrtypes[name] = TYPE_MAP[py_type]
-
-            else:
-                msg = ('Input parameter "data" was specified '
-                       'but appears to be empty')
-                raise Exception(msg)
-
-            # Create attribute fields in layer
-            store_attributes = True
-            for name in fields:
-                fd = ogr.FieldDefn(name, ogrtypes[name])
-                # FIXME (Ole): Trying to address issue #16
-                #              But it doesn't work and
-                #              somehow changes the values of MMI in test
-                #width = max(128, len(name))
-                #print name, width
-                #fd.SetWidth(width)
-
-                # Silent handling of warnings like
-                # Warning 6: Normalized/laundered field name:
-                #'CONTENTS_LOSS_AUD' to 'CONTENTS_L'
-                gdal.PushErrorHandler('CPLQuietErrorHandler')
-                if lyr.CreateField(fd) != 0:
-                    msg = 'Could not create field %s' % name
-                    raise Exception(msg)
-
-                # Restore error handler
-                gdal.PopErrorHandler()
-
-        # Store geometry
-        geom = ogr.Geometry(self.geometry_type)
-        layer_def = lyr.GetLayerDefn()
-        for i in range(N):
-            # Create new feature instance
-            feature = ogr.Feature(layer_def)
-
-            # Store geometry and check
-            if self.geometry_type == ogr.wkbPoint:
-                x = float(geometry[i][0])
-                y = float(geometry[i][1])
-                geom.SetPoint_2D(0, x, y)
-            elif self.geometry_type == ogr.wkbPolygon:
-                wkt = array2wkt(geometry[i], geom_type='POLYGON')
-                geom = ogr.CreateGeometryFromWkt(wkt)
-            elif self.geometry_type == ogr.wkbLineString:
-                wkt = array2wkt(geometry[i], geom_type='LINESTRING')
-                geom = ogr.CreateGeometryFromWkt(wkt)
-            else:
-                msg = 'Geometry type %s not implemented' % self.geometry_type
-                raise Exception(msg)
-
-            feature.SetGeometry(geom)
-
-            G = feature.GetGeometryRef()
-            if G is None:
-                msg = 'Could not create GeometryRef for file %s' % filename
-                raise Exception(msg)
-
-            # Store attributes
-            if store_attributes:
-                for j, name in enumerate(fields):
-                    actual_field_name = layer_def.GetFieldDefn(j).GetNameRef()
-
-                    val = data[i][name]
-                    if type(val) == numpy.ndarray:
-                        # A singleton of type <type 'numpy.ndarray'> works
-                        # for gdal version 1.6 but fails for version 1.8
-                        # in SetField with error: NotImplementedError:
-                        # Wrong number of arguments for overloaded function
-                        val = float(val)
-
-                    feature.SetField(actual_field_name, val)
-
-            # Save this feature
-            if lyr.CreateFeature(feature) != 0:
-                msg = 'Failed to create feature %i in file %s' % (i, filename)
-                raise Exception(msg)
-
-            feature.Destroy()
-
-        # Write keywords if any
-        write_keywords(self.keywords, basename + '.keywords')
+        writer = VectorWriter(filename,
+                              projection=self.projection,
+                              geometry_type=self.geometry_type)
+        writer.write(self)
+        writer.close(keywords=self.keywords)
 
     def get_attribute_names(self):
         """ Get available attribute names
@@ -524,49 +391,80 @@ class Vector:
         These are the ones that can be used with get_data
         """
 
-        return self.data[0].keys()
+        return list(self.attribute_names)
 
-    def get_data(self, attribute=None, index=None):
+    def get_data(self, attribute=None, index=None, copy=False):
         """Get vector attributes
 
         Data is returned as a list where each entry is a dictionary of
         attributes for one feature. Entries in get_geometry() and
-        get_data() are related as 1-to-1
+        get_data() are related as 1-to-1. This list is created from the
+        internal columns on each call, so modifying it does not change
+        the layer.
 
         If optional argument attribute is specified and a valid name,
-        then the list of values for that attribute is returned.
+        then the numpy array of values for that attribute is returned.
+        This is a read only view of the internal column so no data is
+        copied. Callers that need to modify the values must copy them,
+        e.g. by setting copy to True.
 
         If optional argument index is specified on the that value will
         be returned. Any value of index is ignored if attribute is None.
         """
 
-        if hasattr(self, 'data'):
+        if self.columns is None:
             if attribute is None:
-                return self.data
+                return None
             else:
-                msg = ('Specified attribute %s does not exist in '
-                       'vector layer %s. Valid names are %s'
-                       '' % (attribute, self, self.data[0].keys()))
-                assert attribute in self.data[0], msg
-
-                if index is None:
-                    # Return all values for specified attribute
-                    return [x[attribute] for x in self.data]
-                else:
-                    # Return value for specified attribute and index
-                    msg = ('Specified index must be either None or '
-                           'an integer. I got %s' % index)
-                    assert type(index) == type(0)
+                msg = 'Vector data instance does not have any attributes'
+                raise Exception(msg)
 
-                    msg = ('Specified index must lie within the bounds '
-                           'of vector layer %s which is [%i, %i]'
-                           '' % (self, 0, len(self) - 1))
-                    assert 0 <= index < len(self)
+        if attribute is None:
+            return columns2attributes(self.attribute_names,
+                                      self.columns, len(self))
+        else:
+            msg = ('Specified attribute %s does not exist in '
+                   'vector layer %s. Valid names are %s'
+                   '' % (attribute, self, self.attribute_names))
+            assert attribute in self.columns, msg
+
+            if index is None:
+                # Return all values for specified attribute
+                column = self.columns[attribute]
+                if copy:
+                    return column.copy()
+
+                view = column.view()
+                view.flags.writeable = False
+                return view
+            else:
+                # Return value for specified attribute and index
+                msg = ('Specified index must be either None or '
+                       'an integer. I got %s' % index)
+                assert type(index) == type(0)
+
+                msg = ('Specified index must lie within the bounds '
+                       'of vector layer %s which is [%i, %i]'
+                       '' % (self, 0, len(self) - 1))
+                assert 0 <= index < len(self)
+
+                return self.columns[attribute][index:index + 1].tolist()[0]
+
+    @property
+    def data(self):
+        """List of attribute dictionaries (one per feature)
 
-                    return self.data[index][attribute]
+        This is the same as get_data() and is provided for compatibility,
+        except that the dictionaries can not be modified. They are made
+        from the internal columns on each access, so changes would be
+        lost.
+        """
+
+        data = self.get_data()
+        if data is None:
+            return None
         else:
-            msg = 'Vector data instance does not have any attributes'
-            raise Exception(msg)
+            return [FeatureAttributes(attributes) for attributes in data]
 
     def get_geometry(self):
         """Return geometry for vector layer.
@@ -576,11 +474,64 @@ class Vector:
         geometry type     output type
         -----------------------------
         point             coordinates (Nx2 array of longitudes and latitudes)
-        line              TODO
+        line              list of arrays of coordinates
         polygon           list of arrays of coordinates
 
+        Arrays for lines and polygons are views into the packed
+        coordinate array (see get_packed_geometry).
         """
-        return self.geometry
+
+        if self.offsets is None:
+            return self.coordinates
+        else:
+            return unpack_geometry(self.coordinates, self.offsets)
+
+    def get_packed_geometry(self):
+        """Return geometry as packed coordinates and offsets
+
+        Output
+            coordinates: Mx2 array of longitudes and latitudes of all
+                         points or vertices in this layer
+            offsets: Integer array of length N + 1 such that vertices of
+                     line or polygon i are
+                     coordinates[offsets[i]:offsets[i + 1]].
+                     None for point data where row i is point i.
+        """
+
+        return self.coordinates, self.offsets
+
+    def set_packed_geometry(self, coordinates, offsets):
+        """Set geometry from packed coordinates and offsets
+
+        Input
+            coordinates: Mx2 array of longitudes and latitudes
+            offsets: Integer array of length N + 1 for line and polygon
+                     data or None for point data.
+
+        See get_packed_geometry for details.
+        """
+
+        coordinates = numpy.array(coordinates, dtype='d', copy=False)
+        if len(coordinates) == 0:
+            coordinates = coordinates.reshape((0, 2))
+
+        msg = ('Coordinates must be an Mx2 array. '
+               'I got shape %s' % str(coordinates.shape))
+        assert len(coordinates.shape) == 2, msg
+        assert coordinates.shape[1] == 2, msg
+
+        if offsets is not None:
+            offsets = numpy.array(offsets, dtype=numpy.int64, copy=False)
+
+            msg = ('Offsets must start at 0 and end at the number of '
+                   'coordinates (%i). I got %s' % (len(coordinates),
+                                                   str(offsets)))
+            assert len(offsets) > 0, msg
+            assert offsets[0] == 0, msg
+            assert offsets[-1] == len(coordinates), msg
+
+        self.coordinates = coordinates
+        self.offsets = offsets
 
     def get_projection(self, proj4=False):
         """Return projection of this layer as a string
@@ -609,7 +560,10 @@ class Vector:
             raise RuntimeError(msg)
 
         x = self.get_data(attribute)
-        return min(x), max(x)
+        if x.dtype.kind in 'biuf':
+            return x.min(), x.max()
+        else:
+            return min(x), max(x)
 
     def get_topN(self, attribute, N=10):
         """Get top N features
@@ -635,20 +589,30 @@ class Vector:
         msg = 'N must be a positive number. I got %i' % N
         assert N > 0, msg
 
-        # Create list of values for specified attribute
+        # Create array of values for specified attribute
         values = self.get_data(attribute)
 
-        # Sort and select using Schwarzian transform
-        A = zip(values, self.data, self.geometry)
-        A.sort()
-
-        # Pick top N and unpack
-        _, data, geometry = zip(*A[-N:])
+        # Sort and select
+        if values.dtype.kind in 'biuf':
+            order = numpy.argsort(values, kind='mergesort')
+        else:
+            order = sorted(range(len(values)), key=values.__getitem__)
+        idx = order[-N:]
+
+        data = {}
+        for key in self.attribute_names:
+            data[key] = self.columns[key][idx]
+        if self.offsets is None:
+            geometry = self.coordinates[idx]
+        else:
+            geometry = self.get_geometry()
+            geometry = [geometry[i] for i in idx]
 
         # Create new Vector instance and return
         return Vector(data=data,
                       projection=self.get_projection(),
-                      geometry=geometry)
+                      geometry=geometry,
+                      geometry_type=self.geometry_type)
 
     def interpolate(self, X, name=None):
         """Interpolate values of this vector layer to other layer
@@ -685,9 +649,484 @@ class Vector:
     def is_polygon_data(self):
         return self.is_vector and self.geometry_type == ogr.wkbPolygon
 
+
+class FeatureAttributes(dict):
+    """Attributes of one feature as returned by Vector.data
+
+    This is a dictionary that raises an exception when modified.
+    """
+
+    def read_only(self, *args, **kwargs):
+        msg = ('Attributes in Vector.data are made from the layer on each '
+               'access and can not be modified. Use get_data(attribute) '
+               'to get columns and create a new Vector from them instead.')
+        raise Exception(msg)
+
+    __setitem__ = read_only
+    __delitem__ = read_only
+    clear = read_only
+    pop = read_only
+    popitem = read_only
+    setdefault = read_only
+    update = read_only
+
+    def __reduce__(self):
+        # Copies are ordinary dictionaries
+        return (dict, (dict(self),))
+
+
+class VectorWriter:
+    """Write vector layer to file incrementally
+
+    This allows a layer to be written one chunk of features at a time,
+    e.g. as results are computed, without holding the entire layer
+    in memory. Vector.write_to_file uses this class to write
+    all features in one go.
+
+    Usage
+        writer = VectorWriter(filename, projection, geometry_type)
+        writer.write(V1)
+        writer.write(V2)
+        ...
+        writer.close(keywords)
+
+    All layers written must have the same attributes. Field types are
+    established from the first layer written that has attributes.
+    """
+
+    def __init__(self, filename, projection, geometry_type):
+        """Create new vector file with one empty layer
+
+        Input
+            filename: filename with extension .shp or .gml
+            projection: Geospatial reference in WKT format
+                        or Projection instance
+            geometry_type: OGR geometry type, e.g. ogr.wkbPolygon
+
+        Note, if attribute names are longer than 10 characters they will be
+        truncated. This is due to limitations in the shp file driver and has
+        to be done here since gdal v1.7 onwards has changed its handling of
+        this issue: http://www.gdal.org/ogr/drv_shapefile.html
+        """
+
+        # Check file format
+        basename, extension = os.path.splitext(filename)
+
+        msg = ('Invalid file type for file %s. Only extensions '
+               'shp or gml allowed.' % filename)
+        assert extension == '.shp' or extension == '.gml', msg
+        driver = DRIVER_MAP[extension]
+
+        # FIXME (Ole): Tempory flagging of GML issue (ticket #18)
+        if extension == '.gml':
+            msg = ('OGR GML driver does not store geospatial reference.'
+                   'This format is disabled for the time being. See '
+                   'https://github.com/AIFDR/riab/issues/18')
+            raise Exception(msg)
+
+        # Derive layername from filename (excluding preceding dirs)
+        layername = os.path.split(basename)[-1]
+
+        # Clear any previous file of this name (ogr does not overwrite)
+        try:
+            os.remove(filename)
+        except:
+            pass
+
+        # Create new file with one layer
+        drv = ogr.GetDriverByName(driver)
+        if drv is None:
+            msg = 'OGR driver %s not available' % driver
+            raise Exception(msg)
+
+        ds = drv.CreateDataSource(filename)
+        if ds is None:
+            msg = 'Creation of output file %s failed' % filename
+            raise Exception(msg)
+
+        projection = Projection(projection)
+        lyr = ds.CreateLayer(layername,
+                             projection.spatial_reference,
+                             geometry_type)
+        if lyr is None:
+            msg = 'Could not create layer %s' % layername
+            raise Exception(msg)
+
+        self.filename = filename
+        self.basename = basename
+        self.geometry_type = geometry_type
+        self.ds = ds
+        self.lyr = lyr
+        self.fields = None
+        self.count = 0
+
+    def create_fields(self, V):
+        """Create attribute fields in layer from columns of V
+        """
+
+        fields = V.get_attribute_names()
+        columns = V.columns
+
+        # Establish OGR types for each column
+        ogrtypes = {}
+        for name in fields:
+            try:
+                ogrtypes[name] = column2ogrtype(columns[name])
+            except AssertionError, e:
+                msg = ('Unknown type for storing vector '
+                       'data: %s, %s' % (name, str(e)))
+                raise AssertionError(msg)
+
+        # Create attribute fields in layer
+        for name in fields:
+            fd = ogr.FieldDefn(name, ogrtypes[name])
+            # FIXME (Ole): Trying to address issue #16
+            #              But it doesn't work and
+            #              somehow changes the values of MMI in test
+            #width = max(128, len(name))
+            #print name, width
+            #fd.SetWidth(width)
+
+            # Silent handling of warnings like
+            # Warning 6: Normalized/laundered field name:
+            #'CONTENTS_LOSS_AUD' to 'CONTENTS_L'
+            gdal.PushErrorHandler('CPLQuietErrorHandler')
+            if self.lyr.CreateField(fd) != 0:
+                msg = 'Could not create field %s' % name
+                raise Exception(msg)
+
+            # Restore error handler
+            gdal.PopErrorHandler()
+
+        self.fields = fields
+
+    def write(self, V):
+        """Append features of vector layer V to file
+
+        Input
+            V: Vector layer with the same geometry type as this file
+        """
+
+        msg = ('Geometry type of layer %s does not match that of '
+               'file %s' % (V, self.filename))
+        assert V.geometry_type == self.geometry_type, msg
+
+        # Get vector data
+        coordinates, offsets = V.get_packed_geometry()
+        columns = V.columns
+        N = len(V)
+
+        # Define attributes if any
+        store_attributes = False
+        if columns is not None and N > 0:
+            if self.fields is None:
+                self.create_fields(V)
+            else:
+                msg = ('Attributes of layer %s are different from '
+                       'those already written to file %s: %s'
+                       % (V, self.filename, self.fields))
+                assert set(V.get_attribute_names()) == set(self.fields), msg
+
+            # Convert columns to lists of native Python values once
+            store_attributes = True
+            fields = self.fields
+            values = [columns[name].tolist() for name in fields]
+
+        # Encode all geometries as WKB in one go
+        wkb = coordinates2wkb(coordinates, offsets, self.geometry_type)
+
+        # Store features committing them in transactions
+        # of TRANSACTION_SIZE features
+        layer_def = self.lyr.GetLayerDefn()
+        for start in range(0, N, TRANSACTION_SIZE):
+            self.lyr.StartTransaction()
+            for i in range(start, min(start + TRANSACTION_SIZE, N)):
+                # Create new feature instance
+                feature = ogr.Feature(layer_def)
+
+                # Store geometry and check
+                geom = ogr.CreateGeometryFromWkb(wkb[i])
+                if geom is None or feature.SetGeometryDirectly(geom) != 0:
+                    msg = ('Could not create geometry for feature %i in file '
+                           '%s' % (self.count + i, self.filename))
+                    raise Exception(msg)
+
+                # Store attributes by field index
+                if store_attributes:
+                    for j in range(len(fields)):
+                        val = values[j][i]
+                        if type(val) == numpy.ndarray:
+                            # A singleton of type <type 'numpy.ndarray'>
+                            # works for gdal version 1.6 but fails for
+                            # version 1.8 in SetField with error:
+                            # NotImplementedError: Wrong number of
+                            # arguments for overloaded function
+                            val = float(val)
+
+                        feature.SetField(j, val)
+
+                # Save this feature
+                if self.lyr.CreateFeature(feature) != 0:
+                    msg = ('Failed to create feature %i in file '
+                           '%s' % (self.count + i, self.filename))
+                    raise Exception(msg)
+
+                feature.Destroy()
+            self.lyr.CommitTransaction()
+
+        self.count += N
+
+    def close(self, keywords=None):
+        """Flush features to disk and write keywords if any
+
+        Input
+            keywords: Optional dictionary of keywords for the layer
+        """
+
+        self.lyr = None
+        self.ds = None
+
+        # Write keywords if any
+        if keywords is None:
+            keywords = {}
+        write_keywords(keywords, self.basename + '.keywords')
+
+
 #----------------------------------
 # Helper functions for class Vector
 #----------------------------------
+def open_vector_layer(filename):
+    """Open vector file and get its layer
+
+    Input
+        filename: Name of vector file with exactly one layer
+
+    Output
+        fid: OGR data source. This must be kept for as long as layer is used.
+        layer: OGR layer
+    """
+
+    fid = ogr.Open(filename)
+    if fid is None:
+        msg = 'Could not open %s' % filename
+        raise IOError(msg)
+
+    # Assume that file contains all data in one layer
+    msg = 'Only one vector layer currently allowed'
+    if fid.GetLayerCount() > 1:
+        msg = ('WARNING: Number of layers in %s are %i. '
+               'Only the first layer will currently be '
+               'used.' % (filename, fid.GetLayerCount()))
+        raise Exception(msg)
+
+    layer = fid.GetLayerByIndex(0)
+    return fid, layer
+
+
+def get_field_definitions(layer):
+    """Get attribute names and types from OGR layer definition
+
+    Input
+        layer: OGR layer
+
+    Output
+        names: List of field names
+        types: List of OGR field types. These are used to determine
+               the numpy type of each column (issue #66).
+    """
+
+    layer_def = layer.GetLayerDefn()
+    names = []
+    types = []
+    for j in range(layer_def.GetFieldCount()):
+        field_def = layer_def.GetFieldDefn(j)
+        names.append(field_def.GetName())
+        types.append(field_def.GetType())
+
+    return names, types
+
+
+def counts2offsets(counts, geometry_type):
+    """Convert number of vertices per feature to offsets
+
+    Input
+        counts: Integer array with number of vertices in each feature
+        geometry_type: OGR geometry type
+
+    Output
+        offsets: Integer array of length N + 1 or None for point data.
+                 See Vector.get_packed_geometry for details.
+    """
+
+    if geometry_type == ogr.wkbPoint:
+        return None
+
+    offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum(counts)
+    return offsets
+
+
+def read_feature_batches(layer, filename, batch_size):
+    """Read features of OGR layer sequentially in batches
+
+    Input
+        layer: OGR layer
+        filename: Name of file layer came from (used in error messages)
+        batch_size: Maximal number of features in each batch
+
+    Output
+        Generator of tuples (geometry_type, coordinates, counts, columns)
+        for each batch where coordinates is an Mx2 array of all vertices,
+        counts the number of vertices in each feature and columns a
+        dictionary of attribute arrays.
+
+    Features are walked through sequentially as random access by feature
+    id is slow or unsupported by some drivers. Geometries are exported
+    as WKB and each batch is decoded in one go.
+    """
+
+    names, types = get_field_definitions(layer)
+    M = len(names)
+
+    geometry_type = None
+    wkb = []
+    values = [[] for name in names]
+
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    while feature is not None:
+        G = feature.GetGeometryRef()
+        if G is None:
+            msg = ('Geometry was None in filename %s ' % filename)
+            raise Exception(msg)
+
+        # Drop z coordinate if present
+        G.FlattenTo2D()
+
+        if geometry_type is None:
+            geometry_type = G.GetGeometryType()
+
+            if geometry_type not in [ogr.wkbPoint,
+                                     ogr.wkbLineString,
+                                     ogr.wkbPolygon]:
+                # FIXME: Unpack multiple polygons to simple polygons
+                # For hints on how to unpack see http://osgeo-org.1803224.n2.nabble.com/gdal-dev-Shapefile-Multipolygon-with-interior-rings-td5391090.html
+                msg = ('Only point, line and polygon geometries are '
+                       'supported. '
+                       'Geometry type in filename %s '
+                       'was %s.' % (filename, geometry_type))
+                raise Exception(msg)
+
+        # Record geometry as WKB ordered as Longitude, Latitude
+        wkb.append(G.ExportToWkb(ogr.wkbNDR))
+
+        # Record attributes by field index
+        for j in range(M):
+            values[j].append(feature.GetField(j))
+
+        feature.Destroy()
+        feature = layer.GetNextFeature()
+
+        if len(wkb) == batch_size or (feature is None and len(wkb) > 0):
+            coordinates, counts = wkb2coordinates(wkb, geometry_type)
+
+            columns = {}
+            for j, name in enumerate(names):
+                columns[name] = make_column(values[j],
+                                            dtype=DTYPE_MAP.get(types[j]))
+
+            yield geometry_type, coordinates, counts, columns
+
+            wkb = []
+            values = [[] for name in names]
+
+
+def read_vector_in_chunks(filename, chunk_size):
+    """Read vector file as a sequence of smaller vector layers
+
+    Input
+        filename: Name of vector file
+        chunk_size: Maximal number of features in each chunk
+
+    Output
+        Generator of Vector instances each holding up to chunk_size
+        consecutive features of the file. Name, projection and keywords
+        are the same as if the whole file had been read.
+
+    Only one chunk is held in memory at the time so this can be used
+    for layers that are too big to be read in one go.
+    """
+
+    msg = 'Chunk size must be a positive integer. I got %s' % chunk_size
+    assert chunk_size > 0, msg
+
+    # Get metadata as in read_from_file
+    basename, _ = os.path.splitext(filename)
+    keywords = read_keywords(basename + '.keywords')
+    if 'title' in keywords:
+        name = keywords['title']
+    else:
+        name = os.path.split(basename)[-1]
+
+    fid, layer = open_vector_layer(filename)
+    projection = Projection(layer.GetSpatialRef())
+
+    batches = read_feature_batches(layer, filename, chunk_size)
+    for geometry_type, coordinates, counts, columns in batches:
+        V = Vector(data=columns,
+                   projection=projection,
+                   geometry=coordinates,
+                   offsets=counts2offsets(counts, geometry_type),
+                   geometry_type=geometry_type,
+                   name=name,
+                   keywords=keywords.copy())
+        V.filename = filename
+        yield V
+
+
+def split_vector_in_chunks(V, chunk_size):
+    """Split vector layer into a sequence of smaller vector layers
+
+    Input
+        V: Vector layer
+        chunk_size: Maximal number of features in each chunk
+
+    Output
+        Generator of Vector instances each holding up to chunk_size
+        consecutive features of V. Coordinates and attributes are
+        views into those of V so no data is copied.
+    """
+
+    msg = 'Chunk size must be a positive integer. I got %s' % chunk_size
+    assert chunk_size > 0, msg
+
+    coordinates, offsets = V.get_packed_geometry()
+    N = len(V)
+    for start in range(0, N, chunk_size):
+        end = min(start + chunk_size, N)
+
+        data = None
+        if V.columns is not None:
+            data = {}
+            for key in V.attribute_names:
+                data[key] = V.columns[key][start:end]
+
+        if offsets is None:
+            chunk_coordinates = coordinates[start:end]
+            chunk_offsets = None
+        else:
+            chunk_coordinates = coordinates[offsets[start]:offsets[end]]
+            chunk_offsets = offsets[start:end + 1] - offsets[start]
+
+        yield Vector(data=data,
+                     projection=V.get_projection(),
+                     geometry=chunk_coordinates,
+                     offsets=chunk_offsets,
+                     geometry_type=V.geometry_type,
+                     name=V.get_name(),
+                     keywords=V.get_keywords().copy())
+
+
 def convert_line_to_points(V, delta):
     """Convert line vector data to point vector data
 
@@ -701,27 +1140,27 @@ def convert_line_to_points(V, delta):
     msg = 'Input data %s must be line vector data' % V
     assert V.is_line_data, msg
 
-    geometry = V.get_geometry()
-    data = V.get_data()
-    N = len(V)
+    # Calculate points for all lines and the line each came from
+    coordinates, offsets = V.get_packed_geometry()
+    points, parent = densify_lines(coordinates, offsets, delta)
 
-    # Calculate centroids for each polygon
-    points = []
-    new_data = []
-    for i in range(N):
-        c = points_along_line(geometry[i], delta)
-        # We need to create a data entry for each point.
-        new_data.extend([data[i] for thing in c])
-        points.extend(c)
+    # Replicate attributes of each line for all its points
+    new_data = None
+    if V.columns is not None:
+        new_data = {}
+        for key in V.attribute_names:
+            new_data[key] = V.columns[key][parent]
 
     # Create new point vector layer with same attributes and return
     V = Vector(data=new_data,
                projection=V.get_projection(),
                geometry=points,
+               geometry_type=ogr.wkbPoint,
                name='%s_point_data' % V.get_name(),
                keywords=V.get_keywords())
     return V
 
+
 def convert_polygons_to_centroids(V):
     """Convert polygon vector data to point vector data
 
@@ -735,18 +1174,15 @@ def convert_polygons_to_centroids(V):
     msg = 'Input data %s must be polygon vector data' % V
     assert V.is_polygon_data, msg
 
-    geometry = V.get_geometry()
-    N = len(V)
-    # Calculate points for each polygon
-    centroids = []
-    for i in range(N):
-        c = calculate_polygon_centroid(geometry[i])
-        centroids.append(c)
+    # Calculate points for all polygons
+    coordinates, offsets = V.get_packed_geometry()
+    centroids = calculate_polygon_centroids(coordinates, offsets)
 
     # Create new point vector layer with same attributes and return
-    V = Vector(data=V.get_data(),
+    V = Vector(data=V.columns,
                projection=V.get_projection(),
                geometry=centroids,
+               geometry_type=ogr.wkbPoint,
                name='%s_centroid_data' % V.get_name(),
                keywords=V.get_keywords())
     return V
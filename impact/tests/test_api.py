@@ -1,5 +1,6 @@
 import unittest
 import os
+import time
 from django.test.client import Client
 from django.utils import simplejson as json
 from django.conf import settings
@@ -10,6 +11,7 @@ from geonode.maps.models import Layer
 from geonode.maps.utils import get_valid_user
 from impact.storage.io import check_layer
 from impact.tests.utilities import TESTDATA, INTERNAL_SERVER_URL
+from impact.tests.utilities import calculate_via_api
 
 from impact.tests.plugins import unspecific_building_impact_model
 
@@ -69,14 +71,14 @@ class Test_HTTP(unittest.TestCase):
 
         # Run calculation through API
         c = Client()
-        rv = c.post('/impact/api/calculate/',
-                    dict(hazard_server=INTERNAL_SERVER_URL,
-                         hazard='geonode:earthquake_ground_shaking',
-                         exposure='geonode:population_2010_clip',
-                         exposure_server=INTERNAL_SERVER_URL,
-                         bbox='99.36,-2.199,102.237,0.00',
-                         impact_function='Earthquake Fatality Function',
-                         keywords='test,earthquake,fatality'))
+        rv = calculate_via_api(c, dict(
+                hazard_server=INTERNAL_SERVER_URL,
+                hazard='geonode:earthquake_ground_shaking',
+                exposure='geonode:population_2010_clip',
+                exposure_server=INTERNAL_SERVER_URL,
+                bbox='99.36,-2.199,102.237,0.00',
+                impact_function='Earthquake Fatality Function',
+                keywords='test,earthquake,fatality'))
 
         msg = 'Expected status code 200, got %i' % rv.status_code
         self.assertEqual(rv.status_code, 200), msg
@@ -125,7 +127,7 @@ class Test_HTTP(unittest.TestCase):
 
         # Run calculation through API
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=dict(
+        rv = calculate_via_api(c, data=dict(
                    hazard_server=INTERNAL_SERVER_URL,
                    hazard='geonode:lembang_mmi_hazmap',
                    exposure_server=INTERNAL_SERVER_URL,
@@ -156,6 +158,52 @@ class Test_HTTP(unittest.TestCase):
 
         # FIXME (Ole): Download result and check.
 
+    def test_calculation_status(self):
+        """Queued calculations report their progress through the API
+        """
+
+        c = Client()
+        rv = c.post('/impact/api/calculate/', data=dict(
+                   hazard_server=INTERNAL_SERVER_URL,
+                   hazard='geonode:no_such_hazard',
+                   exposure_server=INTERNAL_SERVER_URL,
+                   exposure='geonode:no_such_exposure',
+                   bbox='105.592,-7.809,110.159,-5.647',
+                   impact_function='Earthquake Building Damage Function',
+                   keywords='test,status'))
+
+        msg = 'Expected status code 202, got %i' % rv.status_code
+        self.assertEqual(rv.status_code, 202), msg
+
+        data = json.loads(rv.content)
+        assert data['status'] in ['queued', 'running', 'failed']
+        assert data['progress'][0]['stage'] == 'queued'
+        status_url = data['status_url']
+
+        # Wait for calculation to fail on the missing layers
+        t0 = time.time()
+        while data['status'] not in ['finished', 'failed']:
+            assert time.time() - t0 < 600
+            time.sleep(0.5)
+            rv = c.get(status_url)
+            self.assertEqual(rv.status_code, 200)
+            data = json.loads(rv.content)
+
+        assert data['status'] == 'failed'
+        assert data['errors'] is not None
+        stages = [x['stage'] for x in data['progress']]
+        assert stages == ['queued', 'metadata', 'failed'], stages
+
+        rv = c.get('/impact/api/calculation/%i/result/' % data['id'])
+        self.assertEqual(rv.status_code, 200)
+        result = json.loads(rv.content)
+        assert result['errors'] == data['errors']
+        assert 'stacktrace' in result
+
+        # Unknown calculations are not found
+        rv = c.get('/impact/api/calculation/%i/' % (data['id'] + 1000))
+        self.assertEqual(rv.status_code, 404)
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(Test_HTTP, 'test')
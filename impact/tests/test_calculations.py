@@ -25,6 +25,7 @@ from impact.storage.utilities import extract_WGS84_geotransform
 from impact.storage.utilities import extract_native_geotransform
 
 from impact.tests.utilities import TESTDATA, INTERNAL_SERVER_URL
+from impact.tests.utilities import calculate_via_api
 from owslib.wcs import WebCoverageService
 
 
@@ -159,7 +160,7 @@ class Test_calculations(unittest.TestCase):
 
         # Run calculation
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=dict(
+        rv = calculate_via_api(c, data=dict(
                 hazard_server=INTERNAL_SERVER_URL,
                 hazard=hazard_name,
                 exposure_server=INTERNAL_SERVER_URL,
@@ -255,7 +256,7 @@ class Test_calculations(unittest.TestCase):
 
             # Run calculation
             c = Client()
-            rv = c.post('/impact/api/calculate/', data=dict(
+            rv = calculate_via_api(c, data=dict(
                     hazard_server=INTERNAL_SERVER_URL,
                     hazard=hazard_name,
                     exposure_server=INTERNAL_SERVER_URL,
@@ -429,7 +430,7 @@ class Test_calculations(unittest.TestCase):
                 warnings.simplefilter('ignore')
 
                 c = Client()
-                rv = c.post('/impact/api/calculate/', data=dict(
+                rv = calculate_via_api(c, data=dict(
                         hazard_server=INTERNAL_SERVER_URL,
                         hazard=hazard_name,
                         exposure_server=INTERNAL_SERVER_URL,
@@ -518,7 +519,7 @@ class Test_calculations(unittest.TestCase):
         #with warnings.catch_warnings():
         #    warnings.simplefilter('ignore')
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=dict(
+        rv = calculate_via_api(c, data=dict(
                 hazard_server=INTERNAL_SERVER_URL,
                 hazard=hazard_name,
                 exposure_server=INTERNAL_SERVER_URL,
@@ -595,12 +596,12 @@ class Test_calculations(unittest.TestCase):
 
         # First do it correctly (twice)
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=data)
-        rv = c.post('/impact/api/calculate/', data=data)
+        rv = calculate_via_api(c, data=data)
+        rv = calculate_via_api(c, data=data)
 
         # Then check that spaces are dealt with correctly
         data['bbox'] = bbox_with_spaces
-        rv = c.post('/impact/api/calculate/', data=data)
+        rv = calculate_via_api(c, data=data)
 
         # Then with a range of wrong bbox inputs
         for bad_bbox in [bbox_list,
@@ -621,7 +622,7 @@ class Test_calculations(unittest.TestCase):
             data['bbox'] = bad_bbox
 
             # FIXME (Ole): Suppress error output from c.post
-            rv = c.post('/impact/api/calculate/', data=data)
+            rv = calculate_via_api(c, data=data)
             self.assertEqual(rv.status_code, 200)
             self.assertEqual(rv['Content-Type'], 'application/json')
             data_out = json.loads(rv.content)
@@ -991,7 +992,7 @@ class Test_calculations(unittest.TestCase):
 
         # Run calculation
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=dict(
+        rv = calculate_via_api(c, data=dict(
                 hazard_server=INTERNAL_SERVER_URL,
                 hazard=hazard_name,
                 exposure_server=INTERNAL_SERVER_URL,
@@ -1104,7 +1105,7 @@ class Test_calculations(unittest.TestCase):
 
         # Run calculation
         c = Client()
-        rv = c.post('/impact/api/calculate/', data=dict(
+        rv = calculate_via_api(c, data=dict(
                 hazard_server=INTERNAL_SERVER_URL,
                 hazard=hazard_name,
                 exposure_server=INTERNAL_SERVER_URL,
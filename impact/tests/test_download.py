@@ -0,0 +1,195 @@
+import os
+import socket
+import shutil
+import unittest
+import tempfile
+
+from impact.storage import io
+from impact.storage.io import get_file
+from impact.tests.utilities import LocalHandler, LocalServer
+
+DATA = os.urandom(100000)
+SERVICE_EXCEPTION = ('<?xml version="1.0" ?><ServiceExceptionReport>'
+                     '<ServiceException>Bad request</ServiceException>'
+                     '</ServiceExceptionReport>')
+
+
+class Handler(LocalHandler):
+    """Request handler of test server sending DATA
+
+    Paths select the behaviour:
+        /drop: Close connection after 3500 bytes the first two times
+        /always-drop: Close connection after 3500 bytes every time
+        /norange-drop: As /drop but answer range requests with everything
+        /exception: Respond with an OGC service exception
+        /error: Respond with status 500
+        /redirect: Redirect to /data
+        /moved: Respond with status 301 but no location
+    Other paths get DATA. Range requests get status 206 and the rest of
+    DATA from the given byte.
+    """
+
+    def do_GET(self):
+        if self.path == '/exception':
+            self.send_body(200, SERVICE_EXCEPTION,
+                           {'Content-Type': 'application/vnd.ogc.se_xml'})
+            return
+
+        if self.path == '/error':
+            self.send_body(500, 'Error')
+            return
+
+        if self.path == '/moved':
+            self.send_body(301, 'Error')
+            return
+
+        if self.path == '/redirect':
+            self.send_body(302, '', {'Location': self.server.url('/data')})
+            return
+
+        start = 0
+        byte_range = self.headers.getheader('Range')
+        if byte_range is not None and self.path != '/norange-drop':
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+
+        if (self.path == '/always-drop' or
+            (self.path in ['/drop', '/norange-drop'] and
+             self.server.drops < 2)):
+            self.server.drops += 1
+            self.wfile.write(DATA[start:start + 3500])
+            self.close_connection = 1
+        else:
+            self.wfile.write(DATA[start:])
+
+
+class Test_download(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer(Handler)
+        self.server.drops = 0
+
+        # Read data in small chunks so that drops happen mid download
+        self.chunk_size = io.DOWNLOAD_CHUNK_SIZE
+        io.DOWNLOAD_CHUNK_SIZE = 1000
+
+        # Record temporary directories made by get_file
+        self.tempdirs = []
+        self.mkdtemp = tempfile.mkdtemp
+
+        def mkdtemp(*args, **kwargs):
+            tempdir = self.mkdtemp(*args, **kwargs)
+            self.tempdirs.append(tempdir)
+            return tempdir
+        tempfile.mkdtemp = mkdtemp
+
+    def tearDown(self):
+        tempfile.mkdtemp = self.mkdtemp
+        for tempdir in self.tempdirs:
+            shutil.rmtree(tempdir, ignore_errors=True)
+        io.DOWNLOAD_CHUNK_SIZE = self.chunk_size
+
+        self.server.close()
+
+    def requests(self):
+        """Get paths and byte ranges of requests made to the server
+        """
+
+        return [(path, headers.getheader('Range'))
+                for path, headers in zip(self.server.requests,
+                                         self.server.headers)]
+
+    def assertRaisesAndCleansUp(self, exception, path):
+        """Check that get_file raises exception and removes its files
+        """
+
+        try:
+            get_file(self.server.url(path), '.tif')
+        except exception, e:
+            pass
+        else:
+            msg = 'Download of %s should have raised %s' % (path, exception)
+            raise Exception(msg)
+
+        assert len(self.tempdirs) == 1
+        msg = 'Temporary directory %s was not removed' % self.tempdirs[0]
+        assert not os.path.exists(self.tempdirs[0]), msg
+        return e
+
+    def test_streaming(self):
+        """Files are downloaded in chunks to a new temporary directory
+        """
+
+        filename = get_file(self.server.url('/data'), '.tif')
+        assert filename.endswith('.tif')
+        assert os.path.dirname(filename) == self.tempdirs[0]
+        assert open(filename, 'rb').read() == DATA
+        assert self.requests() == [('/data', None)]
+
+    def test_redirect(self):
+        """Redirected downloads get the file from the new location
+        """
+
+        filename = get_file(self.server.url('/redirect'), '.tif')
+        assert open(filename, 'rb').read() == DATA
+        assert self.requests() == [('/redirect', None), ('/data', None)]
+
+    def test_resume(self):
+        """Broken downloads are resumed with range requests
+        """
+
+        filename = get_file(self.server.url('/drop'), '.tif')
+        assert open(filename, 'rb').read() == DATA
+        assert self.requests() == [('/drop', None),
+                                   ('/drop', 'bytes=3500-'),
+                                   ('/drop', 'bytes=7000-')]
+
+    def test_resume_without_range(self):
+        """Downloads start again if the server ignores ranges
+        """
+
+        filename = get_file(self.server.url('/norange-drop'), '.tif')
+        assert open(filename, 'rb').read() == DATA
+        assert self.requests() == [('/norange-drop', None),
+                                   ('/norange-drop', 'bytes=3500-'),
+                                   ('/norange-drop', 'bytes=3500-')]
+
+    def test_retry_limit(self):
+        """Short bodies are detected and retried a limited number of times
+        """
+
+        e = self.assertRaisesAndCleansUp(socket.error, '/always-drop')
+        assert 'Connection closed after 3500 of' in str(e)
+        assert len(self.server.requests) == io.DOWNLOAD_RETRIES + 1
+
+        expected = [None] + ['bytes=%i-' % (3500 * (i + 1))
+                             for i in range(io.DOWNLOAD_RETRIES)]
+        assert [r for _, r in self.requests()] == expected
+
+    def test_errors(self):
+        """Service exceptions and HTTP errors are reported
+        """
+
+        e = self.assertRaisesAndCleansUp(Exception, '/exception')
+        assert 'Bad request' in str(e)
+
+        self.tempdirs = []
+        e = self.assertRaisesAndCleansUp(Exception, '/error')
+        assert 'HTTP status 500' in str(e)
+
+        # Responses other than data are errors too
+        self.tempdirs = []
+        e = self.assertRaisesAndCleansUp(Exception, '/moved')
+        assert 'HTTP status 301' in str(e)
+
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_download, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -5,9 +5,16 @@ import os
 
 from impact.engine.core import calculate_impact, get_bounding_boxes
 from impact.engine.interpolation2d import interpolate_raster
+from impact.engine import interpolation
+from impact.engine.interpolation import get_interpolation_plan
 from impact.storage.io import read_layer
+from impact.storage import vector
+from impact.storage.vector import Vector
+from impact.storage.raster import Raster
+from impact.storage.projection import DEFAULT_PROJECTION
 
 from impact.storage.utilities import unique_filename
+from impact.storage.utilities import nanallclose
 from impact.storage.io import write_vector_data
 from impact.storage.io import write_raster_data
 from impact.plugins import get_plugins
@@ -1127,6 +1134,198 @@ class Test_Engine(unittest.TestCase):
  
         #FIXME: Add assertions to verify the calculation was done correctly
 
+    def test_calculation_in_chunks(self):
+        """Vector impact calculated in chunks is the same as in one go
+        """
+
+        hazard_filename = os.path.join(TESTDATA, 'Shakemap_Padang_2009.asc')
+        exposure_filename = os.path.join(TESTDATA, 'Padang_WGS84.shp')
+        plugin_name = 'Flood Building Impact Function'
+
+        # Get layers using API
+        H = read_layer(hazard_filename)
+        E = read_layer(exposure_filename)
+
+        plugin_list = get_plugins(plugin_name)
+        IF = plugin_list[0][plugin_name]
+
+        # Reference calculation in one go
+        ref_filename = calculate_impact(layers=[H, E],
+                                        impact_fcn=IF)
+        ref = read_layer(ref_filename)
+
+        # Copy of exposure data without file (split in memory)
+        E_mem = Vector(data=E.columns,
+                       projection=E.get_projection(),
+                       geometry=E.get_geometry(),
+                       keywords=E.get_keywords())
+        assert E_mem.filename is None
+
+        for chunk_size in [1000, 3896, 100000]:
+            for exposure in [E, E_mem]:
+                impact_filename = calculate_impact(layers=[H, exposure],
+                                                   impact_fcn=IF,
+                                                   chunk_size=chunk_size)
+                I = read_layer(impact_filename)
+
+                # Same features and attributes, and caption
+                # accounts for all chunks
+                assert len(I) == len(ref)
+                assert I == ref
+                assert I.get_caption() == ref.get_caption()
+
+        # Exposure given by filename is read one chunk at a time and
+        # the full layer is never built
+        batch_sizes = []
+        read_feature_batches = vector.read_feature_batches
+
+        def record_batches(layer, filename, batch_size):
+            batch_sizes.append(batch_size)
+            return read_feature_batches(layer, filename, batch_size)
+
+        def fail(self, filename):
+            msg = 'Full layer %s should not have been read' % filename
+            raise Exception(msg)
+
+        read_from_file = Vector.__dict__['read_from_file']
+        vector.read_feature_batches = record_batches
+        Vector.read_from_file = fail
+        try:
+            impact_filename = calculate_impact(layers=[H,
+                                                       exposure_filename],
+                                               impact_fcn=IF,
+                                               chunk_size=1000)
+        finally:
+            vector.read_feature_batches = read_feature_batches
+            Vector.read_from_file = read_from_file
+
+        assert batch_sizes == [1000]
+        I = read_layer(impact_filename)
+        assert I == ref
+        assert I.get_caption() == ref.get_caption()
+
+        # Without chunks the file is read in full
+        impact_filename = calculate_impact(layers=[H, exposure_filename],
+                                           impact_fcn=IF)
+        assert read_layer(impact_filename) == ref
+
+    def test_calculation_in_tiles(self):
+        """Raster impact calculated in tiles is the same as in one go
+        """
+
+        earthquake = ('Earthquake_Ground_Shaking_clip.tif',
+                      'Population_2010_clip.tif')
+        flood = ('Flood_Current_Depth_Jakarta_geographic.asc',
+                 'Population_Jakarta_geographic.asc')
+
+        for plugin_name, filenames in [('Earthquake Fatality Function',
+                                        earthquake),
+                                       ('Earthquake Population Exposure '
+                                        'Function', earthquake),
+                                       ('Flood Impact Function', flood)]:
+
+            # Get layers using API
+            H = read_layer(os.path.join(TESTDATA, filenames[0]))
+            E = read_layer(os.path.join(TESTDATA, filenames[1]))
+
+            plugin_list = get_plugins(plugin_name)
+            IF = plugin_list[0][plugin_name]
+
+            # Reference calculation in one go
+            ref_filename = calculate_impact(layers=[H, E],
+                                            impact_fcn=IF)
+            ref = read_layer(ref_filename)
+
+            # Tiles of one row, several rows and the full grid
+            for tile_size in [1, 1000, H.columns * 7 + 3, 10 ** 9]:
+                impact_filename = calculate_impact(layers=[H, E],
+                                                   impact_fcn=IF,
+                                                   chunk_size=tile_size)
+                I = read_layer(impact_filename)
+
+                # Same grid and values, and keywords account for all tiles
+                assert I.get_geotransform() == ref.get_geotransform()
+                assert nanallclose(I.get_data(), ref.get_data(),
+                                   rtol=1.0e-12, atol=1.0e-12)
+                assert I.get_caption() == ref.get_caption()
+                assert I.get_keywords() == ref.get_keywords()
+
+    def test_interpolation_plan_cache(self):
+        """Interpolation plans are reused for the same layers
+        """
+
+        R = Raster(numpy.zeros((10, 20)), projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 0.1, 0, 5.0, 0, -0.1))
+        coordinates = numpy.zeros((50, 2))
+        coordinates[:, 0] = numpy.linspace(100.5, 101.5, 50)
+        coordinates[:, 1] = 4.5
+
+        V = Vector(projection=DEFAULT_PROJECTION, geometry=coordinates)
+        plan = get_interpolation_plan(R, V)
+        assert get_interpolation_plan(R, V) is plan
+        assert get_interpolation_plan(R, V, mode='constant') is not plan
+
+        # Layers with the same points have their own plans
+        W = Vector(projection=DEFAULT_PROJECTION, geometry=coordinates)
+        assert get_interpolation_plan(R, W) is not plan
+        assert get_interpolation_plan(R, V) is plan
+
+        # Plans are dropped with their layers
+        del V
+        get_interpolation_plan(R, Vector(projection=DEFAULT_PROJECTION,
+                                         geometry=coordinates))
+        assert plan not in [entry[2] for entry in
+                            interpolation.plan_cache]
+
+        # and kept within the size limit
+        size = sum([entry[3] for entry in interpolation.plan_cache])
+        assert size > 0
+        PLAN_CACHE_BYTES = interpolation.PLAN_CACHE_BYTES
+        try:
+            interpolation.PLAN_CACHE_BYTES = size
+            get_interpolation_plan(R, W, mode='constant')
+            assert sum([entry[3] for entry in
+                        interpolation.plan_cache]) <= size
+        finally:
+            interpolation.PLAN_CACHE_BYTES = PLAN_CACHE_BYTES
+
+    def test_interpolation_plan_cache_polygons(self):
+        """Interpolation plans for centroids are reused for polygon layers
+        """
+
+        geotransform = (100.0, 0.1, 0, 5.0, 0, -0.1)
+        H1 = Raster(numpy.ones((10, 20)), projection=DEFAULT_PROJECTION,
+                    geotransform=geotransform)
+        H2 = Raster(2 * numpy.ones((10, 20)), projection=DEFAULT_PROJECTION,
+                    geotransform=geotransform)
+
+        polygons = []
+        for x in numpy.linspace(100.5, 101.5, 20):
+            polygons.append(numpy.array([[x, 4.5], [x + 0.01, 4.5],
+                                         [x + 0.01, 4.51], [x, 4.5]]))
+        V = Vector(data={'ID': range(20)}, projection=DEFAULT_PROJECTION,
+                   geometry=polygons)
+        assert V.is_polygon_data
+
+        # Count plans computed for two hazard layers on one grid
+        plans = []
+        InterpolationPlan = interpolation.InterpolationPlan
+
+        def make_plan(*args, **kwargs):
+            plans.append(InterpolationPlan(*args, **kwargs))
+            return plans[-1]
+
+        interpolation.InterpolationPlan = make_plan
+        try:
+            I1 = interpolation.interpolate_raster_vector(H1, V, name='h')
+            I2 = interpolation.interpolate_raster_vector(H2, V, name='h')
+        finally:
+            interpolation.InterpolationPlan = InterpolationPlan
+
+        assert len(plans) == 1
+        assert numpy.allclose(I1.get_data('h'), 1)
+        assert numpy.allclose(I2.get_data('h'), 2)
+        assert numpy.allclose(I1.get_geometry(), I2.get_geometry())
 
 
 if __name__ == '__main__':
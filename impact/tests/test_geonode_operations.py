@@ -3,6 +3,8 @@ from geonode.maps.models import Layer
 from impact.storage.utilities import unique_filename, LAYER_TYPES
 from impact.storage.io import get_bounding_box
 from impact.storage.io import download, get_metadata
+from impact.storage.io import download_layers
+from impact.storage.io import capabilities_cache, invalidate_capabilities
 from django.conf import settings
 import os
 import time
@@ -711,6 +713,72 @@ class Test_geonode_connection(unittest.TestCase):
                    % (keywords['subcategory'], category))
             assert subcategory == keywords['subcategory'], msg
 
+    def test_metadata_cache(self):
+        """Capabilities are parsed once and forgotten when layers change
+        """
+
+        path = os.path.join(TESTDATA, 'lembang_schools.shp')
+        layer = save_to_geonode(path, user=self.user, overwrite=True)
+        layer_name = '%s:%s' % (layer.workspace, layer.name)
+
+        # Metadata is derived from the same capabilities
+        metadata = get_metadata(INTERNAL_SERVER_URL, layer_name)
+        entry = capabilities_cache[INTERNAL_SERVER_URL]
+        all_metadata = get_metadata(INTERNAL_SERVER_URL)
+        assert capabilities_cache[INTERNAL_SERVER_URL] is entry
+        assert all_metadata[layer_name] == metadata
+
+        # Callers get their own copies
+        metadata['keywords']['category'] = 'modified'
+        metadata = get_metadata(INTERNAL_SERVER_URL, layer_name)
+        assert metadata['keywords']['category'] == 'exposure'
+
+        # Uploads invalidate cached capabilities
+        layer = save_to_geonode(path, user=self.user, overwrite=True)
+        get_metadata(INTERNAL_SERVER_URL, layer_name)
+        assert capabilities_cache[INTERNAL_SERVER_URL] is not entry
+
+        # Unknown layers do not fetch recent capabilities again
+        entry = capabilities_cache[INTERNAL_SERVER_URL]
+        self.assertRaises(Exception, get_metadata, INTERNAL_SERVER_URL,
+                          'geonode:no_such_layer')
+        assert capabilities_cache[INTERNAL_SERVER_URL] is entry
+
+        invalidate_capabilities()
+        assert INTERNAL_SERVER_URL not in capabilities_cache
+
+    def test_download_layers(self):
+        """Layers are downloaded concurrently and returned in order
+        """
+
+        layers = []
+        for filename in ['lembang_mmi_hazmap.asc', 'lembang_schools.shp']:
+            path = os.path.join(TESTDATA, filename)
+            layer = save_to_geonode(path, user=self.user, overwrite=True)
+            layer_name = '%s:%s' % (layer.workspace, layer.name)
+            layers.append((INTERNAL_SERVER_URL, layer_name,
+                           get_bounding_box(path)))
+
+        downloaded = download_layers(layers)
+        for i, L in enumerate(downloaded):
+            ref = download(*layers[i])
+            assert L.get_name() == ref.get_name()
+            if L.is_raster:
+                assert nanallclose(L.get_data(), ref.get_data())
+            else:
+                assert len(L) == len(ref)
+
+        # Errors are the same as when downloading one layer at a time
+        layers.append((INTERNAL_SERVER_URL, 'geonode:no_such_layer',
+                       layers[0][2]))
+        try:
+            download_layers(layers)
+        except Exception, e:
+            assert 'geonode:no_such_layer' in str(e)
+        else:
+            msg = 'Download of non existing layer should have failed'
+            raise Exception(msg)
+
     def test_native_raster_resolution(self):
         """Raster layer retains native resolution through Geoserver
 
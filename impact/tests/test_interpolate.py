@@ -2,6 +2,9 @@ import unittest
 import numpy
 
 from impact.engine.interpolation2d import interpolate2d, interpolate_raster
+from impact.engine.interpolation2d import InterpolationPlan
+from impact.engine.interpolation2d import get_regular_spacing
+from impact.engine.interpolation2d import find_neighbours
 from impact.tests.utilities import combine_coordinates
 from impact.storage.utilities import nanallclose
 
@@ -441,6 +444,135 @@ class Test_interpolate(unittest.TestCase):
 
         assert numpy.allclose(vals, refs, rtol=1e-12, atol=1e-12)
 
+    def test_interpolation_plan(self):
+        """Interpolation plan can be reused for different arrays
+        """
+
+        # Non-equidistant mesh
+        x = numpy.array([1.0, 1.5, 2.5, 4.0, 7.0])
+        y = numpy.array([4.0, 4.3, 5.0, 6.5])
+
+        # Points inside, outside and on the boundary of the domain
+        points = combine_coordinates(numpy.linspace(0.5, 7.5, 23),
+                                     numpy.linspace(3.5, 7.0, 17))
+        points[5, 0] = numpy.nan
+
+        for mode in ['linear', 'constant']:
+            plan = InterpolationPlan(x, y, points, mode=mode)
+
+            for i in range(3):
+                A = numpy.random.random((len(x), len(y)))
+                if i == 2:
+                    A[2, 1] = numpy.nan
+
+                vals = plan.interpolate(A)
+                refs = interpolate2d(x, y, A, points, mode=mode)
+                assert len(vals) == len(points)
+                assert numpy.all(numpy.isnan(vals) == numpy.isnan(refs))
+
+                idx = numpy.logical_not(numpy.isnan(refs))
+                assert numpy.allclose(vals[idx], refs[idx],
+                                      rtol=1e-12, atol=1e-12)
+
+                # Raster data is organised latitudes from top down
+                R = numpy.flipud(A.transpose())
+                vals = plan.interpolate_raster(R)
+                refs = interpolate_raster(x, y, R, points, mode=mode)
+                assert numpy.all(numpy.isnan(vals) == numpy.isnan(refs))
+
+            # Arrays must match the mesh of the plan
+            try:
+                plan.interpolate(numpy.zeros((len(y), len(x))))
+            except AssertionError:
+                pass
+            else:
+                msg = 'Should have raised AssertionError'
+                raise Exception(msg)
+
+    def test_interpolation_regular_grid(self):
+        """Neighbours on equidistant mesh are the same as when searching
+        """
+
+        x = numpy.linspace(100.5, 107.5, 8)
+        y = numpy.linspace(5.5, 9.5, 5)
+        spacing = get_regular_spacing(x)
+        assert numpy.allclose(spacing, 1.0)
+
+        x_irregular = x.copy()
+        x_irregular[3] += 0.2
+        assert get_regular_spacing(x_irregular) is None
+
+        # Points inside, outside and exactly on mesh lines
+        xi = numpy.concatenate([numpy.linspace(100, 108, 33), x])
+        inside = (xi >= x[0]) & (xi <= x[-1])
+
+        idx, alpha = find_neighbours(x, xi, inside.copy())
+        ref_idx, ref_alpha = find_neighbours(x, xi, inside.copy(),
+                                             spacing=spacing)
+        assert numpy.all(idx[inside] == ref_idx[inside])
+        assert numpy.allclose(alpha[inside], ref_alpha[inside],
+                              rtol=1e-12, atol=1e-12)
+
+        # Results including NaN propagation and single precision
+        A = numpy.zeros((len(x), len(y)))
+        for i in range(len(x)):
+            for j in range(len(y)):
+                A[i, j] = linear_function(x[i], y[j])
+        A[2, 3] = numpy.nan
+
+        etas = numpy.concatenate([numpy.linspace(5, 10, 21), y])
+        points = combine_coordinates(xi, etas)
+        refs = linear_function(points[:, 0], points[:, 1])
+
+        vals = interpolate2d(x, y, A, points, mode='linear')
+        assert numpy.all(numpy.isnan(vals[numpy.isnan(refs)]))
+        I = numpy.logical_not(numpy.isnan(vals))
+        assert numpy.allclose(vals[I], refs[I], rtol=1e-12, atol=1e-12)
+
+        for mode in ['linear', 'constant']:
+            vals = interpolate2d(x, y, A, points, mode=mode)
+            plan = InterpolationPlan(x, y, points, mode=mode, dtype='f')
+            vals32 = plan.interpolate(A)
+            assert vals32.dtype == numpy.float32
+            assert nanallclose(vals32, vals, rtol=1.0e-6, atol=1.0e-5)
+
+    def test_interpolation_nearly_regular_grid(self):
+        """Weights on nearly equidistant mesh come from actual coordinates
+        """
+
+        # Mesh deviating from equidistant by less than a tenth of spacing
+        x = numpy.array([0.0, 1.0, 2.05, 3.0])
+        y = numpy.array([10.0, 11.0, 11.95, 13.0])
+        assert get_regular_spacing(x) is not None
+        assert get_regular_spacing(y) is not None
+
+        # Linear function is reproduced exactly
+        A = numpy.zeros((len(x), len(y)))
+        for i in range(len(x)):
+            for j in range(len(y)):
+                A[i, j] = linear_function(x[i], y[j])
+
+        xi = numpy.array([2.0, 1.5, 2.5, 0.0, 3.0, 2.05])
+        etas = numpy.array([11.5, 12.0, 11.95, 10.0, 13.0, 12.5])
+        points = numpy.array(zip(xi, etas))
+        refs = linear_function(xi, etas)
+
+        for spacing in [None, get_regular_spacing(x)]:
+            inside = numpy.ones(len(xi), dtype='bool')
+            idx, alpha = find_neighbours(x, xi, inside, spacing=spacing)
+            assert numpy.allclose(x[idx - 1] + alpha * (x[idx] - x[idx - 1]),
+                                  xi, rtol=1e-12, atol=1e-12)
+
+        vals = interpolate2d(x, y, A, points, mode='linear')
+        assert numpy.allclose(vals, refs, rtol=1e-12, atol=1e-12)
+
+        # Simple case from one dimension
+        A = numpy.array([x, x]).transpose()
+        vals = interpolate2d(x, numpy.array([0.0, 1.0]), A,
+                             numpy.array([[2.0, 0.5], [1.5, 0.5],
+                                          [2.5, 0.5]]))
+        assert numpy.allclose(vals, [2.0, 1.5, 2.5], rtol=1e-12, atol=1e-12)
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(Test_interpolate, 'test')
@@ -1,18 +1,25 @@
 import unittest
 import numpy
 import os
+import time
+import shutil
+import struct
 import impact
 
-from osgeo import gdal
+from osgeo import gdal, ogr
 
 from impact.storage.raster import Raster
 from impact.storage.vector import Vector
 from impact.storage.vector import convert_polygons_to_centroids
+from impact.storage.vector import convert_line_to_points
+from impact.storage.vector import read_vector_in_chunks
+from impact.storage.vector import split_vector_in_chunks
 from impact.storage.projection import Projection
 from impact.storage.projection import DEFAULT_PROJECTION
 from impact.storage.io import read_layer
 from impact.storage.io import write_vector_data
 from impact.storage.io import write_raster_data
+from impact.storage.io import is_service_exception
 from impact.storage.utilities import unique_filename
 from impact.storage.utilities import write_keywords
 from impact.storage.utilities import read_keywords
@@ -22,12 +29,30 @@ from impact.storage.utilities import buffered_bounding_box
 from impact.storage.utilities import array2wkt
 from impact.storage.utilities import calculate_polygon_area
 from impact.storage.utilities import calculate_polygon_centroid
+from impact.storage.utilities import calculate_polygon_areas
+from impact.storage.utilities import calculate_polygon_centroids
+from impact.storage.utilities import pack_geometry
+from impact.storage.utilities import points_between_points
 from impact.storage.utilities import points_along_line
+from impact.storage.utilities import densify_lines
+from impact.storage.utilities import unpack_geometry
+from impact.storage.utilities import wkb2coordinates
+from impact.storage.utilities import coordinates2wkb
 from impact.storage.utilities import geotransform2bbox
 from impact.storage.utilities import geotransform2resolution
+from impact.storage.utilities import bbox2window
+from impact.storage.utilities import window2geotransform
 from impact.storage.utilities import nanallclose
 from impact.storage.io import get_bounding_box
 from impact.storage.io import bboxlist2string, bboxstring2list
+from impact.storage.cache import metadata_checksum
+from impact.storage.cache import read_raster_from_cache
+from impact.storage.cache import write_raster_to_cache
+from impact.storage.cache import layer_cache_key, get_cached_file
+from impact.storage.cache import add_file_to_cache, evict_from_cache
+from impact.storage.cache import get_cache_entries
+from impact.storage.cache import remove_layer_from_cache
+from impact.storage import cache
 from impact.tests.utilities import same_API
 from impact.tests.utilities import TESTDATA
 from impact.tests.utilities import FEATURE_COUNTS
@@ -285,6 +310,79 @@ class Test_IO(unittest.TestCase):
             msg = 'Should have raised TypeError'
             raise Exception(msg)
 
+    def test_vector_attribute_columns(self):
+        """Vector attributes are stored as typed columns
+        """
+
+        # Read data file
+        layername = 'lembang_schools.shp'
+        filename = '%s/%s' % (TESTDATA, layername)
+        V = read_layer(filename)
+        N = len(V)
+
+        # Numeric attributes come back as numpy arrays
+        A = V.get_data('FLOOR_AREA')
+        assert isinstance(A, numpy.ndarray)
+        assert A.dtype.kind == 'f'
+        assert len(A) == N
+
+        # Columns are read only views unless a copy is requested
+        assert not A.flags.writeable
+        assert numpy.may_share_memory(A, V.get_data('FLOOR_AREA'))
+        self.assertRaises((RuntimeError, ValueError), A.__setitem__, 0, 1)
+        B = V.get_data('FLOOR_AREA', copy=True)
+        assert B.flags.writeable
+        assert not numpy.may_share_memory(A, B)
+        assert numpy.all(A == B)
+
+        # Single values are native Python scalars
+        for i in range(N):
+            assert V.get_data('FLOOR_AREA', i) == A[i]
+            assert V.data[i]['FLOOR_AREA'] == A[i]
+
+        # Modifying copies does not change the layer
+        B[:] = -1
+        assert numpy.all(V.get_data('FLOOR_AREA') == A)
+        assert V.data[0]['FLOOR_AREA'] == A[0]
+        assert A[0] != -1
+
+        # while attributes in V.data can not be modified
+        try:
+            V.data[0]['FLOOR_AREA'] = -1
+        except Exception:
+            pass
+        else:
+            msg = 'Should have raised exception'
+            raise Exception(msg)
+        assert V.data[0]['FLOOR_AREA'] == A[0]
+
+        # Vector can be instantiated from a dictionary of columns
+        columns = {}
+        for name in V.get_attribute_names():
+            columns[name] = V.get_data(name)
+        V_new = Vector(data=columns,
+                       projection=V.get_projection(),
+                       geometry=V.get_geometry())
+        assert V_new == V
+
+        # List of dictionaries gives the same result
+        V_new = Vector(data=V.get_data(),
+                       projection=V.get_projection(),
+                       geometry=V.get_geometry())
+        assert V_new == V
+
+        # Columns of wrong length are caught
+        columns['FLOOR_AREA'] = A[:-1]
+        try:
+            Vector(data=columns,
+                   projection=V.get_projection(),
+                   geometry=V.get_geometry())
+        except AssertionError:
+            pass
+        else:
+            msg = 'Should have raised AssertionError'
+            raise Exception(msg)
+
     def test_reading_and_writing_of_vector_polygon_data(self):
         """Vector polygon data can be read and written correctly
         """
@@ -1382,6 +1480,56 @@ class Test_IO(unittest.TestCase):
         V.write_to_file(out_filename)
 
 
+    def test_polygon_areas_and_centroids(self):
+        """Areas and centroids of packed polygons are computed correctly
+        """
+
+        # Polygons far from origin, building footprints, an empty polygon
+        # and polygons in both orientations
+        polygons = [numpy.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]),
+                    numpy.array([[168, -2], [169, -2], [169, -1],
+                                 [168, -1], [168, -2]]),
+                    numpy.zeros((0, 2)),
+                    numpy.array([[106.7922547, -6.2297884],
+                                 [106.7924589, -6.2298087],
+                                 [106.7924538, -6.2299127],
+                                 [106.7922547, -6.2298899],
+                                 [106.7922547, -6.2297884]]),
+                    numpy.array([[0, 0], [0, 2], [3, 2], [3, 0], [0, 0]])]
+
+        filename = '%s/%s' % (TESTDATA, 'OSM_subset.shp')
+        polygons.extend(read_layer(filename).get_geometry())
+
+        coordinates, offsets = pack_geometry(polygons)
+        A = calculate_polygon_areas(coordinates, offsets, signed=True)
+        C = calculate_polygon_centroids(coordinates, offsets)
+        assert len(A) == len(polygons)
+        assert C.shape == (len(polygons), 2)
+
+        # Empty polygon
+        assert A[2] == 0
+        assert numpy.all(numpy.isnan(C[2]))
+
+        # Results do not depend on the location of the polygons
+        shift = numpy.array([-106.0, 6.0])
+        A_ref = calculate_polygon_areas(coordinates + shift, offsets,
+                                        signed=True)
+        C_ref = calculate_polygon_centroids(coordinates + shift, offsets)
+        assert numpy.allclose(A, A_ref, rtol=1.0e-9, atol=0)
+        assert nanallclose(C, C_ref - shift, rtol=0, atol=1.0e-12)
+
+        assert numpy.allclose(A[0], 1)
+        assert numpy.allclose(C[1], [168.5, -1.5])
+        assert numpy.allclose(A[4], -6)
+        assert numpy.allclose(C[4], [1.5, 1])
+
+        # Centroid of building footprint against reference from qgis
+        reference_centroid = [106.79235602697445, -6.229849764722536]
+        assert numpy.allclose(C[3], reference_centroid, rtol=1.0e-8)
+
+        A = calculate_polygon_areas(coordinates, offsets)
+        assert numpy.allclose(A[4], 6)
+
     def test_line_to_points(self):
         """Points along line are computed correctly
         """
@@ -1429,6 +1577,227 @@ class Test_IO(unittest.TestCase):
                    name='Test points_along_line')
         V.write_to_file(out_filename)
 
+    def test_densify_lines(self):
+        """Points along many lines are computed in one go
+        """
+
+        lines = [numpy.array([[0, 0], [2, 0]]),
+                 numpy.zeros((0, 2)),
+                 numpy.array([[168, -2], [170, -2], [170, 0]]),
+                 numpy.array([[3, 3]]),
+                 numpy.array([[0, 0], [0.5, 0], [0.5, 0], [0.5, 2.5],
+                              [0.5, 2.50000001], [1.7, 2.5]])]
+        coordinates, offsets = pack_geometry(lines)
+        points, parent = densify_lines(coordinates, offsets, 1)
+        assert len(points) == len(parent)
+
+        # Lines with less than two vertices have no points
+        assert numpy.sum(parent == 1) == 0
+        assert numpy.sum(parent == 3) == 0
+
+        expected = [[0, 0], [1, 0], [2, 0]]
+        assert numpy.allclose(points[parent == 0], expected)
+
+        expected = [[168, -2], [169, -2], [170, -2], [170, -1], [170, 0]]
+        assert numpy.allclose(points[parent == 2], expected)
+
+        # Repeated vertices give one point
+        expected = [[0, 0], [0.5, 0], [0.5, 1], [0.5, 2], [0.5, 2.5],
+                    [1.5, 2.5]]
+        assert numpy.allclose(points[parent == 4], expected)
+
+        # Same as adding points segment by segment, leaving out start
+        # points equal to the last point added. Short and repeated
+        # segments give runs of segments adding no points.
+        numpy.random.seed(17)
+        lines = [numpy.random.randint(0, 3, (20, 2)) * 0.25
+                 for i in range(50)]
+        coordinates, offsets = pack_geometry(lines)
+        points, parent = densify_lines(coordinates, offsets, 0.5)
+        for i, line in enumerate(lines):
+            C = []
+            for j in range(len(line) - 1):
+                with numpy.errstate(invalid='ignore'):
+                    pts = points_between_points(line[j], line[j + 1], 0.5)
+                if len(C) > 0 and numpy.allclose(C[-1], pts[0]):
+                    pts = pts[1:]
+                C.extend(pts)
+            assert numpy.allclose(points[parent == i], C)
+
+        # Same as one line at a time
+        filename = '%s/%s' % (TESTDATA, 'indonesia_highway_sample.shp')
+        layer = read_layer(filename)
+        geometry = layer.get_geometry()
+        coordinates, offsets = layer.get_packed_geometry()
+        delta = 0.01
+        points, parent = densify_lines(coordinates, offsets, delta)
+        for i, line in enumerate(geometry):
+            C = points_along_line(line, delta)
+            assert numpy.allclose(points[parent == i], C)
+
+        # Line layers are converted to points with attributes of lines
+        V = convert_line_to_points(layer, delta)
+        assert V.is_point_data
+        assert numpy.allclose(V.get_geometry(), points)
+        for key in layer.get_attribute_names():
+            for i in [0, len(V) / 2, len(V) - 1]:
+                assert (V.get_data(key, i) ==
+                        layer.get_data(key, int(parent[i])))
+
+    def test_packed_geometry(self):
+        """Polygon geometry is stored as packed coordinates and offsets
+        """
+
+        # Simple polygons
+        P1 = numpy.array([[0, 0], [1, 0], [1, 1], [0, 0]])
+        P2 = numpy.array([[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]])
+        coordinates, offsets = pack_geometry([P1, P2])
+        assert coordinates.shape == (9, 2)
+        assert numpy.allclose(offsets, [0, 4, 9])
+
+        geometry = unpack_geometry(coordinates, offsets)
+        assert len(geometry) == 2
+        assert numpy.allclose(geometry[0], P1)
+        assert numpy.allclose(geometry[1], P2)
+
+        # Packed geometry is used by Vector
+        V = Vector(data={'ID': [1, 2]},
+                   projection=DEFAULT_PROJECTION,
+                   geometry=[P1, P2])
+        assert len(V) == 2
+        coordinates, offsets = V.get_packed_geometry()
+        assert numpy.allclose(offsets, [0, 4, 9])
+
+        V_new = Vector(data={'ID': [1, 2]},
+                       projection=DEFAULT_PROJECTION,
+                       geometry=coordinates,
+                       offsets=offsets,
+                       geometry_type=V.geometry_type)
+        assert V_new == V
+
+        # Real polygon layer survives a round trip through file
+        filename = '%s/%s' % (TESTDATA, 'test_polygon.shp')
+        layer = read_layer(filename)
+        coordinates, offsets = layer.get_packed_geometry()
+        geometry = layer.get_geometry()
+        assert len(offsets) == len(layer) + 1
+        for i in range(len(layer)):
+            assert numpy.allclose(geometry[i],
+                                  coordinates[offsets[i]:offsets[i + 1]])
+
+        tmp_filename = unique_filename(suffix='.shp')
+        layer.write_to_file(tmp_filename)
+        assert read_layer(tmp_filename) == layer
+
+    def test_vector_chunks(self):
+        """Vector layers can be read and split in chunks
+        """
+
+        for vectorname in ['lembang_schools.shp', 'test_polygon.shp']:
+            filename = '%s/%s' % (TESTDATA, vectorname)
+            V = read_layer(filename)
+            N = len(V)
+
+            for chunk_size in [1, 7, N, N + 1]:
+                for chunks in [read_vector_in_chunks(filename, chunk_size),
+                               split_vector_in_chunks(V, chunk_size)]:
+                    chunks = list(chunks)
+                    assert len(chunks) == (N + chunk_size - 1) / chunk_size
+
+                    i = 0
+                    for chunk in chunks:
+                        assert 0 < len(chunk) <= chunk_size
+                        assert chunk.get_name() == V.get_name()
+                        assert chunk.get_keywords() == V.get_keywords()
+
+                        # Compare to the same features of the full layer
+                        geometry = V.get_geometry()
+                        for j, g in enumerate(chunk.get_geometry()):
+                            assert numpy.allclose(g, geometry[i + j])
+
+                        for key in V.get_attribute_names():
+                            x = chunk.get_data(key)
+                            y = V.get_data(key)[i:i + len(chunk)]
+                            assert x.tolist() == y.tolist()
+
+                        i += len(chunk)
+                    assert i == N
+
+    def test_wkb2coordinates(self):
+        """Batches of WKB geometries are decoded correctly
+        """
+
+        P1 = numpy.array([[0, 0], [1, 0], [1, 1], [0, 0]], dtype='d')
+        P2 = numpy.array([[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]], dtype='d')
+
+        # Polygons (the second has a hole which must be ignored)
+        wkb = []
+        for rings in [[P1], [P2, P1]]:
+            w = struct.pack('<BII', ogr.wkbNDR, ogr.wkbPolygon, len(rings))
+            for ring in rings:
+                w += struct.pack('<I', len(ring))
+                w += ring.astype('<f8').tostring()
+            wkb.append(w)
+
+        coordinates, counts = wkb2coordinates(wkb, ogr.wkbPolygon)
+        assert numpy.allclose(counts, [4, 5])
+        assert numpy.allclose(coordinates, numpy.concatenate([P1, P2]))
+
+        # Lines
+        wkb = []
+        for line in [P1, P2]:
+            w = struct.pack('<BII', ogr.wkbNDR, ogr.wkbLineString, len(line))
+            wkb.append(w + line.astype('<f8').tostring())
+
+        coordinates, counts = wkb2coordinates(wkb, ogr.wkbLineString)
+        assert numpy.allclose(counts, [4, 5])
+        assert numpy.allclose(coordinates, numpy.concatenate([P1, P2]))
+
+        # Points
+        wkb = [struct.pack('<BIdd', ogr.wkbNDR, ogr.wkbPoint, x, y)
+               for x, y in P2]
+        coordinates, counts = wkb2coordinates(wkb, ogr.wkbPoint)
+        assert numpy.allclose(counts, 1)
+        assert numpy.allclose(coordinates, P2)
+
+        # Mixed geometry types are caught
+        try:
+            wkb2coordinates(wkb, ogr.wkbPolygon)
+        except Exception:
+            pass
+        else:
+            msg = 'Mixed geometry types should have raised an exception'
+            raise Exception(msg)
+
+        # Encoding is the inverse of decoding
+        coordinates, offsets = pack_geometry([P1, P2, P1])
+        for geometry_type in [ogr.wkbPolygon, ogr.wkbLineString]:
+            wkb = coordinates2wkb(coordinates, offsets, geometry_type)
+            assert len(wkb) == 3
+
+            C, counts = wkb2coordinates(wkb, geometry_type)
+            assert numpy.allclose(counts, [4, 5, 4])
+            assert numpy.allclose(C, coordinates)
+
+        wkb = coordinates2wkb(P2, None, ogr.wkbPoint)
+        C, counts = wkb2coordinates(wkb, ogr.wkbPoint)
+        assert numpy.allclose(C, P2)
+
+        # Agrees with OGR's own parsing
+        filename = '%s/%s' % (TESTDATA, 'test_polygon.shp')
+        layer = read_layer(filename)
+        geometry = layer.get_geometry()
+        for i, P in enumerate(geometry):
+            wkt = array2wkt(P, geom_type='POLYGON')
+            G = ogr.CreateGeometryFromWkt(wkt)
+            coordinates, counts = wkb2coordinates([G.ExportToWkb(ogr.wkbNDR)],
+                                                  ogr.wkbPolygon)
+            assert numpy.allclose(coordinates, P)
+
+            wkb = coordinates2wkb(P, [0, len(P)], ogr.wkbPolygon)
+            G_new = ogr.CreateGeometryFromWkb(wkb[0])
+            assert G_new.Equals(G)
+
 
     def test_geotransform2bbox(self):
         """Bounding box can be extracted from geotransform
@@ -1461,6 +1830,225 @@ class Test_IO(unittest.TestCase):
             assert numpy.allclose(res, gt[1], rtol=0, atol=1.0e-12)
             assert numpy.allclose(res, - gt[5], rtol=0, atol=1.0e-12)
 
+    def test_raster_windows(self):
+        """Blocks of raster data can be read by window or bounding box
+        """
+
+        for rastername in ['Population_2010_clip.tif',
+                           'Earthquake_Ground_Shaking.asc']:
+
+            filename = '%s/%s' % (TESTDATA, rastername)
+            R = read_layer(filename)
+            gt = R.get_geotransform()
+            N, M = R.columns, R.rows
+
+            # Reading a window before anything else reads only that block
+            window = (3, 5, N / 2, M / 3)
+            xoff, yoff, xsize, ysize = window
+            B = R.get_data(window=window)
+            assert B.shape == (ysize, xsize)
+
+            A = R.get_data()
+            assert A.shape == (M, N)
+            assert nanallclose(B, A[yoff:yoff + ysize, xoff:xoff + xsize])
+
+            # Subsequent windows are sliced from the same data
+            B = R.get_data(window=window, nan=False)
+            C = R.get_data(nan=False)
+            assert numpy.allclose(B, C[yoff:yoff + ysize, xoff:xoff + xsize])
+
+            # Returned arrays can be modified without affecting the layer
+            A[:] = 0
+            assert nanallclose(R.get_data(window=window),
+                               R.get_data()[yoff:yoff + ysize,
+                                            xoff:xoff + xsize])
+            assert not numpy.allclose(R.get_data(nan=0), 0)
+
+            # Bounding box of a window maps back to that window
+            sub_gt = window2geotransform(window, gt)
+            bbox = geotransform2bbox(sub_gt, xsize, ysize)
+            assert bbox2window(bbox, gt, N, M) == window
+
+            B = R.get_data(bbox=bbox)
+            assert nanallclose(B, R.get_data(window=window))
+
+            # Bounding boxes are clipped to the grid
+            bbox = R.get_bounding_box()
+            big_bbox = [bbox[0] - 1, bbox[1] - 1, bbox[2] + 1, bbox[3] + 1]
+            assert bbox2window(big_bbox, gt, N, M) == (0, 0, N, M)
+
+            # Windows outside the grid are rejected
+            try:
+                R.get_data(window=(N - 1, 0, 2, 1))
+            except AssertionError:
+                pass
+            else:
+                msg = 'Should have raised AssertionError'
+                raise Exception(msg)
+
+    def test_raster_cache(self):
+        """Raster data can be cached and memory mapped
+        """
+
+        cachedir = unique_filename(suffix='_cache')
+        for rastername in ['Population_2010_clip.tif',
+                           'Earthquake_Ground_Shaking.asc']:
+
+            filename = '%s/%s' % (TESTDATA, rastername)
+            R = read_layer(filename)
+
+            key = layer_cache_key('http://localhost', 'geonode:test',
+                                  R.get_bounding_box(),
+                                  R.get_resolution(),
+                                  metadata_checksum({'name': rastername}))
+
+            # Equivalent bounding boxes give the same key
+            bbox_string = bboxlist2string(R.get_bounding_box(), decimals=8)
+            assert key == layer_cache_key('http://localhost',
+                                          'geonode:test',
+                                          bbox_string,
+                                          R.get_resolution(),
+                                          metadata_checksum(
+                                              {'name': rastername}))
+
+            assert read_raster_from_cache(cachedir, key) is None
+            write_raster_to_cache(R, cachedir, key)
+            C = read_raster_from_cache(cachedir, key)
+
+            # Cached layer is the same as the original
+            assert C == R
+            assert C.get_keywords() == R.get_keywords()
+            assert nanallclose(C.get_data(), R.get_data())
+            assert nanallclose(C.get_data(nan=0), R.get_data(nan=0))
+
+            # Data is a read only view of the cache file
+            A = C.get_data(nan=False, scaling=False, copy=False)
+            assert isinstance(A, numpy.memmap)
+            assert not A.flags.writeable
+
+            # Ordinary requests still get a copy
+            A = C.get_data()
+            assert not isinstance(A, numpy.memmap)
+            A[:] = 0
+
+            # Raster data counts towards the size of its entry
+            sizes = dict([(k, size) for _, size, k
+                          in get_cache_entries(cachedir)])
+            assert sizes[key] > A.nbytes
+
+        # and is evicted with it
+        evict_from_cache(cachedir, 0, min_age=0)
+        assert get_cache_entries(cachedir) == []
+        assert read_raster_from_cache(cachedir, key) is None
+
+    def test_download_cache(self):
+        """Downloaded files are cached and evicted least recently used first
+        """
+
+        cachedir = unique_filename(suffix='_cache')
+        filename = os.path.join(TESTDATA, 'Population_2010_clip.tif')
+        size = os.path.getsize(filename)
+
+        # Equivalent requests share entries. Vectors have no resolution.
+        key = layer_cache_key('http://localhost', 'geonode:test',
+                              '1,2,3,4', None, 'a')
+        assert key == layer_cache_key('http://localhost', 'geonode:test',
+                                      [1.0, 2.0, 3.0, 4.0000001], None, 'a')
+        assert key != layer_cache_key('http://localhost', 'geonode:test',
+                                      '1,2,3,4', None, 'b')
+
+        # Evict entries regardless of when they were used
+        min_age = cache.MIN_AGE
+        cache.MIN_AGE = 0
+        try:
+            keys = self.fill_download_cache(cachedir, filename, size)
+        finally:
+            cache.MIN_AGE = min_age
+
+        assert get_cached_file(cachedir, keys[0]) is not None
+        assert get_cached_file(cachedir, keys[1]) is None
+        assert get_cached_file(cachedir, keys[2]) is not None
+
+        # Recently used entries are kept as they may still be being read
+        assert evict_from_cache(cachedir, 0) == []
+        assert remove_layer_from_cache(cachedir, 'geonode:test') == []
+        assert len(get_cache_entries(cachedir)) == 2
+
+        # Entries of layers uploaded again can be removed
+        deleted = remove_layer_from_cache(cachedir, 'geonode:test',
+                                          min_age=0)
+        assert deleted == [keys[0]]
+
+        # Eviction to zero bytes removes everything
+        deleted = evict_from_cache(cachedir, 0, min_age=0)
+        assert deleted == [keys[2]]
+        assert get_cache_entries(cachedir) == []
+
+    def fill_download_cache(self, cachedir, filename, size):
+        """Add three entries to cache with room for two of them
+
+        The second entry is evicted. The third is of layer geonode:other.
+        """
+
+        keys = []
+        for i in range(3):
+            if i < 2:
+                layer_name = 'geonode:test'
+            else:
+                layer_name = 'geonode:other'
+
+            key = layer_cache_key('http://localhost', layer_name,
+                                  [1, 2, 3, 4], (0.1, 0.1), str(i))
+            assert get_cached_file(cachedir, key) is None
+
+            # Download directory with layer and keywords files
+            dirname = unique_filename(suffix='_download')
+            os.mkdir(dirname)
+            tifname = os.path.join(dirname, 'layer.tif')
+            shutil.copy(filename, tifname)
+            write_keywords({'category': 'hazard'},
+                           os.path.join(dirname, 'layer.keywords'))
+
+            cached = add_file_to_cache(tifname, cachedir, key,
+                                       max_bytes=2 * size + 1000,
+                                       layer_name=layer_name)
+            assert not os.path.exists(dirname)
+            assert get_cached_file(cachedir, key) == cached
+
+            # Cache hits are read as layers
+            R = read_layer(cached)
+            assert R.get_keywords() == {'category': 'hazard'}
+            assert numpy.allclose(R.get_data(nan=0),
+                                  read_layer(filename).get_data(nan=0))
+
+            keys.append(key)
+            time.sleep(0.01)
+
+            # Use first entry again so that second one is evicted
+            if i == 1:
+                assert get_cached_file(cachedir, keys[0]) is not None
+                time.sleep(0.01)
+
+        return keys
+
+    def test_service_exception_detection(self):
+        """Error messages from OWS servers are told apart from data
+        """
+
+        error = ('<?xml version="1.0" ?>\n<ServiceExceptionReport>'
+                 '<ServiceException>Could not find layer'
+                 '</ServiceException></ServiceExceptionReport>')
+        assert is_service_exception(None, error)
+        assert is_service_exception('application/vnd.ogc.se_xml', '')
+        assert is_service_exception('text/xml', 'Whatever')
+        assert is_service_exception('image/tiff', '  ' + error)
+
+        filename = '%s/%s' % (TESTDATA, 'Population_2010_clip.tif')
+        data = open(filename, 'rb').read(2 ** 18)
+        assert not is_service_exception('image/tiff', data)
+        assert not is_service_exception(None, data)
+        assert not is_service_exception('application/zip', 'PK\x03\x04')
+
 
 
     def test_reading_and_writing_of_vector_line_data(self):
@@ -0,0 +1,80 @@
+import unittest
+import numpy
+
+from impact.engine.line_sampling import sample_raster_along_lines
+from impact.engine.line_sampling import merge_line_pieces
+from impact.storage.raster import Raster
+from impact.storage.projection import DEFAULT_PROJECTION
+from impact.storage.utilities import pack_geometry
+
+
+class Test_line_sampling(unittest.TestCase):
+
+    def test_sample_raster_along_lines(self):
+        """Lines are split at grid cells and sampled in each cell
+        """
+
+        geotransform = (100.0, 0.1, 0, 10.0, 0, -0.1)
+        A = numpy.arange(30 * 40, dtype='d').reshape((30, 40))
+        A[2, 4] = numpy.nan
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+
+        # Lines along rows and columns, starting outside the grid,
+        # without segments and with a repeated vertex
+        lines = [numpy.array([[100.05, 9.95], [100.45, 9.95],
+                              [100.45, 9.55]]),
+                 numpy.array([[99.9, 9.0], [100.25, 9.07]]),
+                 numpy.zeros((0, 2)),
+                 numpy.array([[101, 9.0]]),
+                 numpy.array([[100.12, 9.88], [100.12, 9.88],
+                              [100.33, 9.61]])]
+        coordinates, offsets = pack_geometry(lines)
+        start, end, parent, values = sample_raster_along_lines(R,
+                                                               coordinates,
+                                                               offsets)
+
+        assert numpy.allclose(values[parent == 0],
+                              [0, 1, 2, 3, 4, 4, 44, numpy.nan, 124, 164],
+                              equal_nan=True)
+        assert numpy.allclose(start[parent == 0][:, 0],
+                              [100.05, 100.1, 100.2, 100.3, 100.4,
+                               100.45, 100.45, 100.45, 100.45, 100.45])
+
+        # Part outside grid has no value
+        assert numpy.allclose(values[parent == 1],
+                              [numpy.nan, 360, 361, 362], equal_nan=True)
+
+        assert numpy.sum(parent == 2) == 0
+        assert numpy.sum(parent == 3) == 0
+        assert numpy.allclose(values[parent == 4], [41, 81, 82, 122, 123])
+
+        # Pieces add up to the lines
+        length = numpy.sqrt(numpy.sum((end - start) ** 2, axis=1))
+        for i, line in enumerate(lines):
+            d = numpy.diff(line, axis=0)
+            ref = numpy.sum(numpy.sqrt(numpy.sum(d ** 2, axis=1)))
+            assert numpy.allclose(numpy.sum(length[parent == i]), ref)
+
+        # Pieces of each line are connected
+        I = parent[1:] == parent[:-1]
+        assert numpy.all(end[:-1][I] == start[1:][I])
+
+        # Merge pieces into sub-lines of the same class
+        classes = (values > 50).astype('i4')
+        coordinates, offsets, runs = merge_line_pieces(start, end, parent,
+                                                       classes)
+        assert numpy.allclose(parent[runs], [0, 0, 1, 1, 4, 4])
+        assert numpy.allclose(classes[runs], [0, 1, 0, 1, 0, 1])
+        assert numpy.allclose(offsets, [0, 9, 12, 14, 18, 20, 25])
+        assert numpy.allclose(coordinates[:9],
+                              [[100.05, 9.95], [100.1, 9.95], [100.2, 9.95],
+                               [100.3, 9.95], [100.4, 9.95], [100.45, 9.95],
+                               [100.45, 9.9], [100.45, 9.8], [100.45, 9.7]])
+        assert numpy.allclose(coordinates[9:12],
+                              [[100.45, 9.7], [100.45, 9.6], [100.45, 9.55]])
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_line_sampling, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,126 @@
+import unittest
+import numpy
+
+from impact.plugins.mappings import osm2padang, osm2bnpb
+from impact.plugins.mappings import sigab2padang, sigab2bnpb
+from impact.plugins.mappings import unspecific2bnpb
+from impact.plugins.mappings import encode_categories
+from impact.plugins.mappings import mapping_cache
+from impact.plugins.mappings import get_checksum, get_mapping
+from impact.storage.vector import Vector
+from impact.storage.projection import DEFAULT_PROJECTION
+
+
+def make_points(data):
+    """Create point layer with given attribute columns
+    """
+
+    N = len(data.values()[0])
+    geometry = numpy.zeros((N, 2))
+    geometry[:, 0] = 100 + numpy.arange(N) / 100.0
+    geometry[:, 1] = -6
+    return Vector(data=data, projection=DEFAULT_PROJECTION,
+                  geometry=geometry, name='buildings')
+
+
+class Test_mappings(unittest.TestCase):
+
+    def test_categories(self):
+        """Attribute values are encoded as categories
+        """
+
+        column = numpy.array(['b', 'a', None, 'b', 'a', 'c'], dtype=object)
+        values, codes = encode_categories(column)
+        assert values == ['b', 'a', None, 'c']
+        assert numpy.all(codes == [0, 1, 2, 0, 1, 3])
+
+    def test_osm_mappings(self):
+        """OSM attributes are mapped to vulnerability classes
+        """
+
+        levels = [None, 1, 2, 0, 3, 4, 9, 10, 15, 2, 3, 1]
+        structure = ['plastered', None, 'reinforced_masonry', 'brick',
+                     'confined_masonry', 'wood', 'brick', 'brick',
+                     'wood', 'kayu', 'unreinforced_masonry',
+                     'reinforced masonry']
+        E = make_points({'levels': levels, 'structure': structure,
+                         'id': range(len(levels))})
+
+        V = osm2padang(E)
+        assert numpy.all(V.get_data('VCLASS') ==
+                         [2, 2, 7, 2, 8, 4, 4, 6, 6, 9, 2, 7])
+        assert V.get_name() == ('buildings mapped to Padang '
+                                'vulnerability classes')
+        assert numpy.all(V.get_data('id') == E.get_data('id'))
+        assert numpy.all(V.get_geometry() == E.get_geometry())
+
+        V = osm2bnpb(E, target_attribute='CLASS')
+        assert V.get_data('CLASS').tolist() == ['URM', 'URM', 'RM', 'URM',
+                                                'RM', 'RM', 'RM', 'RM',
+                                                'RM', 'RM', 'URM', 'RM']
+        V = unspecific2bnpb(E)
+        assert V.get_data('VCLASS').tolist() == ['URM'] * len(levels)
+
+        # Mapping the same attributes again reuses the classes
+        classes = osm2padang(E).get_data('VCLASS')
+        assert numpy.all(mapping_cache[0][2] == classes)
+        F = make_points({'levels': levels, 'structure': structure})
+        cached = osm2padang(F).get_data('VCLASS')
+        assert numpy.all(cached == classes)
+
+        # Layers do not share classes with the cache
+        assert not numpy.may_share_memory(cached, classes)
+        assert not numpy.may_share_memory(cached, mapping_cache[0][2])
+
+        # Values with the same hash are told apart
+        assert hash(-1) == hash(-2)
+        F = make_points({'levels': [-1, None], 'structure': ['wood'] * 2})
+        G = make_points({'levels': [-2, None], 'structure': ['wood'] * 2})
+        assert get_checksum([F.get_data('levels')]) == \
+            get_checksum([G.get_data('levels')])
+        calls = []
+
+        def function(levels):
+            calls.append(levels)
+            return numpy.zeros(len(levels))
+
+        get_mapping('test', [F.get_data('levels')], function)
+        get_mapping('test', [G.get_data('levels')], function)
+        get_mapping('test', [F.get_data('levels')], function)
+        assert len(calls) == 2
+
+        # but not if attributes differ
+        levels[0] = 12
+        F = make_points({'levels': levels, 'structure': structure})
+        assert osm2padang(F).get_data('VCLASS')[0] == 6
+
+        # Levels between 0 and 1 are not known
+        levels[0] = 0.5
+        F = make_points({'levels': levels, 'structure': structure})
+        self.assertRaises(Exception, osm2padang, F)
+
+    def test_sigab_mappings(self):
+        """SIGAB attributes are mapped to vulnerability classes
+        """
+
+        levels = ['1', '2', 'None', '1', '1', '1', '1', '3', '1']
+        structure = ['Beton Bertulang', 'Tembok', 'Beton', 'Rangka Baja',
+                     'Kayu', 'Tembok', 'none', 'Kayu', 'Beton']
+        N = len(levels)
+        E = make_points({'Tingkat': levels, 'Struktur_B': structure,
+                         'Lantai': ['Keramik'] * N, 'Atap': ['Genteng'] * N,
+                         'Dinding': ['Tembok'] * N})
+
+        V = sigab2padang(E)
+        assert numpy.all(V.get_data('VCLASS') ==
+                         [6, 7, 2, 8, 9, 2, 2, 7, 2])
+
+        V = sigab2bnpb(E)
+        assert V.get_data('VCLASS').tolist() == ['RM', 'RM', 'URM', 'URM',
+                                                 'RM', 'URM', 'URM', 'RM',
+                                                 'RM']
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_mappings, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -13,6 +13,14 @@ from impact.plugins.core import requirement_check
 from impact.plugins.core import requirements_met
 from impact.plugins.core import get_plugins
 from impact.plugins.core import compatible_layers
+from impact.plugins.utilities import lognormal_cdf
+from impact.plugins.utilities import lognormal_fragility
+from impact.plugins.utilities import Fragility_table
+from impact.plugins.utilities import Damage_curve
+from impact.plugins.earthquake import padang_building_impact_model
+from impact.storage.raster import Raster
+from impact.storage.vector import Vector
+from impact.storage.projection import DEFAULT_PROJECTION
 
 
 class BasicFunction(FunctionProvider):
@@ -90,6 +98,144 @@ class Test_plugin_core(unittest.TestCase):
         msg = 'Reserved keyword in statement (logged)'
         assert requirement_check(params, line) == False, msg
 
+    def test_lognormal_fragility(self):
+        """Lognormal fragility curves are evaluated for all features
+        """
+
+        import scipy.stats
+
+        x = numpy.array([-1.0, 0.0, 6.5, 7.5, 8.0, 9.3, 12.0, numpy.nan])
+        P = lognormal_cdf(x, 7.5, 0.11)
+        ref = scipy.stats.lognorm.cdf(x, 0.11, scale=7.5)
+        assert numpy.allclose(P[:-1], ref[:-1], rtol=1.0e-12, atol=0)
+        assert numpy.allclose(P[3], 0.5)
+        assert P[0] == 0 and P[1] == 0
+        assert numpy.isnan(P[-1])
+
+        # Parameters are taken from the curve of each class
+        curves = {'1': dict(median=7.5, beta=0.11),
+                  '2': dict(median=8.3, beta=0.1)}
+        classes = numpy.array([2.0, 1.0, 1.0, 2.0, 2.0, 1.0, 2.0, 1.0])
+        P = lognormal_fragility(x, classes, curves,
+                                key=lambda c: str(int(c)))
+        for i in range(len(x) - 1):
+            params = curves[str(int(classes[i]))]
+            ref = scipy.stats.lognorm.cdf(x[i], params['beta'],
+                                          scale=params['median'])
+            assert numpy.allclose(P[i], ref, rtol=1.0e-12, atol=0)
+
+        # Unknown classes are reported
+        classes[0] = 3
+        self.assertRaises(AssertionError, lognormal_fragility,
+                          x, classes, curves, key=lambda c: str(int(c)))
+
+    def test_fragility_table(self):
+        """Fragility table lookup agrees with exact curves
+        """
+
+        curves = {'URM': dict(median=7.5, beta=0.11),
+                  'RM': dict(median=8.4, beta=0.05),
+                  'Timber': Damage_curve([[-1.0e10, 0.0], [6.0, 0.0],
+                                          [7.0, 0.2], [9.0, 0.9],
+                                          [1.0e10, 1.0]])}
+        T = Fragility_table(curves, minimum=0.0, maximum=12.0, step=0.001)
+        assert 0 < T.error_bound < 1.0e-6
+
+        numpy.random.seed(13)
+        N = 10000
+        x = numpy.random.uniform(-1, 14, N)
+        x[::97] = numpy.nan
+        x[:5] = [0.0, 12.0, 7.0, 6.5, 5.0]
+        classes = numpy.random.permutation(['URM', 'RM', 'Timber'] * N)[:N]
+
+        P = T(x, classes)
+        E = T(x, classes, mode='exact')
+        assert numpy.all(numpy.isnan(P) == numpy.isnan(x))
+        assert numpy.all(numpy.isnan(E) == numpy.isnan(x))
+
+        I = numpy.logical_not(numpy.isnan(x))
+        assert numpy.max(numpy.abs(P[I] - E[I])) <= T.error_bound + 1.0e-15
+
+        # Levels outside table are exact
+        J = I & ((x < 0) | (x > 12))
+        assert numpy.sum(J) > 0
+        assert numpy.all(P[J] == E[J])
+
+        # Exact mode is the same as evaluating each curve
+        for label in curves:
+            K = I & (classes == label)
+            if label == 'Timber':
+                ref = curves[label](x[K])
+            else:
+                ref = lognormal_cdf(x[K], curves[label]['median'],
+                                    curves[label]['beta'])
+            assert numpy.allclose(E[K], ref, rtol=1.0e-12, atol=0)
+
+        # Class labels can be mapped to curves
+        P = T(x, numpy.where(classes == 'RM', 1, 2),
+              key=lambda c: ['RM', 'URM'][c - 1])
+        K = I & (classes != 'Timber')
+        assert numpy.allclose(P[K], E[K], rtol=0, atol=T.error_bound)
+
+    def test_fragility_table_error_bound(self):
+        """Fragility table error bound holds for kinks between levels
+        """
+
+        # Kink a quarter step into the first interval of the table
+        curve = Damage_curve([[-10.0, 0.0], [0.0, 0.0], [0.25, 0.75],
+                              [1.0, 1.0], [10.0, 1.0]])
+        T = Fragility_table({'A': curve}, minimum=0.0, maximum=2.0,
+                            step=1.0)
+
+        x = numpy.linspace(-0.5, 2.5, 3001)
+        P = T(x, ['A'] * len(x))
+        E = T(x, ['A'] * len(x), mode='exact')
+        error = numpy.max(numpy.abs(P - E))
+        assert numpy.allclose(error, 0.5, rtol=1.0e-12, atol=0)
+        assert error <= T.error_bound + 1.0e-15
+
+    def test_padang_fragility_mode(self):
+        """Padang building damage can use table lookup of damage curves
+        """
+
+        # Ground shaking from MMI 6 to 11 across the grid
+        geotransform = (100.0, 0.01, 0, 1.0, 0, -0.01)
+        mmi = numpy.ones((100, 1)) * numpy.linspace(6, 11, 100)
+        H = Raster(mmi, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform,
+                   keywords={'category': 'hazard', 'unit': 'MMI'})
+
+        numpy.random.seed(17)
+        N = 1000
+        coordinates = numpy.zeros((N, 2))
+        coordinates[:, 0] = numpy.random.uniform(100.01, 100.98, N)
+        coordinates[:, 1] = numpy.random.uniform(0.02, 0.98, N)
+        E = Vector(data={'TestBLDGCl': numpy.random.randint(1, 10, N)},
+                   projection=DEFAULT_PROJECTION, geometry=coordinates,
+                   keywords={'category': 'exposure', 'datatype': 'itb'})
+
+        model = padang_building_impact_model
+        F = model.PadangEarthquakeBuildingDamageFunction()
+        assert F.fragility_mode == 'exact'
+        R = F.run([H, E])
+        exact = R.get_data(F.target_field)
+
+        F.fragility_mode = 'table'
+        table = F.run([H, E]).get_data(F.target_field)
+
+        # Exact mode is the lognormal fragility of each class
+        ref = lognormal_fragility(R.get_data('MMI'), R.get_data('TestBLDGCl'),
+                                  model.damage_curves,
+                                  key=lambda c: str(int(c))) * 100
+        assert numpy.all(numpy.isfinite(exact))
+        assert numpy.allclose(exact, ref, rtol=1.0e-12, atol=0)
+
+        # Table lookup agrees with the curves within its error bound
+        error_bound = model.damage_table.error_bound * 100
+        assert 0 < error_bound < 1.0e-4
+        assert numpy.max(numpy.abs(table - exact)) > 0
+        assert numpy.allclose(table, exact, rtol=0, atol=error_bound)
+
 if __name__ == '__main__':
     os.environ['DJANGO_SETTINGS_MODULE'] = 'risiko.settings'
     suite = unittest.makeSuite(Test_plugin_core, 'test')
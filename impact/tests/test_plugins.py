@@ -30,6 +30,7 @@ from django.utils import simplejson as json
 from geonode.maps.utils import get_valid_user
 
 from impact.tests.utilities import TESTDATA, INTERNAL_SERVER_URL
+from impact.tests.utilities import calculate_via_api
 
 DEFAULT_PLUGINS = ('Earthquake Fatality Function',)
 
@@ -323,7 +324,7 @@ class Test_plugins(unittest.TestCase):
                 warnings.simplefilter('ignore')
 
                 c = Client()
-                rv = c.post('/impact/api/calculate/', data=dict(
+                rv = calculate_via_api(c, data=dict(
                             hazard_server=INTERNAL_SERVER_URL,
                             hazard=hazard_name,
                             exposure_server=INTERNAL_SERVER_URL,
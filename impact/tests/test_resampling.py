@@ -0,0 +1,199 @@
+import unittest
+import numpy
+
+from impact.engine.resampling import resample_raster
+from impact.engine.interpolation2d import interpolate_raster
+from impact.storage.raster import Raster
+from impact.storage.projection import DEFAULT_PROJECTION
+from impact.storage.utilities import nanallclose
+
+
+def linear_function(x, y):
+    """Auxiliary function for use with resampling test
+    """
+
+    return x + y / 2.0
+
+
+def make_raster(A, geotransform, name='Test raster', keywords=None):
+    """Create raster layer in memory from array and geotransform
+    """
+
+    return Raster(A, projection=DEFAULT_PROJECTION,
+                  geotransform=geotransform, name=name, keywords=keywords)
+
+
+def pixel_centres(geotransform, columns, rows):
+    """Coordinates of pixel centres (x along rows, y down columns)
+    """
+
+    x = geotransform[0] + (numpy.arange(columns) + 0.5) * geotransform[1]
+    y = geotransform[3] + (numpy.arange(rows) + 0.5) * geotransform[5]
+    return numpy.meshgrid(x, y)
+
+
+class Test_resampling(unittest.TestCase):
+
+    def test_linear_resampling(self):
+        """Bilinear resampling reproduces linear function
+        """
+
+        geotransform = (100.0, 0.5, 0, 10.0, 0, -0.25)
+        x, y = pixel_centres(geotransform, 20, 30)
+        A = linear_function(x, y)
+        R = make_raster(A, geotransform)
+
+        # Finer, shifted grid extending beyond R. Pixel centres are
+        # never half way between source pixel centres to avoid ties.
+        target = (99.7, 0.2, 0, 10.33, 0, -0.1)
+        columns, rows = 55, 85
+        B = resample_raster(R, target, columns, rows, mode='linear')
+        assert B.shape == (rows, columns)
+
+        tx, ty = pixel_centres(target, columns, rows)
+        ref = linear_function(tx, ty)
+
+        # Pixels outside the hull of source pixel centres are NaN
+        outside = ((tx < x[0, 0]) | (tx > x[0, -1]) |
+                   (ty > y[0, 0]) | (ty < y[-1, 0]))
+        assert numpy.all(numpy.isnan(B[outside]))
+        assert not numpy.any(numpy.isnan(B[numpy.logical_not(outside)]))
+        ref[outside] = numpy.nan
+        assert nanallclose(B, ref, rtol=1.0e-12, atol=1.0e-12)
+
+        # Same as interpolation to target pixel centres
+        longitudes = x[0, :]
+        latitudes = y[::-1, 0]
+        points = numpy.zeros((rows * columns, 2))
+        points[:, 0] = tx.flat
+        points[:, 1] = ty.flat
+        for mode in ['linear', 'constant']:
+            B = resample_raster(R, target, columns, rows, mode=mode)
+            ref = interpolate_raster(longitudes, latitudes, A, points,
+                                     mode=mode)
+            assert nanallclose(B.flat, ref, rtol=1.0e-12, atol=1.0e-12)
+
+        # Missing values propagate
+        A[10, 5] = numpy.nan
+        R = make_raster(A, geotransform)
+        B = resample_raster(R, target, columns, rows, mode='linear')
+        I = ((numpy.abs(tx - x[10, 5]) < 0.5) &
+             (numpy.abs(ty - y[10, 5]) < 0.25))
+        assert numpy.all(numpy.isnan(B[I]))
+
+    def test_nearest_neighbour_resampling(self):
+        """Nearest neighbour resampling to aligned subgrid copies data
+        """
+
+        geotransform = (100.0, 0.5, 0, 10.0, 0, -0.5)
+        A = numpy.random.random((12, 16))
+        R = make_raster(A, geotransform)
+
+        target = (101.0, 0.5, 0, 9.0, 0, -0.5)
+        B = resample_raster(R, target, 10, 6, mode='constant')
+        assert numpy.allclose(B, A[2:8, 2:12])
+
+        # Bilinear interpolation on the same grid is the identity
+        B = resample_raster(R, target, 10, 6, mode='linear')
+        assert numpy.allclose(B, A[2:8, 2:12], rtol=1.0e-12, atol=1.0e-12)
+
+    def test_sum_and_average_resampling(self):
+        """Area weighted resampling conserves totals and averages
+        """
+
+        geotransform = (100.0, 0.1, 0, 10.0, 0, -0.1)
+        A = numpy.random.random((40, 30))
+        R = make_raster(A, geotransform)
+
+        # Coarser grid covering R with pixels not aligned with those of R
+        target = (99.95, 0.35, 0, 10.05, 0, -0.3)
+        columns, rows = 10, 15
+        S = resample_raster(R, target, columns, rows, mode='sum')
+        assert S.shape == (rows, columns)
+        assert numpy.allclose(numpy.nansum(S), numpy.sum(A))
+
+        # Sums over target pixels that lie entirely inside R
+        # are 3.5 x 3 source pixels worth of data
+        B = resample_raster(make_raster(numpy.ones(A.shape), geotransform),
+                            target, columns, rows, mode='sum')
+        assert numpy.allclose(B[1:-2, 1:-2], 10.5)
+        assert numpy.all(numpy.isnan(B[-1, :]))
+
+        # Average of constant field is constant where data is available
+        B = resample_raster(make_raster(numpy.ones(A.shape) * 3,
+                                        geotransform),
+                            target, columns, rows, mode='average')
+        assert numpy.allclose(B[:-2, :-1], 3)
+        assert numpy.all(numpy.isnan(B[-1, :]))
+
+        # Missing values are left out
+        A[:20, :] = numpy.nan
+        R = make_raster(A, geotransform)
+        S = resample_raster(R, target, columns, rows, mode='sum')
+        assert numpy.allclose(numpy.nansum(S), numpy.nansum(A))
+
+        # Resampling in several bands of rows gives the same result
+        import impact.engine.resampling as resampling
+        block_size = resampling.BLOCK_SIZE
+        try:
+            resampling.BLOCK_SIZE = 2 * columns
+            for mode in ['sum', 'average', 'linear']:
+                B = resample_raster(R, target, columns, rows, mode=mode)
+                resampling.BLOCK_SIZE = block_size
+                ref = resample_raster(R, target, columns, rows, mode=mode)
+                resampling.BLOCK_SIZE = 2 * columns
+                assert nanallclose(B, ref, rtol=1.0e-12, atol=1.0e-12)
+        finally:
+            resampling.BLOCK_SIZE = block_size
+
+    def test_raster_interpolation_between_grids(self):
+        """Raster layers can be interpolated to other grids
+        """
+
+        geotransform = (100.0, 0.1, 0, 10.0, 0, -0.1)
+        A = numpy.ones((40, 30))
+        A[5, 5] = -9999
+        keywords = {'category': 'exposure', 'density': 'true',
+                    'resolution': '0.05'}
+        R = make_raster(A, geotransform, name='population',
+                        keywords=keywords)
+
+        # Aligned layers are returned as they are
+        assert R.interpolate(R) is R
+
+        target = make_raster(numpy.zeros((20, 15)),
+                             (100.0, 0.2, 0, 10.0, 0, -0.2))
+
+        # Averages keep the keywords so density scaling still applies
+        I = R.interpolate(target, name='average', mode='average')
+        assert I.get_name() == 'average'
+        assert I.get_geotransform() == target.get_geotransform()
+        assert I.get_keywords() == keywords
+        assert numpy.allclose(I.get_data(scaling=False), 1)
+        assert numpy.allclose(I.get_data(), 16)
+
+        # Sums are totals for the target pixels. Source data is scaled
+        # to the actual resolution of R first.
+        I = R.interpolate(target, mode='sum')
+        assert I.get_name() == 'population'
+        assert 'resolution' not in I.get_keywords()
+        assert 'resolution' in R.get_keywords()
+        total = numpy.sum(R.get_data(nan=0))
+        assert numpy.allclose(numpy.sum(I.get_data()), total)
+        assert numpy.allclose(I.get_data()[2, 3], 4 * 4)
+
+        # One of the source pixels in this one is nodata
+        assert numpy.allclose(I.get_data()[2, 2], 4 * 3)
+
+        # Pixels without data are stored as nodata
+        target = make_raster(numpy.zeros((10, 15)),
+                             (99.0, 0.2, 0, 10.0, 0, -0.2))
+        I = R.interpolate(target)
+        A = I.get_data(nan=False, scaling=False)
+        assert numpy.all(A[:, :5] == -9999)
+        assert numpy.all(numpy.isnan(I.get_data()[:, :5]))
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_resampling, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
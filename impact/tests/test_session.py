@@ -0,0 +1,214 @@
+import os
+import time
+import socket
+import unittest
+
+from impact.storage.session import Session
+from impact.tests.utilities import LocalHandler, LocalServer
+
+
+class Handler(LocalHandler):
+    """Request handler of test server
+
+    Paths select the behaviour:
+        /close: Close connection after response without telling client
+        /slow: Wait half a second before responding
+        /error: Respond with status 500 and a body
+        /redirect: Redirect to /data
+        /loop: Redirect to itself
+    HEAD requests get status 405.
+    """
+
+    def do_HEAD(self):
+        self.send_body(405, '')
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+
+        if self.path == '/redirect':
+            self.send_body(302, 'Moved', {'Location': '/data'})
+            return
+
+        if self.path == '/loop':
+            self.send_body(302, 'Moved',
+                           {'Location': self.server.url('/loop')})
+            return
+
+        if self.path == '/error':
+            status = 500
+        else:
+            status = 200
+        self.send_body(status, 'x' * 100000)
+
+        if self.path == '/close':
+            self.close_connection = 1
+
+
+def free_slots(session, server):
+    """Count free connection slots of session to server
+    """
+
+    slot = session.slots[('http', '127.0.0.1:%i' % server.server_port)]
+    count = 0
+    while slot.acquire(False):
+        count += 1
+    for i in range(count):
+        slot.release()
+    return count
+
+
+class Test_session(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer(Handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_keep_alive(self):
+        """Connections are reused for consecutive requests
+        """
+
+        session = Session(pool_size=2)
+        for i in range(5):
+            f = session.request('GET', self.server.url('/data'))
+            assert f.status == 200
+            assert len(f.read()) == 100000
+
+        assert len(self.server.requests) == 5
+        assert len(self.server.connections) == 1
+        assert free_slots(session, self.server) == 2
+        session.close()
+
+    def test_stale_connection(self):
+        """Requests on connections closed while idle are retried
+        """
+
+        session = Session(pool_size=1, retries=1)
+        f = session.request('GET', self.server.url('/close'))
+        assert len(f.read()) == 100000
+
+        # Server has closed the pooled connection by now
+        time.sleep(0.1)
+        f = session.request('GET', self.server.url('/data'))
+        assert f.status == 200
+        assert len(f.read()) == 100000
+
+        assert self.server.requests == ['/close', '/data']
+        assert len(self.server.connections) == 2
+        assert free_slots(session, self.server) == 1
+
+    def test_slot_release(self):
+        """Slots are freed by unread, errored and failed responses
+        """
+
+        session = Session(pool_size=1, retries=0)
+
+        # Response closed without reading its body
+        f = session.request('GET', self.server.url('/data'))
+        assert f.read(10) == 'x' * 10
+        assert free_slots(session, self.server) == 0
+        f.close()
+        assert free_slots(session, self.server) == 1
+
+        # Error response read to the end keeps its connection
+        f = session.request('GET', self.server.url('/error'))
+        assert f.status == 500
+        assert len(f.read()) == 100000
+        assert f.read() == ''
+        assert free_slots(session, self.server) == 1
+
+        # Request that times out
+        try:
+            session.request('GET', self.server.url('/slow'), timeout=0.1)
+        except socket.timeout:
+            pass
+        else:
+            msg = 'Should have raised socket.timeout'
+            raise Exception(msg)
+        assert free_slots(session, self.server) == 1
+
+        # Pool of one connection is still usable
+        f = session.request('GET', self.server.url('/data'))
+        assert len(f.read()) == 100000
+        assert free_slots(session, self.server) == 1
+
+    def test_head_not_allowed(self):
+        """HEAD requests answered by 405 free their connection at once
+        """
+
+        session = Session(pool_size=1)
+        f = session.request('HEAD', self.server.url('/ows'))
+        assert f.status == 405
+        assert free_slots(session, self.server) == 1
+
+        f = session.request('GET', self.server.url('/data'))
+        assert len(f.read()) == 100000
+        assert len(self.server.connections) == 1
+
+    def test_timeouts(self):
+        """Timeouts can be set per request and are not retried
+        """
+
+        session = Session(timeout=0.1, retries=2)
+        try:
+            session.request('GET', self.server.url('/slow'))
+        except socket.timeout:
+            pass
+        else:
+            msg = 'Should have raised socket.timeout'
+            raise Exception(msg)
+        assert self.server.requests == ['/slow']
+
+        f = session.request('GET', self.server.url('/slow'), timeout=5)
+        assert len(f.read()) == 100000
+
+    def test_redirects(self):
+        """Redirects are followed a limited number of times
+        """
+
+        session = Session(pool_size=1, max_redirects=3)
+        f = session.request('GET', self.server.url('/redirect'))
+        assert f.status == 200
+        assert len(f.read()) == 100000
+        assert self.server.requests == ['/redirect', '/data']
+        assert len(self.server.connections) == 1
+
+        # Last redirect is returned when there are too many
+        self.server.requests = []
+        f = session.request('GET', self.server.url('/loop'))
+        assert f.status == 302
+        assert f.read() == 'Moved'
+        assert self.server.requests == ['/loop'] * 4
+        assert free_slots(session, self.server) == 1
+
+    def test_proxy(self):
+        """Requests are sent through proxies from the environment
+        """
+
+        session = Session(pool_size=1)
+        session.proxies = {'http': self.server.url('')}
+        f = session.request('GET', 'http://example.invalid/data?x=1')
+        assert f.status == 200
+        assert len(f.read()) == 100000
+        assert self.server.requests == ['http://example.invalid/data?x=1']
+
+        # Hosts listed in no_proxy are reached directly
+        no_proxy = os.environ.get('no_proxy')
+        os.environ['no_proxy'] = 'example.invalid,127.0.0.1'
+        try:
+            f = session.request('GET', self.server.url('/data'))
+            f.read()
+        finally:
+            if no_proxy is None:
+                del os.environ['no_proxy']
+            else:
+                os.environ['no_proxy'] = no_proxy
+        assert self.server.requests[-1] == '/data'
+
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_session, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
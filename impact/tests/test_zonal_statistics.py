@@ -0,0 +1,155 @@
+import unittest
+import numpy
+
+from impact.engine.zonal_statistics import rasterize_polygons
+from impact.engine.zonal_statistics import zonal_statistics
+from impact.storage.raster import Raster
+from impact.storage.vector import Vector
+from impact.storage.projection import DEFAULT_PROJECTION
+from impact.storage.utilities import pack_geometry
+from impact.storage.utilities import nanallclose
+
+
+def inside_polygon(x, y, polygon):
+    """Test whether points lie inside polygon using even-odd rule
+
+    Reference implementation testing one edge at a time.
+    """
+
+    inside = numpy.zeros(len(x), dtype=bool)
+    N = len(polygon)
+    for i in range(N):
+        x0, y0 = polygon[i]
+        x1, y1 = polygon[(i + 1) % N]
+        if y0 == y1:
+            continue
+
+        crossing = (numpy.minimum(y0, y1) <= y) & (y < numpy.maximum(y0, y1))
+        xc = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crossing & (x < xc)
+
+    return inside
+
+
+class Test_zonal_statistics(unittest.TestCase):
+
+    def test_rasterize_polygons(self):
+        """Pixels whose centres lie inside polygons are found
+        """
+
+        geotransform = (100.0, 0.1, 0, 10.0, 0, -0.1)
+        columns, rows = 40, 30
+        x = 100.05 + 0.1 * numpy.arange(columns)
+        y = 9.95 - 0.1 * numpy.arange(rows)
+        X, Y = numpy.meshgrid(x, y)
+
+        # Square, triangle, star shaped and overlapping polygons as well
+        # as polygons partly or entirely outside grid
+        polygons = [[[100.52, 9.48], [101.01, 9.48], [101.01, 8.87],
+                     [100.52, 8.87], [100.52, 9.48]],
+                    [[101.5, 9.9], [103.7, 9.2], [102.3, 7.4]],
+                    [[100.51, 8.53], [102.02, 8.21], [100.83, 7.04],
+                     [101.52, 8.01], [100.23, 7.32]],
+                    [[101.0, 9.0], [102.5, 9.0], [102.5, 8.0], [101.0, 8.0]],
+                    [[99.0, 8.0], [100.35, 8.0], [100.35, 7.0], [99.0, 7.0]],
+                    [[90.0, 8.0], [91.0, 8.0], [91.0, 7.0]]]
+
+        numpy.random.seed(17)
+        for i in range(10):
+            # Random star shaped polygons
+            angles = numpy.sort(numpy.random.uniform(0, 2 * numpy.pi, 12))
+            radii = numpy.random.uniform(0.1, 1.0, 12)
+            centre = numpy.random.uniform([100.5, 7.5], [103.5, 9.5])
+            P = numpy.zeros((12, 2))
+            P[:, 0] = centre[0] + radii * numpy.cos(angles)
+            P[:, 1] = centre[1] + radii * numpy.sin(angles)
+            polygons.append(P)
+
+        coordinates, offsets = pack_geometry(polygons)
+        labels, I, J = rasterize_polygons(coordinates, offsets,
+                                          geotransform, columns, rows)
+
+        assert numpy.all(numpy.diff(labels) >= 0)
+        for i, P in enumerate(polygons):
+            ref = inside_polygon(X.ravel(), Y.ravel(), numpy.array(P))
+            ref = ref.reshape(X.shape)
+
+            mask = numpy.zeros(X.shape, dtype=bool)
+            K = labels == i
+            mask[I[K], J[K]] = True
+
+            # No pixel is listed twice for the same polygon
+            assert numpy.sum(K) == numpy.sum(mask)
+            assert numpy.all(mask == ref)
+
+        # Square covers 5 x 6 pixels and last polygon is outside
+        assert numpy.sum(labels == 0) == 30
+        assert numpy.sum(labels == 5) == 0
+
+    def test_zonal_statistics(self):
+        """Statistics of raster data over polygons are correct
+        """
+
+        geotransform = (100.0, 0.1, 0, 10.0, 0, -0.1)
+        A = numpy.arange(30 * 40, dtype='d').reshape((30, 40))
+        A[10, 10] = numpy.nan
+        R = Raster(A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform, name='data')
+
+        polygons = [[[100.5, 9.5], [101.0, 9.5], [101.0, 8.9], [100.5, 8.9]],
+                    [[100.9, 9.1], [101.2, 9.1], [101.2, 8.8], [100.9, 8.8]],
+                    [[101.31, 9.41], [101.34, 9.41], [101.34, 9.44],
+                     [101.31, 9.44], [101.31, 9.41]],
+                    [[90.0, 8.0], [91.0, 8.0], [91.0, 7.0]],
+                    [[101.01, 8.99], [101.09, 8.99], [101.09, 8.91],
+                     [101.01, 8.91]]]
+        coordinates, offsets = pack_geometry(polygons)
+
+        # Pixels of first polygon are rows 5 to 10 and columns 5 to 9
+        B = A[5:11, 5:10]
+        values = zonal_statistics(R, coordinates, offsets, mode='sum')
+        assert numpy.allclose(values[0], numpy.sum(B))
+
+        # Second polygon contains 3 x 3 pixels one of which is missing
+        C = A[9:12, 9:12]
+        I = numpy.logical_not(numpy.isnan(C))
+        assert numpy.allclose(values[1], numpy.sum(C[I]))
+
+        # Third polygon is smaller than a pixel and covers 9 percent
+        # of pixel (5, 13)
+        assert numpy.allclose(values[2], 0.09 * A[5, 13])
+
+        # Polygon outside raster and polygon within missing pixel
+        assert numpy.isnan(values[3])
+        assert numpy.isnan(values[4])
+
+        values = zonal_statistics(R, coordinates, offsets, mode='average')
+        assert numpy.allclose(values[0], numpy.mean(B))
+        assert numpy.allclose(values[1], numpy.mean(C[I]))
+        assert numpy.allclose(values[2], A[5, 13])
+        assert numpy.isnan(values[3])
+
+        values = zonal_statistics(R, coordinates, offsets, mode='max')
+        assert numpy.allclose(values[0], numpy.max(B))
+        assert numpy.allclose(values[1], numpy.max(C[I]))
+        assert numpy.allclose(values[2], A[5, 13])
+        assert numpy.isnan(values[3])
+
+        # Aggregation is available through Raster.interpolate
+        V = Vector(data={'id': range(len(polygons))},
+                   projection=DEFAULT_PROJECTION,
+                   geometry=polygons)
+        I = R.interpolate(V, name='mean', mode='average')
+        assert I.is_polygon_data
+        assert len(I) == len(V)
+        values = zonal_statistics(R, coordinates, offsets, mode='average')
+        assert nanallclose(I.get_data('mean'), values)
+
+        # Interpolation to centroids still works
+        I = R.interpolate(V, name='value')
+        assert I.is_point_data
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(Test_zonal_statistics, 'test')
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
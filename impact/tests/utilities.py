@@ -2,7 +2,11 @@ import os
 import time
 import types
 import numpy
+import threading
+import SocketServer
+import BaseHTTPServer
 from django.conf import settings
+from django.utils import simplejson as json
 from impact.storage.io import download, get_bounding_box, get_metadata
 
 TESTDATA = os.path.join(os.environ['RIAB_HOME'], 'risiko_test_data')
@@ -110,3 +114,115 @@ def combine_coordinates(x, y):
     points = numpy.array(points)
 
     return points
+
+
+def calculate_via_api(client, data, timeout=1200):
+    """Queue calculation through the API and wait for its result
+
+    Input
+        client: Django test client
+        data: Dictionary of POST data for /impact/api/calculate/
+        timeout: Maximal number of seconds to wait for the result
+
+    Output
+        Response from the result endpoint of the calculation
+    """
+
+    rv = client.post('/impact/api/calculate/', data=data)
+    msg = 'Expected status code 202, got %i' % rv.status_code
+    assert rv.status_code == 202, msg
+
+    status = json.loads(rv.content)
+    t0 = time.time()
+    while True:
+        rv = client.get(status['result_url'])
+        if rv.status_code != 202:
+            return rv
+
+        msg = ('Calculation %i did not finish within %i seconds'
+               % (status['id'], timeout))
+        assert time.time() - t0 < timeout, msg
+        time.sleep(0.5)
+
+
+class LocalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Base of request handlers for LocalServer
+
+    Requests are recorded by the server before they are handled and
+    nothing is logged. Subclasses implement do_GET, do_HEAD etc.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def parse_request(self):
+        if not BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self):
+            return False
+
+        self.server.requests.append(self.path)
+        self.server.headers.append(self.headers)
+        self.server.connections.add(self.client_address)
+        return True
+
+    def send_body(self, status, body, headers=None):
+        """Send complete response with given status and body
+
+        Input
+            status: HTTP status code
+            body: String with body of response
+            headers: Optional dictionary of further response headers
+        """
+
+        self.send_response(status)
+        if headers is not None:
+            for name in headers:
+                self.send_header(name, headers[name])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local HTTP server on a free port serving requests in a thread
+
+    Input
+        handler: Subclass of LocalHandler answering the requests
+
+    Attributes
+        requests: Paths of the requests received in order
+        headers: Headers of the requests received in order
+        connections: Set of client addresses that made requests
+
+    Call close when done to stop the server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.requests = []
+        self.headers = []
+        self.connections = set()
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        # Tests break connections on purpose
+        pass
+
+    def url(self, path):
+        """Get URL of path on this server
+        """
+
+        return 'http://127.0.0.1:%i%s' % (self.server_port, path)
+
+    def close(self):
+        """Stop serving and close the listening socket
+        """
+
+        self.shutdown()
+        self.server_close()
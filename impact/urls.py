@@ -8,6 +8,13 @@ urlpatterns = patterns('',
 
 urlpatterns += patterns('impact.views',
                        url(r'^api/calculate/$', 'calculate'),
+                       url(r'^api/calculation/(?P<calculation_id>\d+)/$',
+                           'calculation_status',
+                           name='calculation_status'),
+                       url(r'^api/calculation/(?P<calculation_id>\d+)/'
+                           r'result/$',
+                           'calculation_result',
+                           name='calculation_result'),
                        url(r'^api/layers/$', 'layers'),
                        url(r'^api/functions/$', 'functions'),
                        url(r'^api/debug/$', 'debug'))
@@ -23,45 +23,36 @@ All API calls start with:
 """
 from __future__ import division
 
-import sys
-import inspect
 import datetime
 
 from django.utils import simplejson as json
 from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 
-from impact.storage.io import dummy_save, download
-from impact.storage.io import get_metadata, get_layer_descriptors
-from impact.storage.io import bboxlist2string
-from impact.storage.io import save_to_geonode
+from impact.storage.io import get_layer_descriptors
 from impact.storage.utilities import titelize
-from impact.plugins.core import get_plugin, get_plugins, compatible_layers
-from impact.engine.core import calculate_impact
-from impact.engine.core import get_common_resolution, get_bounding_boxes
-from impact.engine.core import get_linked_layers
+from impact.plugins.core import get_plugins, compatible_layers
 from impact.models import Calculation, Workspace
+from impact.jobs import submit, get_status
 
 from geonode.maps.utils import get_valid_user
 
-from urlparse import urljoin
-
 import logging
 logger = logging.getLogger('risiko')
 
 
-def exception_format(e):
-    """Convert an exception object into a string,
-    complete with stack trace info, suitable for display.
-    """
-    import traceback
-    info = ''.join(traceback.format_tb(sys.exc_info()[2]))
-    return str(e) + '\n\n' + info
+@csrf_exempt
+def calculate(request):
+    """Queue requested calculation
 
+    The calculation is run by a worker (see impact.jobs). The response
+    has status code 202 and contains the id of the calculation together
+    with the urls of its status and result.
+    """
 
-@csrf_exempt
-def calculate(request, save_output=save_to_geonode):
     start = datetime.datetime.now()
 
     if request.method == 'GET':
@@ -91,133 +82,50 @@ def calculate(request, save_output=save_to_geonode):
                               exposure_server=exposure_server,
                               exposure_layer=exposure_layer,
                               impact_function=impact_function_name,
+                              requested_bbox=requested_bbox,
+                              keywords=keywords,
                               success=False)
+    submit(calculation)
 
-    # Wrap main computation loop in try except to catch and present
-    # messages and stack traces in the application
-    try:
-        # Get metadata
-        haz_metadata = get_metadata(hazard_server, hazard_layer)
-        exp_metadata = get_metadata(exposure_server, exposure_layer)
-
-        # Determine common resolution in case of raster layers
-        raster_resolution = get_common_resolution(haz_metadata, exp_metadata)
-
-        # Get reconciled bounding boxes
-        haz_bbox, exp_bbox, imp_bbox = get_bounding_boxes(haz_metadata,
-                                                          exp_metadata,
-                                                          requested_bbox)
-
-        # Record layers to download
-        download_layers = [(exposure_server, exposure_layer,
-                            exp_bbox, exp_metadata),
-                           (hazard_server, hazard_layer,
-                            haz_bbox, haz_metadata)]
-
-        # Add linked layers if any
-        download_layers += get_linked_layers(download_layers)
-
-        # Get selected impact function
-        impact_function = get_plugin(impact_function_name)
-        impact_function_source = inspect.getsource(impact_function)
-
-        # Record information calculation object and save it
-        calculation.impact_function_source = impact_function_source
-        calculation.bbox = bboxlist2string(imp_bbox)
-        calculation.save()
-
-        # Start computation
-        msg = 'Performing requested calculation'
-        logger.info(msg)
-
-        # Download selected layer objects
-        layers = []
-        for server, layer_name, bbox, _ in download_layers:
-            msg = ('- Downloading layer %s from %s with bbox=%s and res=%s'
-                   % (layer_name, server, str(bbox), str(raster_resolution)))
-            logger.info(msg)
-            L = download(server, layer_name, bbox, raster_resolution)
-            layers.append(L)
-
-        # Calculate result using specified impact function
-        msg = ('- Calculating impact using %s' % impact_function)
-        logger.info(msg)
-        impact_filename = calculate_impact(layers=layers,
-                                           impact_fcn=impact_function)
-
-        # Upload result to internal GeoServer
-        msg = ('- Uploading impact layer %s' % impact_filename)
-        logger.info(msg)
-        result = save_output(impact_filename,
-                             title='output_%s' % start.isoformat(),
-                             user=theuser)
-    except Exception, e:
-        # FIXME: Reimplement error saving for calculation.
-        # FIXME (Ole): Why should we reimplement?
-        # This is dangerous. Try to raise an exception
-        # e.g. in get_metadata_from_layer. Things will silently fail.
-        # See issue #170
-
-        logger.error(e)
-        errors = e.__str__()
-        trace = exception_format(e)
-        calculation.errors = errors
-        calculation.stacktrace = trace
-        calculation.save()
-        jsondata = json.dumps({'errors': errors, 'stacktrace': trace})
-        return HttpResponse(jsondata, mimetype='application/json')
-
-    msg = ('- Result available at %s.' % result.get_absolute_url())
-    logger.info(msg)
-
-    calculation.layer = urljoin(settings.SITEURL, result.get_absolute_url())
-    calculation.success = True
-    calculation.save()
-
-    output = calculation.__dict__
-
-    # json.dumps does not like datetime objects,
-    # let's make it a json string ourselves
-    output['run_date'] = 'new Date("%s")' % calculation.run_date
-
-    # FIXME: This should not be needed in an ideal world
-    ows_server_url = settings.GEOSERVER_BASE_URL + 'ows',
-    output['ows_server_url'] = ows_server_url
-
-    # json.dumps does not like django users
-    output['user'] = calculation.user.username
-    downloads = result.download_links()
-    keys = [x[0] for x in downloads]
-    values = [x[2] for x in downloads]
-    download_dict = dict(zip(keys, values))
-    if 'excel' in keys:
-        output['excel'] = download_dict['excel']
-
-    # Keywords do not like caption being there.
-    # FIXME: Do proper parsing, don't assume caption is the only keyword.
-    if 'caption' in result.keywords:
-        caption = result.keywords.split('caption:')[1]
-        # FIXME (Ole): Return underscores to spaces that was put in place
-        # to store it in the first place. See issue #148
-        output['caption'] = caption.replace('_', ' ')
-    else:
-        output['caption'] = 'Calculation finished ' \
-                            'in %s' % calculation.run_duration
+    output = get_status(calculation)
+    output['status_url'] = reverse('calculation_status',
+                                   args=[calculation.id])
+    output['result_url'] = reverse('calculation_result',
+                                   args=[calculation.id])
+    jsondata = json.dumps(output)
+    return HttpResponse(jsondata, mimetype='application/json', status=202)
 
-    # Delete _state and _user_cache item from the dict,
-    # they were created automatically by Django
-    del output['_user_cache']
-    del output['_state']
 
-    # If success == True and errors = '' ...
-    # ... let's make errors=None for backwards compat
-    if output['success'] and len(output['errors']) == 0:
-        output['errors'] = None
+def calculation_status(request, calculation_id):
+    """Get status and progress of a calculation
+    """
 
-    jsondata = json.dumps(output)
+    calculation = get_object_or_404(Calculation, id=calculation_id)
+    jsondata = json.dumps(get_status(calculation))
     return HttpResponse(jsondata, mimetype='application/json')
 
 
+def calculation_result(request, calculation_id):
+    """Get result of a calculation
+
+    This is the same as was returned by the calculate endpoint before
+    calculations were queued: Either the calculation with the url of the
+    impact layer or the errors and stacktrace. While the calculation is
+    queued or running the status is returned with status code 202.
+    """
+
+    calculation = get_object_or_404(Calculation, id=calculation_id)
+    if calculation.status in ['finished', 'failed']:
+        jsondata = calculation.result
+        status = 200
+    else:
+        jsondata = json.dumps(get_status(calculation))
+        status = 202
+
+    return HttpResponse(jsondata, mimetype='application/json',
+                        status=status)
+
+
 def debug(request):
     """Show a list of all the functions"""
     plugin_list = get_plugins()
@@ -335,6 +335,45 @@ AUTH_PROFILE_MODULE = 'maps.Contact'
 REGISTRATION_OPEN = False
 DB_DATASTORE = False
 
+# Maximal number of exposure features (or raster pixels) processed at a
+# time by impact functions that support it. See calculate_impact in
+# impact.engine.core
+RISIKO_CHUNK_SIZE = 100000
+
+# Directory and size in bytes of the cache of downloaded layer files and
+# memory mapped raster data used in calculations.
+# See impact.storage.cache. Set directory to None to disable.
+RISIKO_DOWNLOAD_CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache', 'downloads')
+RISIKO_DOWNLOAD_CACHE_SIZE = 2 * 1024 ** 3
+
+# Maximal number of calculations run at the same time by each web server
+# process. See impact.jobs. Set to 0 to run calculations in the request.
+RISIKO_CALCULATION_WORKERS = 2
+
+# Seconds without heartbeat after which a running calculation is taken to
+# be abandoned by a process that died and is marked as failed.
+# See impact.jobs
+RISIKO_CALCULATION_TIMEOUT = 600
+
+# Seconds that capabilities of OWS servers are reused by get_metadata.
+# See impact.storage.io
+RISIKO_CAPABILITIES_TTL = 300
+
+# Maximal number of concurrent downloads from each OWS server.
+# See download_layers in impact.storage.io
+RISIKO_DOWNLOADS_PER_SERVER = 4
+
+# Connections kept open to each OWS server, seconds before requests time
+# out and number of times requests are retried. See impact.storage.session
+RISIKO_HTTP_POOL_SIZE = 4
+RISIKO_HTTP_TIMEOUT = 60
+RISIKO_HTTP_RETRIES = 2
+
+# Seconds before downloads of layers time out. Servers may take long to
+# produce the data, so this is much longer than RISIKO_HTTP_TIMEOUT.
+# See get_file in impact.storage.io
+RISIKO_DOWNLOAD_TIMEOUT = 3600
+
 # Get rid of a future warning in elemtree:
 import warnings
 try: